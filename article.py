@@ -1,7 +1,49 @@
+import sys
+import discovery
 import utils
 import metadata
+import tagindex
 import logging
-import xml.dom.minidom as minidom
+import xmlbackend
+
+
+def plosImages(doi, hrefs):
+    '''Returns the images of a PLoS article, given its DOI and the
+    xlink:href of each of its graphic and inline-graphic elements, as a list
+    of (address, key, tag, subdirectory, filename) in the order of their
+    names in the ePub. The address is the URL of the image and the key, under
+    which it is cached, is its URI with its representation.'''
+    #This string is invariable in the fetching of PLoS images
+    PLOSSTRING = 'article/fetchObject.action?uri=info%3Adoi%2F'
+    #An example DOI for PLoS is 10.1371/journal.pmed.0010027
+    #Here we parse it into useful strings for URL construction
+    pdoi, jdoi = doi.split('/')  # 10.1371, journal.pmed.0010027
+    _j, jrn_id, art_id = jdoi.split('.')  # journal, pmed, 0010027
+    #A mapping of journal ids to URLs:
+    jids = {'pgen': 'http://www.plosgenetics.org/',
+            'pcbi': 'http://www.ploscompbiol.org/',
+            'ppat': 'http://www.plospathogens.org/',
+            'pntd': 'http://www.plosntds.org/',
+            'pmed': 'http://www.plosmedicine.org/',
+            'pbio': 'http://www.plosbiology.org/',
+            'pone': 'http://www.plosone.org/'}
+    #A mapping of image types to directory names
+    dirs = {'e': 'equations', 'g': 'figures', 't': 'tables'}
+    images = {}
+    for xlink_href in hrefs:
+        tag = xlink_href.split('.')[-1]
+        type = tag[0]  # first character, either e, g, or t
+        if type == 'e':  # the case of an equation
+            representation = 'PNG'
+        else:  # other cases: table and figure
+            representation = 'PNG_L'
+        #Let's compose the address
+        addr_str = '{0}{1}{2}%2Fjournal.{3}.{4}.{5}&representation={6}'
+        addr = addr_str.format(jids[jrn_id], PLOSSTRING, pdoi, jrn_id,
+                               art_id, tag, representation)
+        key = u'{0}?representation={1}'.format(xlink_href, representation)
+        images[addr] = (addr, key, tag, dirs[type], '{0}.png'.format(tag))
+    return sorted(images.values(), key = lambda image: image[3:])
 
 
 class Article(object):
@@ -16,8 +58,15 @@ class Article(object):
     '''
     def __init__(self, xml_file):
         logging.info('Parsing file: {0}'.format(xml_file))
-        doc = minidom.parse(xml_file)
-        self.root_tag = doc.documentElement
+        #The parsed Document is kept so that all later stages (OPSContent,
+        #TocNCX, ContentOPF) may share it instead of parsing the file again.
+        #Stages which must mutate the tree should copy the subtree they need.
+        self.xml_file = xml_file
+        with discovery.openInput(xml_file) as source:
+            self.doc = xmlbackend.parse(source)
+        self.root_tag = self.doc.documentElement
+        #Index the Document by tagName; see the tagindex module
+        self.index = tagindex.TagIndex(self.doc)
         #The potential Attributes of the <article> tag
         #article-type Type of Article
         #dtd-version Version of the Tag Set (DTD)
@@ -57,21 +106,21 @@ class Article(object):
         ###
         #This tag is mandatory, bad input here deserves an error
         try:
-            front_node = self.root_tag.getElementsByTagName('front')[0]
+            front_node = self.index.lookup('front')[0]
         except IndexError:
             msg = '<front> element was not detected in the document'
             logging.critical(msg)
             print(msg)
             sys.exit()
         #These tags are not mandatory, but rather expected...
-        body_node = self.root_tag.getElementsByTagName('body')
-        back_node = self.root_tag.getElementsByTagName('back')
+        body_node = self.index.lookup('body')
+        back_node = self.index.lookup('back')
         #This tag is new to 3.0, I don't know what to expect of it yet
-        floats_group_node = self.root_tag.getElementsByTagName('floats-group')
+        floats_group_node = self.index.lookup('floats-group')
         #These tags are zero or more, and mutually exclusive
-        sub_article_nodes = self.root_tag.getElementsByTagName('sub-article')
+        sub_article_nodes = self.index.lookup('sub-article')
         if not sub_article_nodes:
-            response_nodes = self.root_tag.getElementsByTagName('response')
+            response_nodes = self.index.lookup('response')
         #To make our lives easier (I hope), we can instantiate special classes
         #for Front and Back nodes.
         self.front = Front(front_node)
@@ -120,98 +169,122 @@ class Article(object):
         titlestring = titlestring.replace(u' ', u'-')
         return(titlestring)
 
-    def fetchPLoSImages(self, cache_dir, output_dir, caching):
-        '''Fetch the PLoS images associated with the article.'''
-        import urllib2
+    def plosImages(self):
+        '''Returns the images of the article as plosImages() does'''
+        #We detect all the graphic references in the document
+        graphics = self.index.lookup('graphic')
+        graphics += self.index.lookup('inline-graphic')
+        hrefs = [g.getAttribute('xlink:href') for g in graphics]
+        return plosImages(self.getDOI(), hrefs)
+
+    def fetchPLoSImages(self, cache_dir, epub, caching):
+        '''Fetch the PLoS images associated with the article, writing them
+        into the ePub through epub, an epubwriter. With caching, images are
+        taken from the content-addressed cache in cache_dir/images when
+        present and current, stale ones are downloaded again only if the
+        server has changed them, and the missing ones are downloaded and then
+        cached. Raises downloader.DownloadError if any image could not be
+        downloaded.'''
         import logging
         import os.path
         import shutil
-        from time import sleep
+        import tempfile
+        import cache
+        import downloader
+        from epubwriter import imageName
         
         doi = self.getDOI()
         print('Processing images for {0}...'.format(doi))
         o = doi.split('journal.')[1]
-        img_dir = os.path.join(output_dir, 'OPS', 'images-{0}'.format(o))
-        #Check cache to see if images already have been downloaded
-        cached = False
         p, s = os.path.split(doi)
-        if p == '10.1371':
-            art_cache = os.path.join(cache_dir, 'PLoS', s)
-            art_cache_images = os.path.join(art_cache, 'images')
-            if os.path.isdir(art_cache):
-                cached = True
-                logging.info('Cached images found')
+        if p != '10.1371':
+            print('The publisher DOI does not correspond to PLoS')
+        images = self.plosImages()
+        image_cache = None
+        if caching:
+            image_cache = cache.ContentCache(os.path.join(cache_dir, 'images'))
+        try:
+            if image_cache is not None:
+                #Kept from eviction by other processes until the ePub has
+                #them; close() unpins them, even when the run fails
+                image_cache.pin([image[1] for image in images])
+                #Images cached per article by earlier versions are moved in
+                legacy = os.path.join(cache_dir, 'PLoS', s, 'images')
+            #Check cache to see which images already have been downloaded
+            to_fetch = {}
+            missing = []
+            for addr, key, tag, img_dir_sub, filename in images:
+                img_file = os.path.join(img_dir_sub, filename)
+                cached = None
+                if image_cache is not None:
+                    cached = image_cache.current(key)
+                    legacy_file = os.path.join(legacy, img_file)
+                    if cached is None and not image_cache.contains(key) and \
+                       os.path.isfile(legacy_file):
+                        cached = image_cache.storeFile(key, legacy_file)
+                if cached is None:
+                    to_fetch[addr] = (key, tag, img_file)
+                else:
+                    epub.writeFile(imageName(o, img_file), cached)
+            logging.info('{0} of {1} images found in cache'.format(
+                         len(images) - len(to_fetch), len(images)))
+            if not to_fetch:
                 print('Cached images found. Transferring from cache...')
-                shutil.copytree(art_cache_images, img_dir)
             else:
-                logging.info('Cached images not found')
-        else:
-            print('The publisher DOI does not correspond to PLoS')
-        
-        if not cached:
-            model_images = os.path.join(cache_dir, 'model', 'images')
-            shutil.copytree(model_images, img_dir)
-            print('Downloading images, this may take some time...')
-            #This string is invariable in the fetching of PLoS images
-            PLOSSTRING = 'article/fetchObject.action?uri=info%3Adoi%2F'
-            #An example DOI for PLoS is 10.1371/journal.pmed.0010027
-            #Here we parse it into useful strings for URL construction
-            pdoi, jdoi = doi.split('/')  # 10.1371, journal.pmed.0010027
-            _j, jrn_id, art_id = jdoi.split('.')  # journal, pmed, 0010027
-            #A mapping of journal ids to URLs:
-            jids = {'pgen': 'http://www.plosgenetics.org/',
-                    'pcbi': 'http://www.ploscompbiol.org/',
-                    'ppat': 'http://www.plospathogens.org/',
-                    'pntd': 'http://www.plosntds.org/',
-                    'pmed': 'http://www.plosmedicine.org/',
-                    'pbio': 'http://www.plosbiology.org/',
-                    'pone': 'http://www.plosone.org/'}
-            #A mapping of image types to directory names
-            dirs = {'e': 'equations', 'g': 'figures', 't': 'tables'}
-            #We detect all the graphic references in the document
-            graphics = self.root_tag.getElementsByTagName('graphic')
-            graphics += self.root_tag.getElementsByTagName('inline-graphic')
-            for g in graphics:
-                xlink_href = g.getAttribute('xlink:href')
-                tag = xlink_href.split('.')[-1]
-                type = tag[0]  # first character, either e, g, or t
-                if type == 'e':  # the case of an equation
-                    rep = '&representation=PNG'
-                else:  # other cases: table and figure
-                    rep = '&representation=PNG_L'
-                #Let's compose the address
-                addr_str = '{0}{1}{2}%2Fjournal.{3}.{4}.{5}{6}'
-                addr = addr_str.format(jids[jrn_id], PLOSSTRING, pdoi, jrn_id,
-                                       art_id, tag, rep)
-                #Open the address
-                try:
-                    image = urllib2.urlopen(addr)
-                except urllib2.HTTPError, e:
-                    if e.code == 503:  # Server overloaded
-                        sleep(1)  # Wait one second
-                        try:
-                            image = urllib2.urlopen(address)
-                        except:
-                            break
-                    elif e.code == 500:
-                        logging.error('urllib2.HTTPError {0}'.format(e.code))
-                    break
+                msg = 'Downloading {0} images, this may take some time...'
+                print(msg.format(len(to_fetch)))
+                addresses = [image[0] for image in images
+                             if image[0] in to_fetch]
+                dl_str = 'Downloaded image {0}'
+                #The downloads overlap, and are written out in order as they
+                #end
+                if image_cache is None:
+                    #Each image is streamed into a temporary file, then placed
+                    tmp = tempfile.mkdtemp()
+                    try:
+                        fetcher = downloader.fetcher
+                        responses = fetcher.fetchResponses(addresses, None,
+                                                           tmp)
+                        for addr, response in responses:
+                            key, tag, img_file = to_fetch[addr]
+                            if response is None:
+                                missing.append(tag)
+                                continue
+                            epub.writeFile(imageName(o, img_file),
+                                           response.filename)
+                            os.remove(response.filename)
+                            print(dl_str.format(tag))
+                    finally:
+                        shutil.rmtree(tmp, ignore_errors = True)
                 else:
-                    filename = '{0}.png'.format(tag)
-                    img_dir_sub = dirs[type]
-                    img_file = os.path.join(img_dir, img_dir_sub, filename)
-                    with open(img_file, 'wb') as outimage:
-                        outimage.write(image.read())
-                    dl_str = 'Downloaded image {0}'
-                    print(dl_str.format(tag))
-            print("Done downloading images")
-        #If the images were not already cached, and caching is enabled...
-        #We want to transfer the downloaded files to the cache
-        if not cached and caching:
-            os.mkdir(art_cache)
-            shutil.copytree(img_dir, art_cache_images)
+                    #Each image is cached as it arrives, so that a failed run
+                    #need not download it again, and is then taken from the
+                    #cache
+                    requests = [(addr, to_fetch[addr][0])
+                                for addr in addresses]
+                    updates = image_cache.update(requests)
+                    for addr, key, cached, status in updates:
+                        key, tag, img_file = to_fetch[addr]
+                        if cached is None:
+                            missing.append(tag)
+                            continue
+                        epub.writeFile(imageName(o, img_file), cached)
+                        if status == 'unchanged':
+                            print('Image {0} is unchanged'.format(tag))
+                        else:
+                            print(dl_str.format(tag))
+                print("Done downloading images")
+            if image_cache is not None:
+                image_cache.storeArticle(doi, [image[1] for image in images])
+            if missing:
+                msg = 'Could not download {0} images for {1}: {2}'
+                raise downloader.DownloadError(msg.format(len(missing), doi,
+                                                          ', '.join(missing)))
+        finally:
+            if image_cache is not None:
+                image_cache.close()
 
-    def fetchFrontiersImages(self, cache_dir, output_dir, caching):
+    def fetchFrontiersImages(self, cache_dir, epub, caching):
         '''Fetch the Frontiers images associated with the article.'''
         pass
 
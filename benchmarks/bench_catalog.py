@@ -0,0 +1,61 @@
+'''Catalog throughput in articles per second, with the metadata read by
+catalog.extractMetadata(), which parses only up to the end of <front>, and
+with a whole Article parsed for each, as the conversion does.
+
+    python benchmarks/bench_catalog.py [batch directory] [--copies N]
+
+Besides the articles of the batch directory, by default tests/articles, an
+article enlarged copies times (300 by default) is measured, the front of
+which is no larger than that of the others.'''
+
+import argparse
+import io
+import os.path
+
+import fixtures
+
+import catalog
+
+
+def extract(files, rounds):
+    '''Writes the catalog of files rounds times'''
+    for _round in range(rounds):
+        writer = catalog.CatalogWriter(io.BytesIO())
+        for xml_file in files:
+            writer.write(catalog.extractMetadata(xml_file))
+
+
+def parse(files, rounds):
+    '''Parses each of files as an Article rounds times'''
+    for _round in range(rounds):
+        for xml_file in files:
+            fixtures.parse(xml_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('batch', nargs = '?', default = None)
+    parser.add_argument('--copies', type = int, default = 300)
+    parser.add_argument('--rounds', type = int, default = 20)
+    args = parser.parse_args()
+    scratch = fixtures.Scratch()
+    try:
+        files = fixtures.articleFiles(args.batch)
+        large = fixtures.enlarge(files[0], args.copies, scratch.directory)
+        row = u'{0:<28} {1:>8} {2:>12} {3:>12}'
+        print(row.format('articles', 'KB', 'catalog a/s', 'Article a/s'))
+        for name, inputs in [('batch', files),
+                             (os.path.basename(large), [large])]:
+            size = sum(os.path.getsize(xml_file) for xml_file in inputs)
+            count = len(inputs) * args.rounds
+            extracted, _none = fixtures.timed(extract, inputs, args.rounds)
+            parsed, _none = fixtures.timed(parse, inputs, args.rounds)
+            print(row.format(name[:28], size // 1024,
+                             '{0:.1f}'.format(count / extracted),
+                             '{0:.1f}'.format(count / parsed)))
+    finally:
+        scratch.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+'''Size and time of each article's ePub stored, level 0, and deflated, level
+6, and the size and time of deflating its documents with zlib at each level
+from 0 to 9, to show what the levels zipfile does not offer would give.
+
+    python benchmarks/bench_compression.py [batch directory] [--copies N]
+
+Besides the articles of the batch directory, by default tests/articles, an
+article enlarged copies times (300 by default) is measured.'''
+
+import argparse
+import os.path
+import zipfile
+import zlib
+
+import fixtures
+
+import epubwriter
+
+
+def documents(epub_file):
+    '''Returns the contents of the entries of the ePub epub_file which
+    Archive deflates'''
+    with zipfile.ZipFile(epub_file) as epub:
+        names = [name for name in epub.namelist() if name != 'mimetype' and
+                 os.path.splitext(name)[1][1:].lower() not in
+                 epubwriter.stored_extensions]
+        return [epub.read(name) for name in names]
+
+
+def deflate(contents, level):
+    '''Deflates each of contents at level and returns the total bytes'''
+    total = 0
+    for data in contents:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        total += len(compressor.compress(data) + compressor.flush())
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('batch', nargs = '?', default = None)
+    parser.add_argument('--copies', type = int, default = 300)
+    args = parser.parse_args()
+    scratch = fixtures.Scratch()
+    try:
+        files = fixtures.articleFiles(args.batch)
+        files.append(fixtures.enlarge(files[0], args.copies, scratch.directory))
+        row = u'{0:<28} {1:>5} {2:>9} {3:>9} {4:>10} {5:>10}'
+        print(row.format('article', 'level', 'ePub KB', 'convert s',
+                         'deflate KB', 'deflate s'))
+        for xml_file in files:
+            epubs = {}
+            for level in [0, 6]:
+                convert, epub_file = fixtures.timed(fixtures.convert,
+                                                    fixtures.parse(xml_file),
+                                                    scratch, level = level)
+                epubs[level] = ('{0:.1f}'.format(
+                                    os.path.getsize(epub_file) / 1024.0),
+                                '{0:.3f}'.format(convert))
+                contents = documents(epub_file)
+                os.remove(epub_file)
+            for level in range(10):
+                seconds, size = fixtures.timed(deflate, contents, level)
+                epub_size, convert = epubs.get(level, ('', ''))
+                print(row.format(os.path.basename(xml_file)[:28], level,
+                                 epub_size, convert,
+                                 '{0:.1f}'.format(size / 1024.0),
+                                 '{0:.3f}'.format(seconds)))
+    finally:
+        scratch.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''Wall-clock time to download the images of each article one at a time and
+with the pool of threads of downloader.Fetcher. The requests go through a
+local HTTP stand-in for the publisher, acting as the proxy, which answers each
+image after the latency given, so nothing is fetched from the network. The
+images are written into an ePub by Article.fetchPLoSImages(), as in a
+conversion without caching.
+
+    python benchmarks/bench_downloads.py [batch directory] [--latency S]
+        [--threads N] [--per-host N]
+
+The articles are those of the batch directory, by default tests/articles.'''
+
+import argparse
+import os.path
+import sys
+import zipfile
+
+import fixtures
+
+import downloader
+import epubwriter
+
+#The stand-in for the publisher is the one the tests use
+sys.path.insert(0, os.path.join(fixtures.root, 'tests'))
+import support
+
+
+def fetch(document, scratch, threads, per_host):
+    '''Writes the images of the Article document into an ePub in the
+    Scratch directory with the given limits, and returns the number of
+    images in it'''
+    downloader.configure(threads, per_host)
+    outdirect = scratch.path(document.getDOI().split('/')[1])
+    epub = epubwriter.ZipWriter(scratch.base_epub, outdirect, 6)
+    try:
+        fixtures.quietly(document.fetchPLoSImages, scratch.directory, epub,
+                         False)
+    finally:
+        epub.close()
+    with zipfile.ZipFile(epub.filename) as archive:
+        count = len([name for name in archive.namelist()
+                     if name.startswith('OPS/images-')])
+    os.remove(epub.filename)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('batch', nargs = '?', default = None)
+    parser.add_argument('--latency', type = float, default = 0.2)
+    parser.add_argument('--threads', type = int, default = 8)
+    parser.add_argument('--per-host', type = int, default = 4)
+    args = parser.parse_args()
+    server = support.StandIn(args.latency)
+    proxy = server.start()
+    session = downloader.session
+    session.proxies = {'http': proxy, 'https': proxy}
+    scratch = fixtures.Scratch()
+    try:
+        row = u'{0:<28} {1:>7} {2:>10} {3:>10} {4:>8}'
+        print(row.format('article', 'images', 'serial s', 'pooled s',
+                         'speedup'))
+        for xml_file in fixtures.articleFiles(args.batch):
+            document = fixtures.parse(xml_file)
+            serial, count = fixtures.timed(fetch, document, scratch, 1, 1)
+            pooled, _count = fixtures.timed(fetch, document, scratch,
+                                            args.threads, args.per_host)
+            print(row.format(os.path.basename(xml_file)[:28], count,
+                             '{0:.3f}'.format(serial),
+                             '{0:.3f}'.format(pooled),
+                             '{0:.1f}x'.format(serial / pooled)))
+    finally:
+        scratch.close()
+        server.stop(session)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''Parse time and peak memory per article, with the Document parsed once and
+shared by every stage, as now, and with it parsed a second time for
+OPSContent, as before. Each article and mode is run in a process of its own so
+that its peak memory is its own.
+
+    python benchmarks/bench_parse.py [batch directory] [--copies N]
+
+Besides the articles of the batch directory, by default tests/articles, an
+article enlarged copies times (300 by default) is measured.'''
+
+import argparse
+import json
+import os.path
+import subprocess
+import sys
+
+import fixtures
+
+import xmlbackend
+from article import Article
+
+
+def child(mode, xml_file):
+    '''Converts xml_file in the given mode and prints its measurements'''
+    scratch = fixtures.Scratch()
+    try:
+        base = fixtures.peakMemory()
+        parse, document = fixtures.timed(Article, xml_file)
+        copies = []
+        if mode == 'twice':
+            #OPSContent parsed its own Document, alive along with the other
+            seconds, copy = fixtures.timed(xmlbackend.parse, xml_file)
+            parse += seconds
+            copies.append(copy)
+        convert, _epub = fixtures.timed(fixtures.convert, document, scratch)
+        print(json.dumps({'parse': parse, 'total': parse + convert,
+                          'memory': fixtures.peakMemory() - base}))
+    finally:
+        scratch.close()
+
+
+def measure(mode, xml_file):
+    '''Runs child() in a new process and returns its measurements'''
+    output = subprocess.check_output([sys.executable, __file__, '--child',
+                                      mode, xml_file])
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('batch', nargs = '?', default = None)
+    parser.add_argument('--copies', type = int, default = 300)
+    parser.add_argument('--child', nargs = 2, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+    scratch = fixtures.Scratch()
+    try:
+        files = fixtures.articleFiles(args.batch)
+        files.append(fixtures.enlarge(files[0], args.copies, scratch.directory))
+        row = u'{0:<28} {1:>8} {2:>7} {3:>9} {4:>9} {5:>9}'
+        print(row.format('article', 'KB', 'mode', 'parse s', 'total s',
+                         'peak MB'))
+        for xml_file in files:
+            size = os.path.getsize(xml_file) // 1024
+            for mode in ['twice', 'once']:
+                result = measure(mode, xml_file)
+                print(row.format(os.path.basename(xml_file)[:28], size, mode,
+                                 '{0:.3f}'.format(result['parse']),
+                                 '{0:.3f}'.format(result['total']),
+                                 '{0:.1f}'.format(result['memory'])))
+    finally:
+        scratch.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''Lookup time by tagName, with the tag index and with minidom's traversal of
+the tree, and the time to convert each article. The lookups are those of a
+conversion: over the whole Document and beneath each section, each round of
+them following an Element attached to the tree, which renumbers the index.
+
+    python benchmarks/bench_tagindex.py [batch directory] [--copies N]
+
+Besides the articles of the batch directory, by default tests/articles, an
+article enlarged copies times (300 by default) is measured.'''
+
+import argparse
+import os.path
+
+import fixtures
+
+import tagindex
+
+#The tagNames looked up, as by the handlers of content.py and tocncx.py
+tagnames = ['sec', 'fig', 'table-wrap', 'xref', 'ext-link', 'title']
+
+
+def lookups(document, indexed, rounds):
+    '''Performs the lookups of rounds rounds upon the Article document, with
+    its index or with minidom, and returns the number of Elements found'''
+    doc = document.doc
+    if not indexed:
+        del doc.tag_index
+    body = doc.getElementsByTagName('body')[0]
+    sections = [node for node in body.childNodes
+                if node.nodeType == node.ELEMENT_NODE and
+                node.tagName == 'sec']
+    found = 0
+    for _round in range(rounds):
+        for tagname in tagnames:
+            found += len(tagindex.getElementsByTagName(doc, tagname))
+            for section in sections:
+                found += len(tagindex.getElementsByTagName(section, tagname))
+        body.appendChild(doc.createElement('sec'))
+        tagindex.attached(body.lastChild)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('batch', nargs = '?', default = None)
+    parser.add_argument('--copies', type = int, default = 300)
+    parser.add_argument('--rounds', type = int, default = 5)
+    args = parser.parse_args()
+    scratch = fixtures.Scratch()
+    try:
+        files = fixtures.articleFiles(args.batch)
+        files.append(fixtures.enlarge(files[0], args.copies, scratch.directory))
+        row = u'{0:<28} {1:>8} {2:>10} {3:>10} {4:>10}'
+        print(row.format('article', 'KB', 'minidom s', 'indexed s',
+                         'convert s'))
+        for xml_file in files:
+            size = os.path.getsize(xml_file) // 1024
+            minidom, _found = fixtures.timed(lookups, fixtures.parse(xml_file),
+                                             False, args.rounds)
+            indexed, _found = fixtures.timed(lookups, fixtures.parse(xml_file),
+                                             True, args.rounds)
+            convert, _epub = fixtures.timed(fixtures.convert,
+                                            fixtures.parse(xml_file), scratch)
+            print(row.format(os.path.basename(xml_file)[:28], size,
+                             '{0:.3f}'.format(minidom),
+                             '{0:.3f}'.format(indexed),
+                             '{0:.3f}'.format(convert)))
+    finally:
+        scratch.close()
+
+
+if __name__ == '__main__':
+    main()
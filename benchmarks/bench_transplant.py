@@ -0,0 +1,99 @@
+'''Nodes allocated, time and peak memory to convert each article with the
+handlers, with its <body> moved into the main document, as now, and with it
+deep-copied there, as before. Nodes are counted by the create methods of the
+minidom Document, through which cloneNode() and the handlers make them. Each
+article and mode is run in a process of its own so that its peak memory is
+its own.
+
+    python benchmarks/bench_transplant.py [batch directory] [--copies N]
+
+Besides the articles of the batch directory, by default tests/articles, an
+article enlarged copies times (300 by default) is measured.'''
+
+import argparse
+import json
+import os.path
+import subprocess
+import sys
+from xml.dom import minidom
+
+import fixtures
+
+import tagindex
+
+#The methods of minidom.Document making a node
+create_methods = ['createElement', 'createElementNS', 'createTextNode',
+                  'createAttribute', 'createAttributeNS', 'createComment',
+                  'createCDATASection', 'createProcessingInstruction']
+allocated = [0]
+
+
+def counting(method):
+    '''Returns method, counting each call in allocated'''
+    def create(*args, **kwargs):
+        allocated[0] += 1
+        return method(*args, **kwargs)
+    return create
+
+
+def child(mode, xml_file):
+    '''Converts xml_file in the given mode and prints its measurements'''
+    scratch = fixtures.Scratch()
+    try:
+        document = fixtures.parse(xml_file)
+        for name in create_methods:
+            setattr(minidom.Document, name,
+                    counting(getattr(minidom.Document, name)))
+        base = fixtures.peakMemory()
+        copies = []
+        seconds = 0
+        if mode == 'copy':
+            #createMain cloned the children of <body>, the originals being
+            #kept alive by the Document along with the copies
+            body = tagindex.getElementsByTagName(document.doc, 'body')[0]
+            seconds, copies = fixtures.timed(lambda: [
+                item.cloneNode(deep = True) for item in body.childNodes])
+        convert, _epub = fixtures.timed(fixtures.convert, document, scratch)
+        print(json.dumps({'nodes': allocated[0], 'total': seconds + convert,
+                          'memory': fixtures.peakMemory() - base}))
+    finally:
+        scratch.close()
+
+
+def measure(mode, xml_file):
+    '''Runs child() in a new process and returns its measurements'''
+    output = subprocess.check_output([sys.executable, __file__, '--child',
+                                      mode, xml_file])
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('batch', nargs = '?', default = None)
+    parser.add_argument('--copies', type = int, default = 300)
+    parser.add_argument('--child', nargs = 2, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+    scratch = fixtures.Scratch()
+    try:
+        files = fixtures.articleFiles(args.batch)
+        files.append(fixtures.enlarge(files[0], args.copies, scratch.directory))
+        row = u'{0:<28} {1:>8} {2:>5} {3:>9} {4:>9} {5:>9}'
+        print(row.format('article', 'KB', 'mode', 'nodes', 'total s',
+                         'peak MB'))
+        for xml_file in files:
+            size = os.path.getsize(xml_file) // 1024
+            for mode in ['copy', 'move']:
+                result = measure(mode, xml_file)
+                print(row.format(os.path.basename(xml_file)[:28], size, mode,
+                                 result['nodes'],
+                                 '{0:.3f}'.format(result['total']),
+                                 '{0:.1f}'.format(result['memory'])))
+    finally:
+        scratch.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+'''Inputs and helpers shared by the benchmarks. The articles are those of
+tests/articles, or of a batch directory given on the command line. Large
+articles, such as the longer PLoS ONE papers, are made from them by repeating
+the content of their <body>.'''
+
+import logging
+import os
+import os.path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+#The benchmarks run from any directory, upon the modules of this checkout
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import article
+import epubwriter
+import opf
+import tocncx
+import utils
+import content
+
+articles = os.path.join(root, 'tests', 'articles')
+#The conversion logs, among other things, each image it cannot find
+logging.disable(logging.CRITICAL)
+
+
+def articleFiles(directory = None):
+    '''Returns the xml files of directory, by default the test articles'''
+    directory = directory or articles
+    return [os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith('.xml')]
+
+
+def enlarge(xml_file, copies, directory):
+    '''Writes a copy of the article xml_file to directory, under the same
+    name, with the content of its <body> repeated copies times. Returns the
+    new file.'''
+    with open(xml_file, 'rb') as source:
+        data = source.read()
+    start = data.index('<body>') + len('<body>')
+    end = data.index('</body>')
+    data = data[:start] + data[start:end] * copies + data[end:]
+    filename = os.path.join(directory, os.path.basename(xml_file))
+    with open(filename, 'wb') as output:
+        output.write(data)
+    return filename
+
+
+def peakMemory():
+    '''Returns the peak resident memory of this process in MB'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def timed(function, *args, **kwargs):
+    '''Returns the seconds taken by function(*args, **kwargs) and its
+    result'''
+    start = time.time()
+    result = function(*args, **kwargs)
+    return time.time() - start, result
+
+
+class Scratch(object):
+    '''A temporary directory, with a base ePub, removed when closed'''
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix = 'oae-bench-')
+        self.base_epub = os.path.join(self.directory, 'base_epub')
+        utils.makeEPUBBase(self.base_epub,
+                           os.path.join(root, 'resources', 'text.css'))
+
+    def path(self, name):
+        '''Returns the location of name in the directory'''
+        return os.path.join(self.directory, name)
+
+    def close(self):
+        '''Removes the directory'''
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+
+def quietly(function, *args, **kwargs):
+    '''Returns function(*args, **kwargs), discarding what it prints'''
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def parse(xml_file):
+    '''Returns the Article of xml_file'''
+    return quietly(article.Article, xml_file)
+
+
+def convert(document, scratch, engine = 'handlers', level = 6):
+    '''Converts the Article document to an ePub in the Scratch directory, as
+    main.makeEPUB() does but without its images, and returns the ePub'''
+    outdirect = scratch.path(document.getDOI().split('/')[1])
+    epub = epubwriter.ZipWriter(scratch.base_epub, outdirect, level)
+    quietly(write, document, epub, engine)
+    epub.close()
+    return epub.filename
+
+
+def write(document, epub, engine):
+    '''Writes the documents of the Article document to the ZipWriter epub'''
+    toc = tocncx.TocNCX()
+    toc.takeArticle(document)
+    myopf = opf.ContentOPF(epub)
+    myopf.takeArticle(document)
+    content.OPSContent(document.getDOI(), epub, document, engine)
+    toc.write(epub)
+    myopf.write()
@@ -0,0 +1,490 @@
+'''A content-addressed cache for downloaded resources. Each body is stored once,
+named by its SHA-1 hash, and is found through the key it was downloaded for,
+such as an image URI with its representation. Resources with identical bodies
+share one file on disk, whichever articles they belong to.
+
+The cache directory holds:
+  objects/ab/cdef...  The bodies, named by hash
+  tmp/                Bodies being downloaded
+  index.sqlite        An SQLite index with a row per key, giving the hash
+                      and size of its body, when it was stored and last used
+                      and how often it has been used; and a row per article
+                      listing the keys of its resources and whether all of
+                      them are cached; and a row per alias, another name
+                      under which a key is known, such as the DOI of an
+                      article for the URL of its xml file; and a row per key
+                      pinned by a ContentCache in use
+
+Bodies are written, or downloaded, to a temporary name and renamed into place
+before they are indexed, so a key is only indexed once its body is complete, and an
+interrupted run never leaves a partial entry behind. Several processes may
+share a cache, SQLite serializing their changes to the index.
+
+The cache may be held to size_limit bytes, the bodies least recently used
+being evicted first; see ContentCache.evict(). A process converting an
+article pins the keys of its images while it uses them, so that their bodies
+are not evicted meanwhile by another process, such as a worker of a parallel
+batch.
+
+Entries downloaded over HTTP keep the validators the server gave for them. An
+entry is current for ttl seconds after it was stored or last revalidated, and
+after that is revalidated with a conditional request when it is next wanted;
+see ContentCache.update().
+
+Cached bodies are placed in output directories with materialize(), which
+avoids copying their bytes where the filesystem allows it.'''
+
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+
+import downloader
+
+#The most bytes the bodies in a cache may take up, None for no limit. It is
+#enforced as each article's resources are recorded.
+size_limit = None
+#The seconds for which an entry is used without asking the server whether it
+#has changed, None to never ask
+ttl = None
+#The seconds after which a pin is disregarded, as that of a process which
+#died without removing it
+pin_ttl = 3600
+
+
+#The Linux ioctl cloning a file's extents into another, as cp --reflink does
+FICLONE = 0x40049409
+#The devices found not to support reflinks
+no_reflink = set()
+
+
+def reflink(source, destination):
+    '''Makes destination a copy-on-write clone of source, raising IOError
+    where the filesystem does not support it'''
+    import fcntl
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except IOError:
+                os.remove(destination)
+                raise
+
+
+def materialize(source, destination):
+    '''Makes destination a file with the contents of source, cloning it by
+    reflink where the filesystem supports it, or else hard linking it, so
+    that no bytes are copied. A copy is only made when neither is possible,
+    such as across devices. A hard link shares the file of source, so the
+    destination must not be modified in place. Returns the method used.'''
+    device = os.stat(source).st_dev
+    if device not in no_reflink:
+        try:
+            reflink(source, destination)
+            return 'reflink'
+        except (IOError, OSError, ImportError):
+            no_reflink.add(device)
+    try:
+        os.link(source, destination)
+        return 'link'
+    except OSError:
+        pass
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+
+class ContentCache(object):
+    '''The cache in the directory root, which is created if needed'''
+    def __init__(self, root):
+        self.root = root
+        for directory in ['objects', 'tmp']:
+            path = os.path.join(root, directory)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:  # Made by another process meanwhile
+                    if not os.path.isdir(path):
+                        raise
+        #The owner of the pins of this ContentCache
+        self.owner = uuid.uuid4().hex
+        self.db = sqlite3.connect(os.path.join(root, 'index.sqlite'),
+                                  timeout = 60)
+        with self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, sha1 TEXT, size INTEGER, stored REAL,
+                accessed REAL, hits INTEGER, metadata TEXT)''')
+            self.db.execute('''CREATE INDEX IF NOT EXISTS entries_sha1
+                ON entries (sha1)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS articles (
+                name TEXT PRIMARY KEY, keys TEXT, complete INTEGER)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS aliases (
+                name TEXT PRIMARY KEY, key TEXT, stored REAL)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS pins (
+                key TEXT, owner TEXT, pinned REAL)''')
+
+    def close(self):
+        '''Removes the pins of this ContentCache and closes the index'''
+        self.unpin()
+        self.db.close()
+
+    def pin(self, keys):
+        '''Keeps the bodies of keys from being evicted, by any process, until
+        unpin() is called or pin_ttl seconds have passed'''
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT INTO pins VALUES (?, ?, ?)',
+                                [(key, self.owner, now) for key in keys])
+
+    def unpin(self):
+        '''Removes the pins of this ContentCache'''
+        with self.db:
+            self.db.execute('DELETE FROM pins WHERE owner = ?', (self.owner,))
+
+    def pinned(self):
+        '''Returns the hashes of the bodies of the pinned keys, discarding
+        the pins older than pin_ttl'''
+        with self.db:
+            self.db.execute('DELETE FROM pins WHERE pinned < ?',
+                            (time.time() - pin_ttl,))
+        rows = self.db.execute('''SELECT DISTINCT sha1 FROM entries
+            WHERE key IN (SELECT key FROM pins)''')
+        return set(sha1 for (sha1,) in rows)
+
+    def objectPath(self, digest):
+        '''Returns the location of the body with the SHA-1 hex digest'''
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:])
+
+    def writeFile(self, path, data):
+        '''Writes data to path atomically'''
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        output = tempfile.NamedTemporaryFile(dir = directory, delete = False)
+        try:
+            with output:
+                output.write(data)
+            os.chmod(output.name, 0644)
+            os.rename(output.name, path)
+        except:
+            os.remove(output.name)
+            raise
+
+    def record(self, key):
+        '''Returns the entry for key as a dictionary, with its metadata, or
+        None if key is not cached'''
+        row = self.db.execute('''SELECT sha1, size, stored, accessed, hits,
+            metadata FROM entries WHERE key = ?''', (key,)).fetchone()
+        if row is None:
+            return None
+        sha1, size, stored, accessed, hits, metadata = row
+        record = json.loads(metadata)
+        record.update(key = key, sha1 = sha1, size = size, stored = stored,
+                      accessed = accessed, hits = hits)
+        return record
+
+    def contains(self, key):
+        '''Determines if key is cached, without counting it as a use'''
+        record = self.record(key)
+        return record is not None and self.isIntact(record)
+
+    def isIntact(self, record):
+        '''Determines if the body of an entry is present at its full size'''
+        try:
+            return os.path.getsize(self.objectPath(record['sha1'])) == \
+                record['size']
+        except OSError:
+            return False
+
+    def isCurrent(self, record):
+        '''Determines if an entry is intact and was stored or revalidated
+        within the last ttl seconds'''
+        if record is None or not self.isIntact(record):
+            return False
+        if ttl is None:
+            return True
+        return time.time() - record.get('validated', record['stored']) < ttl
+
+    def current(self, key):
+        '''Returns the location of the cached body for key if it is current,
+        as lookup() does, or else None'''
+        if not self.isCurrent(self.record(key)):
+            return None
+        return self.lookup(key)
+
+    def lookup(self, key):
+        '''Returns the location of the cached body for key, or None if it is
+        not cached. The use is recorded for the eviction policy.'''
+        record = self.record(key)
+        if record is None:
+            return None
+        if not self.isIntact(record):  # Removed from beneath the index
+            with self.db:
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            return None
+        with self.db:
+            self.db.execute('''UPDATE entries SET accessed = ?, hits = hits + 1
+                WHERE key = ?''', (time.time(), key))
+        return self.objectPath(record['sha1'])
+
+    def store(self, key, data, **metadata):
+        '''Caches data as the body for key, along with any metadata, and
+        returns the location of the body'''
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.objectPath(digest)
+        if not os.path.isfile(path):  # Otherwise the body is shared
+            self.writeFile(path, data)
+        self.index(key, digest, len(data), metadata)
+        return path
+
+    def storeFile(self, key, source, **metadata):
+        '''Caches the file source, which must be on the filesystem of the
+        cache, such as in its tmp directory, as the body for key, as store()
+        does. The file is moved into place, or removed if the cache already
+        holds its body.'''
+        digest = hashlib.sha1()
+        with open(source, 'rb') as body:
+            for chunk in iter(lambda: body.read(1 << 16), ''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        size = os.path.getsize(source)
+        path = self.objectPath(digest)
+        if os.path.isfile(path):
+            os.remove(source)
+        else:
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+            os.chmod(source, 0644)
+            os.rename(source, path)
+        self.index(key, digest, size, metadata)
+        return path
+
+    def index(self, key, digest, size, metadata):
+        '''Records the body with the SHA-1 hex digest as the one for key'''
+        now = time.time()
+        with self.db:
+            self.db.execute('''INSERT OR REPLACE INTO entries VALUES
+                (?, ?, ?, ?, ?, 0, ?)''', (key, digest, size, now, now,
+                                            json.dumps(metadata)))
+
+    def revalidated(self, key):
+        '''Records that the server confirmed the body for key as unchanged'''
+        record = self.record(key)
+        metadata = dict((name, value) for name, value in record.items()
+                        if name not in ('key', 'sha1', 'size', 'stored',
+                                        'accessed', 'hits'))
+        metadata['validated'] = time.time()
+        with self.db:
+            self.db.execute('UPDATE entries SET metadata = ? WHERE key = ?',
+                            (json.dumps(metadata), key))
+
+    def update(self, requests):
+        '''Downloads the bodies for a list of (url, key) requests with the
+        shared fetcher. Where a body is already cached for a key, the
+        request is made conditional on it having changed, so that it is only
+        downloaded again if it has. Bodies are streamed into the tmp
+        directory and moved into place, never being held in memory. Yields (url, key, location, status) in
+        order, where status is 'fetched', 'unchanged' when the server
+        answered 304 Not Modified, or 'failed' with a location of None.'''
+        keys = dict(requests)
+        headers = {}
+        for url, key in requests:
+            record = self.record(key)
+            if record is not None and self.isIntact(record):
+                headers[url] = downloader.conditions(record)
+        urls = [url for url, _key in requests]
+        tmp = os.path.join(self.root, 'tmp')
+        responses = downloader.fetcher.fetchResponses(urls, headers, tmp)
+        for url, response in responses:
+            key = keys[url]
+            if response is None:
+                yield url, key, None, 'failed'
+            elif response.code == 304:
+                self.revalidated(key)
+                yield url, key, self.lookup(key), 'unchanged'
+            else:
+                metadata = downloader.responseMetadata(response)
+                location = self.storeFile(key, response.filename, url = url,
+                                          **metadata)
+                yield url, key, location, 'fetched'
+
+    def alias(self, name, key):
+        '''Records name as an alias of key'''
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)',
+                            (name, key, time.time()))
+
+    def resolve(self, name):
+        '''Returns the key of which name is an alias, or None'''
+        row = self.db.execute('SELECT key FROM aliases WHERE name = ?',
+                              (name,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def article(self, name):
+        '''Returns the record for the article name, or None'''
+        row = self.db.execute('''SELECT keys, complete FROM articles
+            WHERE name = ?''', (name,)).fetchone()
+        if row is None:
+            return None
+        return {'name': name, 'keys': json.loads(row[0]),
+                'complete': bool(row[1])}
+
+    def storeArticle(self, name, keys):
+        '''Records the keys of the resources of the article name, and whether
+        all of them are cached, then holds the cache to size_limit'''
+        complete = all(self.contains(key) for key in keys)
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO articles VALUES (?, ?, ?)',
+                            (name, json.dumps(keys), complete))
+        if size_limit is not None:
+            self.evict(size_limit)
+        return complete
+
+    def objects(self):
+        '''Returns (sha1, size, last access) for each indexed body, least
+        recently used first'''
+        return self.db.execute('''SELECT sha1, MAX(size), MAX(accessed)
+            FROM entries GROUP BY sha1 ORDER BY MAX(accessed)''').fetchall()
+
+    def totalSize(self):
+        '''Returns the bytes taken up by the indexed bodies'''
+        return sum(size for _sha1, size, _accessed in self.objects())
+
+    def objectFiles(self):
+        '''Yields the hash of each body file present in the cache'''
+        top = os.path.join(self.root, 'objects')
+        for prefix in sorted(os.listdir(top)):
+            directory = os.path.join(top, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if len(prefix + name) == 40:  # Skip temporary files
+                    yield prefix + name
+
+    def remove(self, digests):
+        '''Removes the bodies with the given hashes and every entry using
+        them, marking the articles using them as incomplete'''
+        digests = set(digests)
+        if not digests:
+            return
+        keys = set()
+        with self.db:
+            for digest in digests:
+                rows = self.db.execute('SELECT key FROM entries WHERE sha1 = ?',
+                                       (digest,))
+                keys.update(key for (key,) in rows)
+                self.db.execute('DELETE FROM entries WHERE sha1 = ?',
+                                (digest,))
+            articles = self.db.execute('''SELECT name, keys FROM articles
+                WHERE complete''').fetchall()
+            for name, article_keys in articles:
+                if keys.intersection(json.loads(article_keys)):
+                    self.db.execute('''UPDATE articles SET complete = 0
+                        WHERE name = ?''', (name,))
+        for digest in digests:
+            try:
+                os.remove(self.objectPath(digest))
+            except OSError:
+                pass
+
+    def evict(self, limit):
+        '''Evicts the least recently used bodies until the rest take up no
+        more than limit bytes, or only pinned ones are left. Returns the
+        number of bodies and bytes evicted.'''
+        objects = self.objects()
+        excess = sum(size for _sha1, size, _accessed in objects) - limit
+        if excess <= 0:
+            return 0, 0
+        pinned = self.pinned()
+        evicted = []
+        freed = 0
+        for sha1, size, _accessed in objects:
+            if freed >= excess:
+                break
+            if sha1 in pinned:
+                continue
+            evicted.append(sha1)
+            freed += size
+        self.remove(evicted)
+        return len(evicted), freed
+
+    def prune(self, limit = None):
+        '''Removes body files which are not indexed, such as those left by
+        an index entry being replaced, and downloads left in the tmp
+        directory by interrupted runs, then evicts bodies down to limit bytes
+        if a limit is given. Unindexed files less than an hour old are kept,
+        as another process may be about to index them. Returns the number of
+        files and bytes removed.'''
+        indexed = set(sha1 for sha1, _size, _accessed in self.objects())
+        count = freed = 0
+        tmp = os.path.join(self.root, 'tmp')
+        for name in os.listdir(tmp):
+            stat = os.stat(os.path.join(tmp, name))
+            if time.time() - stat.st_mtime > 3600:
+                os.remove(os.path.join(tmp, name))
+                count += 1
+                freed += stat.st_size
+        orphans = []
+        for sha1 in self.objectFiles():
+            if sha1 in indexed:
+                continue
+            stat = os.stat(self.objectPath(sha1))
+            if time.time() - stat.st_mtime > 3600:
+                orphans.append(sha1)
+                freed += stat.st_size
+        self.remove(orphans)
+        count += len(orphans)
+        if limit is None:
+            return count, freed
+        evicted_count, evicted = self.evict(limit)
+        return count + evicted_count, freed + evicted
+
+    def verify(self, repair = False):
+        '''Checks that every indexed body is present and matches its hash,
+        returning the hashes of those which do not. With repair, they are
+        removed, along with their entries.'''
+        bad = []
+        for sha1, size, _accessed in self.objects():
+            digest = hashlib.sha1()
+            try:
+                with open(self.objectPath(sha1), 'rb') as body:
+                    for chunk in iter(lambda: body.read(1 << 16), ''):
+                        digest.update(chunk)
+            except IOError:
+                bad.append(sha1)
+                continue
+            if digest.hexdigest() != sha1:
+                bad.append(sha1)
+        if repair:
+            self.remove(bad)
+        return bad
+
+    def report(self):
+        '''Returns a dictionary of statistics on the cache'''
+        entries, hits, oldest = self.db.execute('''SELECT COUNT(*),
+            SUM(hits), MIN(accessed) FROM entries''').fetchone()
+        articles, complete = self.db.execute('''SELECT COUNT(*),
+            SUM(complete) FROM articles''').fetchone()
+        objects = self.objects()
+        return {'entries': entries, 'hits': hits or 0,
+                'unused': self.db.execute('''SELECT COUNT(*) FROM entries
+                    WHERE hits = 0''').fetchone()[0],
+                'objects': len(objects),
+                'bytes': sum(size for _sha1, size, _accessed in objects),
+                'articles': articles, 'complete': complete or 0,
+                'oldest': oldest}
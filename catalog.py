@@ -0,0 +1,167 @@
+'''Extraction of catalog metadata from article xml files without parsing the
+whole article. The file is read with iterparse only until the end of <front>,
+and only the data needed for a catalog is collected: the DOI, title, journal,
+authors, publication dates and subjects. The values follow those produced by
+the metadata module for the same article.
+
+Catalogs are written as JSON Lines, one object per article, or as CSV.'''
+
+import csv
+import json
+import logging
+import os.path
+
+import discovery
+
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+#The catalog columns, in order
+fields = ['file', 'doi', 'title', 'journal', 'authors', 'pub_dates',
+          'subjects']
+
+
+def serializeText(elem, stringlist = None):
+    '''Collects the text beneath elem, like utils.serializeText()'''
+    if stringlist is None:
+        stringlist = []
+    if elem.text and elem.text != u'\n':
+        stringlist.append(elem.text)
+    for child in elem:
+        serializeText(child, stringlist)
+        if child.tail and child.tail != u'\n':
+            stringlist.append(child.tail)
+    return u''.join(stringlist)
+
+
+def getText(elem):
+    '''Returns the text of elem, or an empty string if there is none'''
+    if elem is None or not elem.text:
+        return u''
+    return unicode(elem.text)
+
+
+def dateString(pub_date):
+    '''Formats a <pub-date> as epub_date.DateInfo.dateString() would'''
+    newstring = u'{0}'.format(int(pub_date.findtext('year')))
+    if pub_date.find('season') is None:
+        month = pub_date.findtext('month')
+        if month:
+            try:
+                month = int(month)
+            except ValueError:
+                months = ['January', 'February', 'March', 'April', 'May',
+                          'June', 'July', 'August', 'September', 'October',
+                          'November', 'December']
+                month = months.index(month) + 1
+            newstring += u'-{0}'.format(str(month).zfill(2))
+        day = pub_date.findtext('day')
+        if day and int(day):
+            newstring += u'-{0}'.format(str(int(day)).zfill(2))
+    return newstring
+
+
+def authorName(contrib):
+    '''Formats a contributor name as contributor.Contributor.get_name()'''
+    collab = contrib.find('.//collab')
+    if collab is not None:
+        return serializeText(collab)
+    name = contrib.find('.//name')
+    if name is None:
+        return u' '
+    return u'{0} {1}'.format(getText(name.find('given-names')),
+                             getText(name.find('surname')))
+
+
+def readFront(xml_file):
+    '''Parses xml_file up to the end of <front> and returns the <front>
+    element, or None if the file has no <front>'''
+    with discovery.openInput(xml_file) as source:
+        for event, elem in etree.iterparse(source, events = ('start', 'end')):
+            if event == 'end' and elem.tag == 'front':
+                return elem
+            if event == 'start' and elem.tag in ('body', 'back'):
+                break
+    return None
+
+
+def extractMetadata(xml_file, directory = None):
+    '''Returns a dictionary of the catalog fields for the article in
+    xml_file. Its file is named by its path relative to the batch directory,
+    if given, as files in different subdirectories may share a name.'''
+    record = dict.fromkeys(fields, u'')
+    if directory is None:
+        record['file'] = os.path.basename(xml_file)
+    else:
+        record['file'] = discovery.relativePath(xml_file, directory)
+    record['authors'] = []
+    record['pub_dates'] = {}
+    record['subjects'] = {}
+    front = readFront(xml_file)
+    if front is None:
+        logging.error('No front element found in {0}'.format(xml_file))
+        return record
+    journal_meta = front.find('journal-meta')
+    if journal_meta is not None:
+        record['journal'] = getText(journal_meta.find('.//journal-title'))
+    article_meta = front.find('article-meta')
+    if article_meta is None:
+        return record
+    #The metadata module searches at any depth, so iter() is used here
+    for article_id in article_meta.iter('article-id'):
+        if article_id.get('pub-id-type') == 'doi':
+            record['doi'] = getText(article_id)
+    title_group = article_meta.find('.//title-group')
+    if title_group is not None:
+        article_title = title_group.find('.//article-title')
+        if article_title is not None:
+            record['title'] = serializeText(article_title)
+    for contrib_group in article_meta.iter('contrib-group'):
+        for contrib in contrib_group.iter('contrib'):
+            if contrib.get('contrib-type') == 'author':
+                record['authors'].append(authorName(contrib))
+    for pub_date in article_meta.iter('pub-date'):
+        pub_type = pub_date.get('pub-type', u'')
+        record['pub_dates'][pub_type] = dateString(pub_date)
+    article_categories = article_meta.find('.//article-categories')
+    if article_categories is not None:
+        for subj_group in article_categories.iter('subj-group'):
+            subjects = [serializeText(subject)
+                        for subject in subj_group.iter('subject')]
+            subj_type = subj_group.get('subj-group-type', u'')
+            record['subjects'][subj_type] = subjects
+    return record
+
+
+class CatalogWriter(object):
+    '''Writes catalog records to a file in JSON Lines or CSV format'''
+    def __init__(self, output, format = 'jsonl'):
+        self.output = output
+        self.format = format
+        if format == 'csv':
+            self.writer = csv.writer(output)
+            self.writer.writerow(fields)
+
+    def write(self, record):
+        '''Writes one record, as returned by extractMetadata()'''
+        if self.format != 'csv':
+            self.output.write(json.dumps(record, sort_keys = True) + '\n')
+            return
+        row = []
+        for field in fields:
+            value = record[field]
+            if field == 'authors':
+                value = u'; '.join(value)
+            elif field == 'pub_dates':
+                value = u'; '.join(u'{0}={1}'.format(key, value[key])
+                                   for key in sorted(value))
+            elif field == 'subjects':
+                value = u'; '.join(u'{0}={1}'.format(key, subject)
+                                   for key in sorted(value)
+                                   for subject in value[key])
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            row.append(value)
+        self.writer.writerow(row)
@@ -1,30 +1,79 @@
-import xml.dom.minidom as minidom
 import xml.dom
 import logging
 import os, os.path
 import utils
+import tagindex
+import xmlbackend
+import xslt
+
+#The web sites of the PLoS journals, by journal title
+journal_sites = {'PLoS Genetics': u'http://www.plosgenetics.org/',
+                 'PLoS ONE': u'http://www.plosone.org/',
+                 'PLoS Biology': u'http://www.plosbiology.org/',
+                 'PLoS Computational Biology': u'http://www.ploscompbiol.org/',
+                 'PLoS Pathogens': u'http://www.plospathogens.org/',
+                 'PLoS Medicine': u'http://www.plosmedicine.org/',
+                 'PLoS Neglected Tropical Diseases': u'http://www.plosntds.org/'}
 
 class OPSContent(object):
     '''A class for instantiating content xml documents in the OPS Preferred
     Vocabulary'''
-    def __init__(self, documentstring, doi, outdirect, document):
+    def __init__(self, doi, epub, document, engine = 'handlers'):
         print('Generating OPS content...')
-        self.inputstring = documentstring
-        self.doc = minidom.parse(self.inputstring)
-        #Get string from outdirect sans "journal."
+        #The Document is owned by the Article, it must not be parsed again
+        self.doc = document.doc
+        #The conversion engine: 'handlers', 'xslt' or 'stream', which differs
+        #from 'handlers' only for the main body
+        self.engine = engine
+        #The epubwriter receiving the output files
+        self.epub = epub
+        #Get string from the DOI sans "journal."
         self.doi = doi
         self.jid = self.doi.split('journal.')[1] #journal id string
         self.syn_frag = 'synop.{0}.xml'.format(self.jid) + '#{0}'
         self.main_frag = 'main.{0}.xml'.format(self.jid) + '#{0}'
         self.bib_frag = 'biblio.{0}.xml'.format(self.jid) + '#{0}'
         self.tab_frag = 'tables.{0}.xml'.format(self.jid) + '#{0}'
-        self.outdir = os.path.join(outdirect, 'OPS')
-        self.outputs = {'Synopsis': os.path.join(outdirect, 'OPS', 'synop.{0}.xml'.format(self.jid)), 
-                        'Main': os.path.join(outdirect, 'OPS', 'main.{0}.xml'.format(self.jid)), 
-                        'Biblio': os.path.join(outdirect, 'OPS', 'biblio.{0}.xml'.format(self.jid)), 
-                        'Tables': os.path.join(outdirect, 'OPS', 'tables.{0}.xml'.format(self.jid))}
+        self.outputs = {'Synopsis': 'OPS/synop.{0}.xml'.format(self.jid), 
+                        'Main': 'OPS/main.{0}.xml'.format(self.jid), 
+                        'Biblio': 'OPS/biblio.{0}.xml'.format(self.jid), 
+                        'Tables': 'OPS/tables.{0}.xml'.format(self.jid)}
         self.metadata = document.front
         self.backdata = document.back
+        #We need mappings for local files to xref ref-type attribute values
+        self.ref_map = {u'bibr': self.bib_frag,
+                        u'fig': self.main_frag,
+                        u'supplementary-material': self.main_frag,
+                        u'table': self.main_frag,
+                        u'aff': self.syn_frag,
+                        u'sec': self.main_frag,
+                        u'table-fn': self.tab_frag,
+                        u'boxed-text': self.main_frag,
+                        u'other': self.main_frag,
+                        u'disp-formula': self.main_frag}
+        #The tagName to handler dispatch table used by handleElements, the
+        #handlers are run in this order
+        self.element_handlers = [('bold', self.boldElementHandler),
+                                 ('italic', self.italicElementHandler),
+                                 ('monospace', self.monospaceElementHandler),
+                                 ('sub', self.subElementHandler),
+                                 ('sup', self.supElementHandler),
+                                 ('underline', self.underlineElementHandler),
+                                 ('xref', self.xrefElementHandler),
+                                 ('sec', self.secElementHandler),
+                                 ('named-content', self.namedContentElementHandler),
+                                 ('inline-formula', self.inlineFormulaElementHandler),
+                                 ('disp-formula', self.dispFormulaElementHandler),
+                                 ('disp-quote', self.dispQuoteElementHandler),
+                                 ('ext-link', self.extLinkElementHandler),
+                                 ('sc', self.smallCapsElementHandler),
+                                 ('list', self.listElementHandler),
+                                 ('graphic', self.graphicElementHandler),
+                                 ('email', self.emailElementHandler),
+                                 ('fn', self.fnElementHandler)]
+        self.anonymous_secs = 0
+        #The heading tags for section titles, by depth; see divTitleFormat
+        self.heading_tags = ['h2', 'h3', 'h4', 'h5', 'h6']
         
         self.createSynopsis(self.metadata, self.backdata)
         self.createMain()
@@ -75,15 +124,12 @@ class OPSContent(object):
         else:
             abstitle = synbody.appendChild(synop.createElement('h2'))
             abstitle.appendChild(synop.createTextNode('Abstract'))
+            tagindex.detaching(abstract)
             synbody.appendChild(abstract)
-            abstract.tagName = 'div'
+            tagindex.rename(abstract, 'div')
             abstract.setAttribute('id', 'abstract')
             abstract.setAttribute('class', 'abstract')
-            for title in abstract.getElementsByTagName('title'):
-                title.tagName = 'h3'
-            for sec in abstract.getElementsByTagName('sec'):
-                sec.tagName = 'div'
-            self.postNodeHandling(abstract, synop)
+            self.abstractHandler(abstract, synop)
         
         #Create the Author's Summary if it exists
         try:
@@ -95,19 +141,17 @@ class OPSContent(object):
             summary_title.appendChild(synop.createTextNode('Author Summary'))
             for title in summary.getElementsByTagName('title'):
                 if utils.serializeText(title, stringlist = []) == 'Author Summary':
+                    tagindex.detaching(title)
                     summary.removeChild(title)
+            tagindex.detaching(summary)
             synbody.appendChild(summary)
-            summary.tagName = 'div'
+            tagindex.rename(summary, 'div')
             summary.removeAttribute('abstract-type')
             summary.setAttribute('id', 'author-summary')
             summary.setAttribute('class', 'summary')
-            for title in abstract.getElementsByTagName('title'):
-                title.tagName = 'h3'
-            for sec in abstract.getElementsByTagName('sec'):
-                sec.tagName = 'div'
             #for para in abstract.getElementsByTagName('p'):
             #    para.tagName = 'big'
-            self.postNodeHandling(abstract, synop)
+            self.abstractHandler(abstract, synop)
         
         #We can create the <div class="articleInfo">
         #We will put metadata in it.
@@ -211,11 +255,11 @@ class OPSContent(object):
                         term = item.getElementsByTagName('term')[0]
                         idef = item.getElementsByTagName('def')[0]
                         defp = idef.getElementsByTagName('p')[0]
-                        for c in term.childNodes:
-                            ap.appendChild(c.cloneNode(deep=True))
+                        #The glossary is only read here, so its content
+                        #is moved rather than copied
+                        tagindex.transplantChildren(term, ap)
                         ap.appendChild(synop.createTextNode(','))
-                        for c in defp.childNodes:
-                            ap.appendChild(c.cloneNode(deep=True))
+                        tagindex.transplantChildren(defp, ap)
         
         #Create a node for the correspondence text
         corr_line = articleInfo.appendChild(synop.createElement('p'))
@@ -233,7 +277,7 @@ class OPSContent(object):
         #Handle conversion of ext-link to <a>
         ext_links = synop.getElementsByTagName('ext-link')
         for ext_link in ext_links:
-            ext_link.tagName = u'a'
+            tagindex.rename(ext_link, u'a')
             ext_link.removeAttribute('ext-link-type')
             href = ext_link.getAttribute('xlink:href')
             ext_link.removeAttribute('xlink:href')
@@ -269,36 +313,44 @@ class OPSContent(object):
                         break
                 except AttributeError:
                     pass
+            tagindex.detaching(title)
             synbody.appendChild(title)
-            title.tagName = u'h2'
+            tagindex.rename(title, u'h2')
+            tagindex.detaching(editor_abs)
             synbody.appendChild(editor_abs)
-            editor_abs.tagName = 'div'
+            tagindex.rename(editor_abs, 'div')
             editor_abs.removeAttribute('abstract-type')
             editor_abs.setAttribute('id','editor_abstract')
             editor_abs.setAttribute('class', 'editorsAbstract')
-            for title in editor_abs.getElementsByTagName('title'):
-                title.tagName = 'h3'
-            for sec in editor_abs.getElementsByTagName('sec'):
-                sec.tagName = 'div'
             #for para in editor_abs.getElementsByTagName('p'):
             #    para.tagName = 'big'
-            self.postNodeHandling(editor_abs, synop)
-        
+            self.abstractHandler(editor_abs, synop)
         
-        self.postNodeHandling(synbody, synop)
+        if self.engine == 'xslt':
+            self.transformChildren('synopsis', synbody)
+        else:
+            self.postNodeHandling(synbody, synop)
         
-        with open(self.outputs['Synopsis'],'wb') as out:
-            out.write(synop.toprettyxml(encoding = 'utf-8'))
+        self.epub.writeDocument(self.outputs['Synopsis'], synop)
 
     def createMain(self):
         '''Create an output file containing the main article body content'''
+        if self.engine == 'stream':
+            self.streamMain()
+            return
+        if self.engine == 'xslt':
+            self.transformMain()
+            return
         doc = self.doc
         #Initiate the document, returns the document and its body element
         main, mainbody = self.initiateDocument('Main file')
-        body = doc.getElementsByTagName('body')[0]
-        #Here we copy the entirety of the body element over to our main document
-        for item in body.childNodes:
-            mainbody.appendChild(item.cloneNode(deep=True))
+        body = tagindex.getElementsByTagName(doc, 'body')[0]
+        #Here we move the entirety of the body element over to our main
+        #document. TocNCX and ContentOPF have already read it, and nothing
+        #reads it afterwards, so it need not be copied.
+        tagindex.transplantChildren(body, mainbody)
+        #Index the main document now that it holds the content to be converted
+        tagindex.TagIndex(main)
         #Process figures
         self.figNodeHandler(mainbody, main) #Convert <fig> to <img>
         #Process tables
@@ -321,13 +373,143 @@ class OPSContent(object):
         self.divTitleFormat(mainbody, depth = 0) #Convert <title> to <h#>...
         #If any tables were in the article, make the tables.xml
         if tab_docbody.getElementsByTagName('table'):
-            with open(self.outputs['Tables'],'wb') as output:
-                output.write(tab_doc.toprettyxml(encoding = 'utf-8'))
+            self.epub.writeDocument(self.outputs['Tables'], tab_doc)
         
         #Write the document
-        with open(self.outputs['Main'],'wb') as out:
-            out.write(main.toprettyxml(encoding = 'utf-8'))
+        self.epub.writeDocument(self.outputs['Main'], main)
+
+    def transformMain(self):
+        '''Creates the main and tables output files with the stylesheet of
+        xslt, which converts the body along with the acknowledgments and
+        author contributions. The Document of the article is left as it is.'''
+        main, mainbody = self.initiateDocument('Main file')
+        tab_doc, tab_docbody = self.initiateDocument('HTML Versions of Tables')
+        nodes = tagindex.getElementsByTagName(self.doc, 'body')[:1]
+        if self.backdata and self.backdata.ack:
+            nodes.append(self.backdata.ack)
+        anc = self.metadata.article_meta.author_notes_contributions
+        if anc:
+            nodes.append(anc)
+        xslt.transform('main', nodes, {'main': mainbody, 'tables': tab_docbody},
+                       self.jid, self.imageFiles(), self.journalSite())
+        if tab_docbody.getElementsByTagName('table'):
+            self.epub.writeDocument(self.outputs['Tables'], tab_doc)
+        self.epub.writeDocument(self.outputs['Main'], main)
+
+    def transformChildren(self, name, node):
+        '''Replaces the children of node with their conversion by the
+        stylesheet of xslt as the part name, 'synopsis' or 'abstract'.'''
+        children = list(node.childNodes)
+        for child in children:
+            node.removeChild(child)
+        xslt.transform(name, children, {name: node}, self.jid,
+                       self.imageFiles(), self.journalSite())
+
+    def abstractHandler(self, abstract, doc):
+        '''Converts an abstract of the synopsis, already renamed to <div>: its
+        titles become <h3> and its sections <div>, and the element handlers
+        are applied'''
+        if self.engine == 'xslt':
+            self.transformChildren('abstract', abstract)
+            return
+        for title in abstract.getElementsByTagName('title'):
+            tagindex.rename(title, 'h3')
+        for sec in abstract.getElementsByTagName('sec'):
+            tagindex.rename(sec, 'div')
+        self.postNodeHandling(abstract, doc)
+
+    def journalSite(self):
+        '''Returns the web site of the journal of the article, or an empty
+        string for journals not in journal_sites'''
+        return journal_sites.get(self.metadata.journal_meta.title[0], u'')
         
+    def streamMain(self):
+        '''Create the output file containing the main article body content
+        without assembling it as one Document. Sections are written as they
+        are reached in the shared Document, every other node beneath them is
+        copied, converted as in createMain and written out on its own, so that
+        memory is bounded by the nesting depth and the largest such block.'''
+        doc = self.doc
+        main, mainbody = self.initiateDocument('Main file')
+        tab_doc, tab_docbody = self.initiateDocument('HTML Versions of Tables')
+        body = tagindex.getElementsByTagName(doc, 'body')[0]
+        self.anonymous_secs = 0
+        with self.epub.open(self.outputs['Main']) as out:
+            stream = xmlbackend.StreamWriter(out)
+            stream.startDocument(main)
+            root = main.documentElement
+            stream.start(root)
+            for item in root.childNodes:
+                if item is not mainbody:
+                    stream.append(item)
+                    continue
+                stream.start(mainbody)
+                self.streamChildren(body, main, tab_docbody, stream, depth = 0)
+                #Acknowledgments and Author Contributions follow the body, and
+                #are only given the general processing, as in createMain
+                block = main.createElement(u'body')
+                self.acknowledgments(block, main)
+                self.authorContributions(block, main)
+                self.handleElements(block, main, [tagname for tagname, _handler
+                                                  in self.element_handlers])
+                self.divTitleFormat(block, depth = 0)
+                for child in list(block.childNodes):
+                    stream.append(child)
+                stream.end()
+            stream.end()
+        self.postNodeHandling(tab_docbody, tab_doc)
+        #If any tables were in the article, make the tables.xml
+        if tab_docbody.getElementsByTagName('table'):
+            self.epub.writeDocument(self.outputs['Tables'], tab_doc)
+
+    def isStreamableSection(self, node):
+        '''Determines if node is a <sec> which streamMain may write as it goes.
+        Its title must be its first <title> descendant and must have content,
+        otherwise divTitleFormat could choose a different heading.'''
+        if node.nodeType != node.ELEMENT_NODE or node.tagName != u'sec':
+            return False
+        for element in tagindex.walkElements(node):
+            if element.tagName == u'title':
+                return element.parentNode is node and bool(element.childNodes)
+        return False
+
+    def streamChildren(self, node, main, tabbody, stream, depth):
+        '''Converts and writes the children of node, the <body> or a <sec> of
+        the shared Document, to stream. Sections are streamed in turn, other
+        Elements are converted a block at a time by convertBlock.'''
+        for item in node.childNodes:
+            if self.isStreamableSection(item):
+                div = item.cloneNode(deep=False)
+                self.secElementHandler(div, main)
+                stream.start(div)
+                self.streamChildren(item, main, tabbody, stream, depth + 1)
+                stream.end()
+            elif item.nodeType == item.ELEMENT_NODE:
+                #The copy is held by an element standing in for its parent,
+                #as some handlers modify the parent of the element they handle
+                block = main.createElement(node.tagName)
+                block.appendChild(item.cloneNode(deep=True))
+                self.convertBlock(block, main, tabbody, depth)
+                if item.tagName == u'title' and node.tagName == u'sec':
+                    tagindex.rename(block.firstChild, self.heading_tags[depth - 1])
+                for child in list(block.childNodes):
+                    stream.append(child)
+            else:
+                stream.append(item)
+
+    def convertBlock(self, block, main, tabbody, depth):
+        '''Applies the conversions of createMain to the content of block.
+        Sections are not renumbered, so that their ids follow on from those
+        already written.'''
+        self.figNodeHandler(block, main)
+        self.tableWrapNodeHandler(block, main, tabbody)
+        self.refListHandler(block, main)
+        self.boxedTextNodeHandler(block)
+        self.supplementaryMaterialNodeHandler(block, main)
+        self.handleElements(block, main, [tagname for tagname, _handler
+                                          in self.element_handlers])
+        self.divTitleFormat(block, depth)
+
     def createBiblio(self, doc, back):
         '''Create an output file containing the article bibliography'''
         #Initiate the document, returns the document and its body element
@@ -335,15 +517,23 @@ class OPSContent(object):
         
         back = doc.getElementsByTagName('back')[0]
         try:
-            bibbody.appendChild(back.getElementsByTagName('ref-list')[0])
+            ref_list = back.getElementsByTagName('ref-list')[0]
         except IndexError:
             pass
         else:
+            if self.engine == 'xslt':
+                xslt.transform('biblio', [ref_list], {'biblio': bibbody},
+                               self.jid, self.imageFiles(),
+                               self.journalSite())
+                self.epub.writeDocument(self.outputs['Biblio'], biblio)
+                return
+            #The ref-list belongs to the shared Article Document, which is
+            #still read by ContentOPF, so we mutate a copy of it instead
+            bibbody.appendChild(ref_list.cloneNode(deep=True))
             self.refListHandler(bibbody, biblio)
             bibbody.getElementsByTagName('div')[0].setAttribute('id', 'references')
             self.postNodeHandling(bibbody, biblio, ignorelist=[])
-            with open(self.outputs['Biblio'],'wb') as out:
-                out.write(biblio.toprettyxml(encoding = 'utf-8'))
+            self.epub.writeDocument(self.outputs['Biblio'], biblio)
 
     def synopsisAuthors(self, meta, topnode, doc):
         '''Creates the text in synopsis for displaying the authors'''
@@ -384,12 +574,15 @@ class OPSContent(object):
             pass
         else:
             if ack:
+                tagindex.detaching(ack)
                 topnode.appendChild(ack)
-                ack.tagName = 'div'
+                tagindex.attached(ack)
+                tagindex.rename(ack, 'div')
                 ack.setAttribute('id', 'acknowledgments')
                 ack_title = doc.createElement('h2')
                 ack_title.appendChild(doc.createTextNode('Acknowledgments'))
                 ack.insertBefore(ack_title, ack.firstChild)
+                tagindex.attached(ack_title)
 
     def authorContributions(self, topnode, doc):
         '''Takes the optional Author Contributions element from metadata and
@@ -397,13 +590,16 @@ class OPSContent(object):
            References.'''
         anc = self.metadata.article_meta.author_notes_contributions
         if anc:
+            tagindex.detaching(anc)
             topnode.appendChild(anc)
-            anc.tagName = 'div'
+            tagindex.attached(anc)
+            tagindex.rename(anc, 'div')
             anc.removeAttribute('fn-type')
             anc.setAttribute('id', 'contributions')
             anc_title = doc.createElement('h2')
             anc_title.appendChild(doc.createTextNode('Author Contibutions'))
             anc.insertBefore(anc_title, anc.firstChild)
+            tagindex.attached(anc_title)
             
     def parseRef(self, fromnode, doc):
         '''Interprets the references in the article back reference list into
@@ -484,7 +680,8 @@ class OPSContent(object):
             ref_par.appendChild(doc.createTextNode(frs))
             #Give all the article title children to reference paragraph
             if art_tit:
-                ref_par.childNodes += art_tit.childNodes
+                for child in art_tit.childNodes:
+                    ref_par.appendChild(child.cloneNode(deep=True))
             #Begin collecting data for second reference string
             src = cite_tags['source']  # src
             if src:
@@ -520,18 +717,11 @@ class OPSContent(object):
                 alink = doc.createElement('a')
                 alink.appendChild(doc.createTextNode('Find This Article Online'))
                 j_title = self.metadata.journal_meta.title[0]
-                pj= {'PLoS Genetics': u'http://www.plosgenetics.org/{0}{1}{2}{3}',
-                     'PLoS ONE': u'http://www.plosone.org/{0}{1}{2}{3}',
-                     'PLoS Biology': u'http://www.plosbiology.org/{0}{1}{2}{3}',
-                     'PLoS Computational Biology': u'http://www.ploscompbiol.org/{0}{1}{2}{3}',
-                     'PLoS Pathogens': u'http://www.plospathogens.org/{0}{1}{2}{3}',
-                     'PLoS Medicine': u'http://www.plosmedicine.org/{0}{1}{2}{3}',
-                     'PLoS Neglected Tropical Diseases':
-                     u'http://www.plosntds.org/{0}{1}{2}{3}'}
                 if art_tit:
                     art_tit_form = utils.serializeText(art_tit, stringlist=[]).replace(' ', '%20')
-                    href = pj[j_title].format(u'article/findArticle.action?author=',
-                                              first_auth, u'&title=', art_tit_form)
+                    href = u'{0}{1}{2}{3}{4}'.format(journal_sites[j_title],
+                                                     u'article/findArticle.action?author=',
+                                                     first_auth, u'&title=', art_tit_form)
                     alink.setAttribute('href', href)
                     ref_par.appendChild(alink)
         elif citation_type == u'confproc':
@@ -566,7 +756,8 @@ class OPSContent(object):
             ref_par.appendChild(doc.createTextNode(frs))
             #Give all the article title children to reference paragraph
             if art_tit:
-                ref_par.childNodes += art_tit.childNodes
+                for child in art_tit.childNodes:
+                    ref_par.appendChild(child.cloneNode(deep=True))
             cname = cite_tags['conf-name']  # cname
             if cname:
                 cname += '; '
@@ -591,9 +782,10 @@ class OPSContent(object):
                     ext_link.removeAttribute('xlink:type')
                     href = ext_link.getAttribute('xlink:href')
                     ext_link.removeAttribute('xlink:href')
-                    ext_link.tagName = 'a'
+                    tagindex.rename(ext_link, 'a')
                     ext_link.setAttribute('href', href)
-                ref_par.childNodes += com.childNodes
+                for child in com.childNodes:
+                    ref_par.appendChild(child.cloneNode(deep=True))
         
         elif citation_type == u'other':
             ref_string = u'{0}. '.format(utils.getTagText(label))
@@ -624,38 +816,48 @@ class OPSContent(object):
             else:
                 self.refOther(item, stringlist)
         return u''.join(stringlist)
-    
+
+    def findImage(self, name):
+        '''Returns the path, relative to OPS, of the article's image file
+        whose name sans extension is name, or None if it is not in the ePub.
+        The images are looked up in the epubwriter's registry of written
+        files rather than on disk.'''
+        return self.imageFiles().get(name)
+
+    def imageFiles(self):
+        '''Returns the paths, relative to OPS, of the article's image files in
+        the ePub by their names sans extension; see findImage'''
+        images = {}
+        prefix = 'OPS/images-{0}/'.format(self.jid)
+        for entry in self.epub.names:
+            if entry.startswith(prefix):
+                images[os.path.splitext(entry.rsplit('/', 1)[1])[0]] = entry[4:]
+        return images
+
     def postNodeHandling(self, topnode, doc, ignorelist = []):
-        '''A wrapper function for all of the node handlers. Conceptually,
-        this function should be called after special cases have been handled 
-        such as in figures, tables, and references. This function provides 
-        simple access to the entire cohort of default nodeHandlers which may 
-        be utilized after special cases have been handled. Passing a list of 
-        string tagNames allows those tags to be ignored'''
-        handlers = {'bold': self.boldNodeHandler(topnode),
-                    'italic': self.italicNodeHandler(topnode),
-                    'monospace': self.monospaceNodeHandler(topnode),
-                    'sub': self.subNodeHandler(topnode),
-                    'sup': self.supNodeHandler(topnode),
-                    'underline': self.underlineNodeHandler(topnode),
-                    'xref': self.xrefNodeHandler(topnode),
-                    'sec': self.secNodeHandler(topnode),
-                    #'ref-list': self.refListHandler(topnode, doc),
-                    'named-content': self.namedContentNodeHandler(topnode),
-                    'inline-formula': self.inlineFormulaNodeHandler(topnode, doc),
-                    'disp-formula': self.dispFormulaNodeHandler(topnode, doc),
-                    'disp-quote': self.dispQuoteNodeHandler(topnode, doc),
-                    'ext-link': self.extLinkNodeHandler(topnode),
-                    'sc': self.smallCapsNodeHandler(topnode),
-                    'list': self.listNodeHandler(topnode, doc),
-                    'graphic': self.graphicNodeHandler(topnode),
-                    'email': self.emailNodeHandler(topnode),
-                    'fn': self.fnNodeHandler(topnode)}
-        
-        for tagname in handlers:
-            if tagname not in ignorelist:
-                handlers[tagname]
-    
+        '''A wrapper function for all of the element handlers. Conceptually,
+        this function should be called after special cases have been handled
+        such as in figures, tables, and references. This function provides
+        simple access to the entire cohort of default element handlers which
+        may be utilized after special cases have been handled. Passing a list
+        of string tagNames allows those tags to be ignored. Sections without
+        an id are numbered from zero for each call.'''
+        tagnames = [tagname for tagname, _handler in self.element_handlers
+                    if tagname not in ignorelist]
+        self.anonymous_secs = 0
+        self.handleElements(topnode, doc, tagnames)
+
+    def handleElements(self, topnode, doc, tagnames):
+        '''Collects all of the elements beneath topnode with a tagName in
+        tagnames, from the tag index or with a single walk of the tree, then
+        dispatches each one to its handler in self.element_handlers. Handlers
+        are run in the order of that table, and the elements for each handler
+        in document order.'''
+        elements = tagindex.getElementsByTagNames(topnode, tagnames)
+        for tagname, handler in self.element_handlers:
+            for element in elements.get(tagname, []):
+                handler(element, doc)
+
     def refListHandler(self, topnode, doc):
         '''This method has two primary significant uses: it is used to generate
         the bibliographical references section at the end of an article, and at
@@ -668,7 +870,7 @@ class OPSContent(object):
         ref-list node and replacing it with a rendered string andlinks to
         locate the resource online.'''
         try:
-            ref_lists = topnode.getElementsByTagName('ref-list')
+            ref_lists = tagindex.getElementsByTagName(topnode, 'ref-list')
         except AttributeError:
             for item in topnode:
                 self.figNodeHandler(item, doc)
@@ -680,25 +882,27 @@ class OPSContent(object):
                 except IndexError:
                     pass
                 else:
-                    title.tagName = 'h2'
+                    tagindex.rename(title, 'h2')
                 #Then we want to handle each ref in the ref-list
                 ref_ps = []
-                for ref in rl.getElementsByTagName('ref'):
+                for ref in tagindex.getElementsByTagName(rl, 'ref'):
                     ref_ps.append(self.parseRef(ref, doc))
+                    tagindex.detaching(ref)
                     rl.removeChild(ref)
                 #Now that we have our title text and a list of rendered
                 #paragraph tags from our ref tags, we mutate the original tag
-                rl.tagName = 'div'
+                tagindex.rename(rl, 'div')
                 rl.setAttribute('class', 'ref-list')
                 #Add all the ref paragraphs as children
                 for each in ref_ps:
                     rl.appendChild(each)
+                    tagindex.attached(each)
                 
     def figNodeHandler(self, topnode, doc):
         '''Handles conversion of <fig> tags under the provided topnode. Also 
         handles Nodelists by calling itself on each Node in the NodeList.'''
         try:
-            fig_nodes = topnode.getElementsByTagName('fig')
+            fig_nodes = tagindex.getElementsByTagName(topnode, 'fig')
         except AttributeError:
             for item in topnode:
                 self.figNodeHandler(item, doc)
@@ -725,8 +929,10 @@ class OPSContent(object):
                 #Here is a fix for it
                 if fig_parent.tagName == 'body':
                     fig_div = doc.createElement('div')
+                    tagindex.detaching(fig_node)
                     fig_parent.insertBefore(fig_div, fig_node)
                     fig_div.appendChild(fig_node)
+                    tagindex.attached(fig_div)
                     fig_parent = fig_div  # this equates to fig_node.parentNode
                 
                 #This should provide the fragment identifier
@@ -748,13 +954,9 @@ class OPSContent(object):
                 #The following code block uses the fragment identifier to
                 #locate the correct source file based on PLoS convention
                 name = fig_id.split('-')[-1]
-                startpath = os.getcwd()
-                os.chdir(self.outdir)
-                for path, _subdirs, filenames in os.walk('images-{0}'.format(self.jid)):
-                    for filename in filenames:
-                        if os.path.splitext(filename)[0] == name:
-                            img_src = os.path.join(path, filename)
-                os.chdir(startpath)
+                found = self.findImage(name)
+                if found:
+                    img_src = found
                 #Now we can begin to process to output
                 try:
                     img_node.setAttribute('src', img_src)
@@ -773,7 +975,9 @@ class OPSContent(object):
                     img_node.setAttribute('title', fig_long_desc_text)
                 
                 #Replace the fig_node with img_node
+                tagindex.detaching(fig_node)
                 fig_parent.replaceChild(img_node, fig_node)
+                tagindex.attached(img_node)
                 
                 #Handle the figure caption if it exists
                 if fig_caption:
@@ -781,9 +985,9 @@ class OPSContent(object):
                     #We want to handle the <title> in our caption/div as a special case
                     #For this reason, figNodeHandler should be called before divTitleFormat
                     for _title in fig_caption_node.getElementsByTagName('title'):
-                        _title.tagName = u'b'
+                        tagindex.rename(_title, u'b')
                     #Modify this <caption> in situ to <div class="caption">
-                    fig_caption_node.tagName = u'div'
+                    tagindex.rename(fig_caption_node, u'div')
                     fig_caption_node.setAttribute('class', 'caption')
                     if fig_label: #Extract the label text if list non-empty
                         fig_label_text = utils.getTagData(fig_label)
@@ -793,16 +997,18 @@ class OPSContent(object):
                         fig_caption_node.insertBefore(bold_label_text, fig_caption_node.firstChild)
                     #Place after the image node
                     orig_parent.insertBefore(fig_caption_node, fig_sibling)
+                    tagindex.attached(fig_caption_node)
                 
                 #Handle email
                 for email in fig_email:
-                    email.tagName = 'a'
+                    tagindex.rename(email, 'a')
                     text = each.getTagData
                     email.setAttribute('href','mailto:{0}'.format(text))
                     if fig_sibling:
                         fig_parent.insertBefore(email, fig_sibling)
                     else:
                         fig_parent.appendChild(email)
+                    tagindex.attached(email)
                 #ext-links are currently ignored
                 
                 #uris are currently ignored
@@ -812,117 +1018,92 @@ class OPSContent(object):
                 #For more details on what could be potentially handled
                 
     
-    def inlineFormulaNodeHandler(self, topnode, doc):
-        '''Handles <inline-formula> nodes for ePub formatting. At the moment, 
-        there is no way to support MathML (without manual curation) which 
-        would be more optimal for accessibility. If PLoS eventually publishes 
-        the MathML (or SVG) then that option should be handled. For now, the 
-        rasterized images will be placed in-line. This accepts either Nodes or 
-        NodeLists and handles all instances of <inline-formula> beneath them'''
+    def inlineFormulaElementHandler(self, if_node, doc):
+        '''Handles an <inline-formula> element for ePub formatting. At the
+        moment, there is no way to support MathML (without manual curation)
+        which would be more optimal for accessibility. If PLoS eventually
+        publishes the MathML (or SVG) then that option should be handled. For
+        now, the rasterized images will be placed in-line.'''
+        #There is a potential for complexity of content within the
+        #<inline-formula> tag. I have supplied methods for collecting the
+        #complex matter, but do not yet implement its inclusion
+        parent = if_node.parentNode
+        sibling = if_node.nextSibling
+
+        #Potential Attributes
+        if_alt_form_of = if_node.getAttribute('alternate-form-of')
         try:
-            inline_formulas = topnode.getElementsByTagName('inline-formula')
-        except AttributeError:
-            for item in topnode:
-                self.inlineFormulaNodeHandler(topnode, doc)
-        else:
-            #There is a potential for complexity of content within the
-            #<inline-formula> tag. I have supplied methods for collecting the 
-            #complex matter, but do not yet implement its inclusion
-            for if_node in inline_formulas:
-                parent = if_node.parentNode
-                sibling = if_node.nextSibling
-                
-                #Potential Attributes
-                if_alt_form_of = if_node.getAttribute('alternate-form-of')
-                try:
-                    if_node.removeAttribute('alternate-form-of')
-                except xml.dom.NotFoundErr:
-                    pass
-                if_id = if_node.getAttribute('id')
-                
-                #Handle the conversion of emphasis elements
-                #if_node = utils.getFormattedNode(if_node)
-                
-                #Potential contents
-                if_private_char = if_node.getElementsByTagName('private-char')
-                if_tex_math = if_node.getElementsByTagName('tex-math')
-                if_mml_math = if_node.getElementsByTagName('mml:math')
-                if_inline_formula = if_node.getElementsByTagName('inline-formula')
-                if_sub = if_node.getElementsByTagName('sub')
-                if_sup = if_node.getElementsByTagName('sup')
-                
-                #Collect the inline-graphic element, which we will try to use 
-                #in order to create an image node
-                if_inline_graphic = if_node.getElementsByTagName('inline-graphic')
-                img = None
-                if if_inline_graphic:
-                    ig_node = if_inline_graphic[0]
-                    xlink_href_id = ig_node.getAttribute('xlink:href')
-                    name = xlink_href_id.split('.')[-1]
-                    img = None
-                    startpath = os.getcwd()
-                    os.chdir(self.outdir)
-                    for path, _subdirs, filenames in os.walk('images-{0}'.format(self.jid)):
-                        for filename in filenames:
-                            if os.path.splitext(filename)[0] == name:
-                                img = os.path.join(path, filename)
-                    os.chdir(startpath)
-                if img:
-                    imgnode = doc.createElement('img')
-                    imgnode.setAttribute('src', img)
-                    imgnode.setAttribute('alt', 'An inline formula')
-                    parent.insertBefore(imgnode, sibling)
-                
-                parent.removeChild(if_node)
-    
-    def dispFormulaNodeHandler(self, topnode, doc):
-        '''Handles disp-formula nodes'''
+            if_node.removeAttribute('alternate-form-of')
+        except xml.dom.NotFoundErr:
+            pass
+        if_id = if_node.getAttribute('id')
+
+        #Handle the conversion of emphasis elements
+        #if_node = utils.getFormattedNode(if_node)
+
+        #Potential contents
+        if_private_char = if_node.getElementsByTagName('private-char')
+        if_tex_math = if_node.getElementsByTagName('tex-math')
+        if_mml_math = if_node.getElementsByTagName('mml:math')
+        if_inline_formula = if_node.getElementsByTagName('inline-formula')
+        if_sub = if_node.getElementsByTagName('sub')
+        if_sup = if_node.getElementsByTagName('sup')
+
+        #Collect the inline-graphic element, which we will try to use
+        #in order to create an image node
+        if_inline_graphic = if_node.getElementsByTagName('inline-graphic')
+        img = None
+        if if_inline_graphic:
+            ig_node = if_inline_graphic[0]
+            xlink_href_id = ig_node.getAttribute('xlink:href')
+            name = xlink_href_id.split('.')[-1]
+            img = self.findImage(name)
+        if img:
+            imgnode = doc.createElement('img')
+            imgnode.setAttribute('src', img)
+            imgnode.setAttribute('alt', 'An inline formula')
+            parent.insertBefore(imgnode, sibling)
+            tagindex.attached(imgnode)
+
+        tagindex.detaching(if_node)
+        parent.removeChild(if_node)
+
+    def dispFormulaElementHandler(self, disp, doc):
+        '''Handles a <disp-formula> element'''
+        attrs = {'id': None, 'alternate-form-of': None}
+        for attr in attrs:
+            attrs[attr] = disp.getAttribute(attr)
+
         try:
-            disp_formulas = topnode.getElementsByTagName('disp-formula')
-        except AttributeError:
-            for item in topnode:
-                self.dispFormulaNodeHandler(item, doc)
+            graphic = disp.getElementsByTagName('graphic')[0]
+        except IndexError:
+            logging.error('disp-formula element does not contain graphic element')
         else:
-            for disp in disp_formulas:
-                attrs = {'id': None, 'alternate-form-of': None}
-                for attr in attrs:
-                    attrs[attr] = disp.getAttribute(attr)
-                
-                try:
-                    graphic = disp.getElementsByTagName('graphic')[0]
-                except IndexError:
-                    logging.error('disp-formula element does not contain graphic element')
-                else:
-                    graphic_xlink_href = graphic.getAttribute('xlink:href')
-                    if not graphic_xlink_href:
-                        logging.error('graphic xlink:href attribute not present for disp-formula')
-                    else:
-                        name = graphic_xlink_href.split('.')[-1]
-                        img = None
-                        startpath = os.getcwd()
-                        os.chdir(self.outdir)
-                        for path, _subdirs, filenames in os.walk('images-{0}'.format(self.jid)):
-                            for filename in filenames:
-                                if os.path.splitext(filename)[0] == name:
-                                    img = os.path.join(path, filename)
-                        os.chdir(startpath)
-                        
-                        #Convert <label> to <b class="disp-form-label">
-                        #Also move it up a level, after the formula
-                        for item in disp.getElementsByTagName('label'):
-                            disp.parentNode.insertBefore(item, disp.nextSibling)
-                            item.tagName = 'b'
-                            item.setAttribute('class', 'disp-formula-label')
-                        
-                        img_node = doc.createElement('img')
-                        img_node.setAttribute('src', img)
-                        img_node.setAttribute('alt', 'A display formula')
-                        img_node.setAttribute('class', 'disp-formula')
-                        parent = disp.parentNode
-                        parent.insertBefore(img_node, disp)
-                        parent.removeChild(disp)
-                        
-    
+            graphic_xlink_href = graphic.getAttribute('xlink:href')
+            if not graphic_xlink_href:
+                logging.error('graphic xlink:href attribute not present for disp-formula')
+            else:
+                name = graphic_xlink_href.split('.')[-1]
+                img = self.findImage(name)
+
+                #Convert <label> to <b class="disp-form-label">
+                #Also move it up a level, after the formula
+                for item in disp.getElementsByTagName('label'):
+                    tagindex.transplant(item, disp.parentNode,
+                                        disp.nextSibling)
+                    tagindex.rename(item, 'b')
+                    item.setAttribute('class', 'disp-formula-label')
+
+                img_node = doc.createElement('img')
+                img_node.setAttribute('src', img)
+                img_node.setAttribute('alt', 'A display formula')
+                img_node.setAttribute('class', 'disp-formula')
+                parent = disp.parentNode
+                parent.insertBefore(img_node, disp)
+                tagindex.attached(img_node)
+                tagindex.detaching(disp)
+                parent.removeChild(disp)
+
     def tableWrapNodeHandler(self, topnode, doc, tabdoc):
         '''Handles conversion of <table-wrap> tags under the provided topnode. 
         Also handles NodeLists by calling itself on each Node in the NodeList. 
@@ -930,7 +1111,7 @@ class OPSContent(object):
         OPS 2.0.1 compliant output. HTML versions of tables will be exported to
         tables.xml and must be fully HTML compliant'''
         try:
-            table_wraps = topnode.getElementsByTagName('table-wrap')
+            table_wraps = tagindex.getElementsByTagName(topnode, 'table-wrap')
         except AttributeError:
             for item in topnode:
                 self.tableWrapNodeHandler(item, doc)
@@ -969,13 +1150,9 @@ class OPSContent(object):
                 #The following code block uses the fragment identifier to
                 #locate the correct source file based on PLoS convention
                 name = tab_id.split('-')[-1]
-                startpath = os.getcwd()
-                os.chdir(self.outdir)
-                for path, _subdirs, filenames in os.walk('images-{0}'.format(self.jid)):
-                    for filename in filenames:
-                        if os.path.splitext(filename)[0] == name:
-                            img_src = os.path.join(path, filename)
-                os.chdir(startpath)
+                found = self.findImage(name)
+                if found:
+                    img_src = found
                 
                 #Now we can begin to process to output
                 try:
@@ -994,7 +1171,9 @@ class OPSContent(object):
                     img_node.setAttribute('title', tab_long_desc_text)
                 
                 #Replace the tab_wrap_node with img_node
+                tagindex.detaching(tab_wrap)
                 tab_parent.replaceChild(img_node, tab_wrap)
+                tagindex.attached(img_node)
                 
                 #Handle the table caption if it exists
                 tab_caption_title_node = None
@@ -1008,26 +1187,34 @@ class OPSContent(object):
                 tab_header = doc.createElement('div')
                 tab_header.setAttribute('class', 'table_header')
                 tab_header.setAttribute('id', tab_id)
+                #The tab_wrap has been replaced, so its label and caption may
+                #be moved rather than copied. A label found elsewhere, as in
+                #a footnote, is still needed there. The email elements are
+                #moved on their own below, so a caption holding them must be
+                #copied.
                 if tab_label:
                     tab_header_b = doc.createElement('b')
-                    for item in tab_label[0].childNodes:
-                        tab_header_b.appendChild(item.cloneNode(deep=True))
+                    tagindex.transplantChildren(tab_label[0], tab_header_b,
+                        copy = tab_label[0].parentNode is not tab_wrap)
                     tab_header_b.appendChild(doc.createTextNode(u'. '))
                     tab_header.appendChild(tab_header_b)
                 if tab_caption_title_node:
-                    for item in tab_caption_title_node.childNodes:
-                        tab_header.appendChild(item.cloneNode(deep = True))
+                    tagindex.transplantChildren(tab_caption_title_node,
+                                                tab_header,
+                                                copy = bool(tab_email))
                 tab_parent.insertBefore(tab_header, img_node)
+                tagindex.attached(tab_header)
                 
                 #Handle email
                 for email in tab_email:
-                    email.tagName = 'a'
+                    tagindex.rename(email, 'a')
                     text = each.getTagData
                     email.setAttribute('href','mailto:{0}'.format(text))
                     if tab_sibling:
                         tab_parent.insertBefore(email, tab_sibling)
                     else:
                         tab_parent.appendChild(email)
+                    tagindex.attached(email)
                 
                 #Handle <table>s: This is an XHTML Table Model (less the <caption>)
                 #These text format tables are useful alternatives to the 
@@ -1045,10 +1232,8 @@ class OPSContent(object):
                         table.setAttribute('id', tab_id)
                         tab_first = False
                     #Unfortunately, this XHTML Table Model is allowed to have
-                    #unorthodox elements... the fooNodeHandler methods may be necessary
-                    self.boldNodeHandler(table)
-                    self.xrefNodeHandler(table)
-                    self.italicNodeHandler(table)
+                    #unorthodox elements... the element handlers may be necessary
+                    self.handleElements(table, doc, ['bold', 'xref', 'italic'])
                     
                     #Add the table to the table document
                     tabdoc.appendChild(table)
@@ -1059,6 +1244,7 @@ class OPSContent(object):
                     h_link.setAttribute('href', self.tab_frag.format(tab_id))
                     h_link.appendChild(doc.createTextNode('HTML version of this table'))
                     tab_parent.insertBefore(h_link, tab_sibling)
+                    tagindex.attached(h_link)
                 
                 #Handle <table-wrap-foot>
                 #Because the contents of this element are presented by PLoS in 
@@ -1068,10 +1254,9 @@ class OPSContent(object):
                 for tab_foot in tab_wrap_foots:
                     foot_div = doc.createElement('div')
                     foot_div.setAttribute('class', 'footnotes')
-                    for child in tab_foot.childNodes:
-                        foot_div.appendChild(child.cloneNode(deep = True))
+                    tagindex.transplantChildren(tab_foot, foot_div)
                     for fn in foot_div.getElementsByTagName('fn'):
-                        fn.tagName = 'div'
+                        tagindex.rename(fn, 'div')
                         try:
                             fn.removeAttribute('symbol')
                         except xml.dom.NotFoundErr:
@@ -1087,20 +1272,19 @@ class OPSContent(object):
                             pass
                         for label in foot_div.getElementsByTagName('label'):
                             if utils.getTagText(label):
-                                label.tagName = u'b'
+                                tagindex.rename(label, u'b')
                             else:
                                 label_parent = label.parentNode
                                 label_parent.removeChild(label)
                         for title in foot_div.getElementsByTagName('title'):
-                            title.tagName = u'b'
+                            tagindex.rename(title, u'b')
                         for cps in foot_div.getElementsByTagName('copyright-statement'):
-                            cps.tagName = u'p'
+                            tagindex.rename(cps, u'p')
                         for attr in foot_div.getElementsByTagName('attrib'):
-                            attr.tagName = u'p'
+                            tagindex.rename(attr, u'p')
                         
-                        self.boldNodeHandler(foot_div)
-                        self.xrefNodeHandler(foot_div)
-                        self.italicNodeHandler(foot_div)
+                        self.handleElements(foot_div, doc,
+                                            ['bold', 'xref', 'italic'])
                         
                         tabdoc.appendChild(foot_div)
                         
@@ -1128,7 +1312,7 @@ class OPSContent(object):
         keep_attrs = ['id']
         
         try:
-            boxed_texts = topnode.getElementsByTagName('boxed-text')
+            boxed_texts = tagindex.getElementsByTagName(topnode, 'boxed-text')
         except AttributeError:
             for item in topnode:
                 self.boxedTextNodeHandler(item)
@@ -1145,10 +1329,10 @@ class OPSContent(object):
                             pass
                         
                 parent = boxed_text.parentNode
-                boxed_text.tagName = 'blockquote'
+                tagindex.rename(boxed_text, 'blockquote')
                 boxed_text_titles = boxed_text.getElementsByTagName('title')
                 for title in boxed_text.getElementsByTagName('title'):
-                    title.tagName = u'b'
+                    tagindex.rename(title, u'b')
     
     def supplementaryMaterialNodeHandler(self, topnode, doc):
         '''Handles conversion of <supplementary-material> tags under the 
@@ -1156,7 +1340,7 @@ class OPSContent(object):
         Node in the NodeList.'''
         
         try:
-            supp_mats = topnode.getElementsByTagName('supplementary-material')
+            supp_mats = tagindex.getElementsByTagName(topnode, 'supplementary-material')
         except AttributeError:
             for item in topnode:
                 self.supplementaryMaterialNodeHandler(item)
@@ -1183,7 +1367,7 @@ class OPSContent(object):
                         except xml.dom.NotFoundErr:
                             pass
                             
-                supp_mat.tagName = 'div' #Convert supplementary-material to div
+                tagindex.rename(supp_mat, 'div') #Convert supplementary-material to div
                 
                 try:
                     supp_mat_object_id = supp_mat.getElementsByTagName('object-id')[0]
@@ -1191,6 +1375,7 @@ class OPSContent(object):
                     supp_mat_object_id = None
                 else:
                     #We remove this tag and ignore it for now
+                    tagindex.detaching(supp_mat_object_id)
                     supp_mat.removeChild(supp_mat_object_id)
                 
                 try: #Convert the label to bold if it exists
@@ -1198,14 +1383,14 @@ class OPSContent(object):
                 except IndexError:
                     supp_mat_label = None
                 else:
-                    supp_mat_label.tagName = u'b'
+                    tagindex.rename(supp_mat_label, u'b')
                     
                 try:
                     supp_mat_caption =supp_mat.getElementsByTagName('caption')[0]
                 except IndexError:
                     supp_mat_caption = None
                 else:
-                    supp_mat_caption.tagName = u'div' 
+                    tagindex.rename(supp_mat_caption, u'div')
                 
                 #A mapping of 4-character codes to web addresses
                 plos_jrns= {'pgen': 'http://www.plosgenetics.org/', 
@@ -1230,514 +1415,352 @@ class OPSContent(object):
                         anchor = doc.createElement('a')
                         anchor.setAttribute('href', href)
                         if supp_mat_label:
+                            tagindex.detaching(supp_mat_label)
                             supp_mat.insertBefore(anchor, supp_mat_label)
                             anchor.appendChild(supp_mat_label)
+                            tagindex.attached(anchor)
                 
-    def boldNodeHandler(self, topnode):
-        '''Handles proper conversion of <bold> tags under the provided 
-        topnode. Also handles NodeLists by calling itself on each Node in the 
-        NodeList'''
-        try:
-            bold_nodes = topnode.getElementsByTagName('bold')
-            
-        except AttributeError:
-            for item in topnode:
-                self.boldNodeHandler(item)
-        else:
-            #In this case, we can just modify them in situ
-            for bold_node in bold_nodes:
-                bold_node.tagName = u'b'
+    def boldElementHandler(self, bold_node, doc):
+        '''Handles proper conversion of a <bold> element'''
+        #In this case, we can just modify it in situ
+        tagindex.rename(bold_node, u'b')
 
-                
-    def italicNodeHandler(self, topnode):
-        '''Handles proper conversion of <italic> tags under the provided 
-        topnode. Also handles NodeLists by calling itself on each Node in the 
-        NodeList'''
+    def italicElementHandler(self, italic_node, doc):
+        '''Handles proper conversion of an <italic> element'''
+        #In this case, we can just modify it in situ
+        tagindex.rename(italic_node, u'i')
+
+    def monospaceElementHandler(self, mono_node, doc):
+        '''Handles proper conversion of a <monospace> element'''
+        #In this case, we can just modify it in situ
+        tagindex.rename(mono_node, u'span')
+        mono_node.setAttribute('style', 'font-family:monospace')
+
+    def dispQuoteElementHandler(self, disp, doc):
+        '''Handles proper conversion of a <disp-quote> element'''
+        attrs = {'content-type': None, 'id': None,
+                 'specific-use': None, 'xml:lang': None}
+        for attr in attrs:
+            attrs[attr] = disp.getAttribute(attr)
+            try:
+                disp.removeAttribute(attr)
+            except xml.dom.NotFoundErr:
+                pass
+
+        tagindex.rename(disp, u'span')
+        disp.setAttribute('class', 'disp-quote')
+        disp_ps = disp.getElementsByTagName('p')
+        first = True
+        for disp_p in disp_ps:
+            if not first:
+                br = disp.insertBefore(doc.createElement('br'), disp_p)
+                tagindex.attached(br)
+            for child in list(disp_p.childNodes):
+                tagindex.transplant(child, disp, disp_p)
+            tagindex.detaching(disp_p)
+            disp.removeChild(disp_p)
+            first = False
+
+        #parent = disp.parentNode
+        #grandparent = parent.parentNode
+        #disp_index = parent.childNodes.index(disp)
+        #parent_sibling = parent.nextSibling
+
+        #disp_p = doc.createElement('p')
+        #grandparent.insertBefore(disp_p, parent_sibling)
+        #new_p = doc.createElement('p')
+        #grandparent.insertBefore(new_p, parent_sibling)
+        #for each in parent.childNodes[disp_index + 1:]:
+        #    new_p.appendChild(each)
+
+    def subElementHandler(self, sub_node, doc):
+        '''Handles the potential attribute \"arrange\" for a sub element'''
+        arrange = sub_node.getAttribute('arrange')
+        if arrange:
+            sub_node.removeAttribute('arrange')
+            sub_node.setAttribute('class', arrange)
+
+    def supElementHandler(self, sup_node, doc):
+        '''Handles the potential attribute \"arrange\" for a sup element'''
+        arrange = sup_node.getAttribute('arrange')
+        if arrange:
+            sup_node.removeAttribute('arrange')
+            sup_node.setAttribute('class', arrange)
+
+    def smallCapsElementHandler(self, sc_node, doc):
+        '''Handles proper conversion of a <sc> element'''
+        #In this case, we can just modify it in situ
+        tagindex.rename(sc_node, u'span')
+        sc_node.setAttribute('style', 'font-variant:small-caps')
+
+    def underlineElementHandler(self, underline_node, doc):
+        '''Handles proper conversion of an <underline> element'''
+        #In this case, we can just modify it in situ
+        tagindex.rename(underline_node, u'span')
+        underline_node.setAttribute('style', 'text-decoration:underline')
+
+    def namedContentElementHandler(self, nc_node, doc):
+        '''Handles the <named-content> tag. This method needs development to
+        fit PLoS practice.'''
+
+        #The content-type attribute can be used to identify the subject or type
+        #of content that makes this word or phrase semantically special and,
+        #therefore, to be treated differently. For example, this attribute
+        #could be used to identify a drug name, company name, or product name.
+        #It could be used to define systematics terms, such as genus, family,
+        #order, or suborder. It could also be used to identify biological
+        #components, such as gene, protein, or peptide. It could be used to
+        #name body systems, such as circulatory or skeletal. Therefore, values
+        #may include information classes, semantic categories, or types of
+        #nouns such as "generic-drug-name", "genus-species", "gene", "peptide",
+        #"product", etc.
+
+        #In this case, we modify it in situ
+        nc_content_type = nc_node.getAttribute('content-type')
         try:
-            italic_nodes = topnode.getElementsByTagName('italic')
-        except AttributeError:
-            for item in topnode:
-                self.italicNodeHandler(item)
-        else:
-            #In this case, we can just modify them in situ
-            for italic_node in italic_nodes:
-                italic_node.tagName = u'i'
-
-    def monospaceNodeHandler(self, topnode):
-        '''Handles proper conversion of <monospace> tags under the provided 
-        topnode. Also handles NodeLists by calling itself on each Node in the 
-        NodeList'''
+            nc_node.removeAttribute('content-type')
+        except xml.dom.NotFoundErr:
+            pass
+        nc_id = nc_node.getAttribute('id')
+        nc_xlink_actuate = nc_node.getAttribute('xlink:actuate')
         try:
-            monospace_nodes = topnode.getElementsByTagName('monospace')
-        except AttributeError:
-            for item in topnode:
-                self.monospaceNodeHandler(item)
-        else:
-            #In this case, we can just modify them in situ
-            for mono_node in monospace_nodes:
-                mono_node.tagName = u'span'
-                mono_node.setAttribute('style', 'font-family:monospace')
-                
-    def dispQuoteNodeHandler(self, topnode, doc):
-        '''Handles proper conversion of <disp-quote> tags under the provided 
-        topnode. Also handles NodeLists by calling itself on each Node in the 
-        NodeList'''
+            nc_node.removeAttribute('xlink:actuate')
+        except xml.dom.NotFoundErr:
+            pass
+        nc_xlink_href = nc_node.getAttribute('xlink:href')
         try:
-            disp_quote_nodes = topnode.getElementsByTagName('disp-quote')
-        except AttributeError:
-            for item in topnode:
-                self.dispQuoteNodeHandler(item, doc)
-        else:
-            for disp in disp_quote_nodes:
-                
-                attrs = {'content-type': None, 'id': None, 
-                         'specific-use': None, 'xml:lang': None}
-                for attr in attrs:
-                    attrs[attr] = disp.getAttribute(attr)
-                    try:
-                        disp.removeAttribute(attr)
-                    except xml.dom.NotFoundErr:
-                        pass
-                    
-                    disp.tagName = u'span'
-                    disp.setAttribute('class', 'disp-quote')
-                    disp_ps = disp.getElementsByTagName('p')
-                    first = True
-                    for disp_p in disp_ps:
-                        if not first:
-                            disp.insertBefore(doc.createElement('br'), disp_p)
-                        for child in disp_p.childNodes:
-                            disp.insertBefore(child, disp_p)
-                        disp.removeChild(disp_p)
-                        first = False
-                        
-                    #parent = disp.parentNode
-                    #grandparent = parent.parentNode
-                    #disp_index = parent.childNodes.index(disp)
-                    #parent_sibling = parent.nextSibling
-                    
-                    #disp_p = doc.createElement('p')
-                    #grandparent.insertBefore(disp_p, parent_sibling)
-                    #new_p = doc.createElement('p')
-                    #grandparent.insertBefore(new_p, parent_sibling)
-                    #for each in parent.childNodes[disp_index + 1:]:
-                    #    new_p.appendChild(each)
-                        
-                    #Now that we have modified the structure, modify the tag
-                    #and it's children:
-                    
-    
-    def subNodeHandler(self, topnode):
-        '''Handles the potential attribute \"arrange\" for sub elements under 
-        the provided Node. Also handles NodeLists by calling itself on each 
-        Node in the NodeList'''
+            nc_node.removeAttribute('xlink:href')
+        except xml.dom.NotFoundErr:
+            pass
+        nc_xlink_role = nc_node.getAttribute('xlink:role')
         try:
-            sub_nodes = topnode.getElementsByTagName('sub')
-        except AttributeError:
-            for item in topnode:
-                self.subNodeHandler(item)
-        else:
-            for sub_node in sub_nodes:
-                arrange = sub_node.getAttribute('arrange')
-                if arrange:
-                    sub_node.removeAttribute('arrange')
-                    sub_node.setAttribute('class', arrange)
-    
-    def supNodeHandler(self, topnode):
-        '''Handles the potential attribute \"arrange\" for sup elements under 
-        the provided Node. Also handles NodeLists by calling itself on each 
-        Node in the NodeList'''
+            nc_node.removeAttribute('xlink:role')
+        except xml.dom.NotFoundErr:
+            pass
+        nc_xlink_show = nc_node.getAttribute('xlink:show')
         try:
-            sup_nodes = topnode.getElementsByTagName('sup')
-        except AttributeError:
-            for item in topnode:
-                self.subNodeHandler(item)
-        else:
-            for sup_node in sup_nodes:
-                arrange = sup_node.getAttribute('arrange')
-                if arrange:
-                    sup_node.removeAttribute('arrange')
-                    sup_node.setAttribute('class', arrange)
-    
-    def smallCapsNodeHandler(self, topnode):
-        '''Handles proper conversion of <sc> tags under the provided 
-        topnode. Also handles NodeLists by calling itself on each Node in the 
-        NodeList'''
+            nc_node.removeAttribute('xlink:show')
+        except xml.dom.NotFoundErr:
+            pass
+        nc_xlink_title = nc_node.getAttribute('xlink:title')
         try:
-            sc_nodes = topnode.getElementsByTagName('sc')
-        except AttributeError:
-            for item in topnode:
-                self.smallCapsNodeHandler(item)
-        else:
-            #In this case, we can just modify them in situ
-            for sc_node in sc_nodes:
-                sc_node.tagName = u'span'
-                sc_node.setAttribute('style', 'font-variant:small-caps')
-    
-    def underlineNodeHandler(self, topnode):
-        '''Handles proper conversion of <underline> tags under the provided 
-        topnode. Also handles NodeLists by calling itself on each Node in the 
-        NodeList'''
+            nc_node.removeAttribute('xlink:title')
+        except xml.dom.NotFoundErr:
+            pass
+        nc_xlink_type = nc_node.getAttribute('xlink:type')
         try:
-            underline_nodes = topnode.getElementsByTagName('underline')
-        except AttributeError:
-            for item in topnode:
-                self.underlineNodeHandler(item)
-        else:
-            #In this case, we can just modify them in situ
-            for underline_node in underline_nodes:
-                underline_node.tagName = u'span'
-                underline_node.setAttribute('style', 'text-decoration:underline')
-    
-    def namedContentNodeHandler(self, topnode):
-        '''Handles the <named-content> tag. This method needs development to 
-        fit PLoS practice. Handles NodeLists by calling itself on each Node in 
-        the NodeList'''
-        
-        #The content-type attribute can be used to identify the subject or type 
-        #of content that makes this word or phrase semantically special and, 
-        #therefore, to be treated differently. For example, this attribute 
-        #could be used to identify a drug name, company name, or product name. 
-        #It could be used to define systematics terms, such as genus, family, 
-        #order, or suborder. It could also be used to identify biological 
-        #components, such as gene, protein, or peptide. It could be used to 
-        #name body systems, such as circulatory or skeletal. Therefore, values 
-        #may include information classes, semantic categories, or types of 
-        #nouns such as "generic-drug-name", "genus-species", "gene", "peptide", 
-        #"product", etc.
-        
+            nc_node.removeAttribute('xlink:type')
+        except xml.dom.NotFoundErr:
+            pass
+        nc_xmlns_xlink = nc_node.getAttribute('xmlns:xlink')
         try:
-            namedcontent_nodes = topnode.getElementsByTagName('named-content')
-        except AttributeError:
-            for item in topnode:
-                self.namedContentNodeHandler(item)
-        else:
-            #In this case, we modify them in situ
-            for nc_node in namedcontent_nodes:
-                nc_content_type = nc_node.getAttribute('content-type')
-                try:
-                    nc_node.removeAttribute('content-type')
-                except xml.dom.NotFoundErr:
-                    pass
-                nc_id = nc_node.getAttribute('id')
-                nc_xlink_actuate = nc_node.getAttribute('xlink:actuate')
-                try:
-                    nc_node.removeAttribute('xlink:actuate')
-                except xml.dom.NotFoundErr:
-                    pass
-                nc_xlink_href = nc_node.getAttribute('xlink:href')
-                try:
-                    nc_node.removeAttribute('xlink:href')
-                except xml.dom.NotFoundErr:
-                    pass
-                nc_xlink_role = nc_node.getAttribute('xlink:role')
-                try:
-                    nc_node.removeAttribute('xlink:role')
-                except xml.dom.NotFoundErr:
-                    pass
-                nc_xlink_show = nc_node.getAttribute('xlink:show')
-                try:
-                    nc_node.removeAttribute('xlink:show')
-                except xml.dom.NotFoundErr:
-                    pass
-                nc_xlink_title = nc_node.getAttribute('xlink:title')
-                try:
-                    nc_node.removeAttribute('xlink:title')
-                except xml.dom.NotFoundErr:
-                    pass
-                nc_xlink_type = nc_node.getAttribute('xlink:type')
-                try:
-                    nc_node.removeAttribute('xlink:type')
-                except xml.dom.NotFoundErr:
-                    pass
-                nc_xmlns_xlink = nc_node.getAttribute('xmlns:xlink')
+            nc_node.removeAttribute('xmlns:xlink')
+        except xml.dom.NotFoundErr:
+            pass
+
+        #Current approach: convert to <span style="content-type">
+        tagindex.rename(nc_node, u'span')
+        nc_node.setAttribute('style', nc_content_type)
+
+    def secElementHandler(self, sec_node, doc):
+        '''Handles proper conversion of a <sec> element. Sections without an
+        id are numbered in document order for each call to postNodeHandling.'''
+        #In this case, we can just modify it in situ
+        tagindex.rename(sec_node, u'div')
+        try:
+            sec_node.removeAttribute('sec-type')
+        except xml.dom.NotFoundErr:
+            pass
+        if not sec_node.getAttribute('id'):
+            id = 'OA-EPUB-{0}'.format(str(self.anonymous_secs))
+            self.anonymous_secs += 1
+            sec_node.setAttribute('id', id)
+
+    def xrefElementHandler(self, xref_node, doc):
+        '''Handles conversion of an <xref> element. These are utilized for
+        internal crossreferencing.'''
+        tagindex.rename(xref_node, u'a') #Convert to <a> tag
+        #Handle the ref-type attribute
+        ref_type = xref_node.getAttribute('ref-type')
+        xref_node.removeAttribute('ref-type')
+        #Handle the rid attribute
+        rid = xref_node.getAttribute('rid')
+        xref_node.removeAttribute('rid')
+        #Set the href attribute
+        href = self.ref_map[ref_type].format(rid)
+        xref_node.setAttribute('href', href)
+
+    def emailElementHandler(self, email, doc):
+        '''Handles conversion of an <email> element'''
+        attrs = {'xlink:actuate': None, 'xlink:href': None,
+                 'xlink:role': None, 'xlink:show': None,
+                 'xlink:title': None, 'xlink:type': None,
+                 'xmlns:xlink': None}
+        for attr in attrs:
+            attrs[attr] = email.getAttribute(attr)
+            try:
+                email.removeAttribute(attr)
+            except xml.dom.NotFoundErr:
+                pass
+        tagindex.rename(email, u'a')
+        address = utils.getTagText(email)
+        href = u'mailto:{0}'.format(address)
+        email.setAttribute('href', href)
+
+    def fnElementHandler(self, fn, doc):
+        '''Handles conversion of a <fn> element. These are used for footnotes,
+        so the general idea is to convert the tagname and give it a class
+        attribute'''
+        keep_attrs = ['id']
+
+        tagindex.rename(fn, u'span')
+        #Handle the potential attributes
+        attrs = {'fn-type': None, 'id': None, 'symbol': None,
+                 'xml:lang': None}
+        for attr in attrs:
+            if attr not in keep_attrs:
                 try:
-                    nc_node.removeAttribute('xmlns:xlink')
+                    fn.removeAttribute(attr)
                 except xml.dom.NotFoundErr:
                     pass
-                
-                #Current approach: convert to <span style="content-type">
-                nc_node.tagName = u'span'
-                nc_node.setAttribute('style', nc_content_type)
-        
-    
-    def secNodeHandler(self, topnode):
-        '''Handles proper conversion of <sec> tags under the provided topnode.
-        Also handles NodeLists by calling itself on each Node in the NodeList. 
-        '''
-        try:
-            sec_nodes = topnode.getElementsByTagName('sec')
-        except AttributeError:
-            for item in topnode:
-                self.secNodeHandler(item)
-        else:
-            #In this case, we can just modify them in situ
-            c = 0
-            for sec_node in sec_nodes:
-                sec_node.tagName = u'div'
+        #Assign the class attribute to "footnote"
+        fn.setAttribute('class', 'footnote')
+        #If there is a <p> tag inside, take it's children and remove <p>
+        fn_ps = fn.getElementsByTagName('p')
+        for fn_p in fn_ps:
+            for child in list(fn_p.childNodes):
+                tagindex.transplant(child, fn, fn_p)
+            tagindex.detaching(fn_p)
+            fn.removeChild(fn_p)
+
+    def extLinkElementHandler(self, ext_link, doc):
+        '''Handles conversion of an <ext-link> element. These are utilized for
+        external referencing.'''
+        keep_attrs = ['id']
+
+        tagindex.rename(ext_link, u'a') #convert to <a>
+        #Handle the potential attributes
+        attrs = {'ext-link-type': None, 'id': None,
+                 'xlink:actuate': None, 'xlink:href': None,
+                 'xlink:role': None, 'xlink:show': None,
+                 'xlink:title': None, 'xlink:type': None,
+                 'xmlns:xlink': None}
+
+        for attr in attrs:
+            attrs[attr] = ext_link.getAttribute(attr)
+            if attr not in keep_attrs:
                 try:
-                    sec_node.removeAttribute('sec-type')
+                    ext_link.removeAttribute(attr)
                 except xml.dom.NotFoundErr:
                     pass
-                if not sec_node.getAttribute('id'):
-                    id = 'OA-EPUB-{0}'.format(str(c))
-                    c += 1
-                    sec_node.setAttribute('id', id)
-    
-    def xrefNodeHandler(self, topnode):
-        '''Handles conversion of <xref> tags. These tags are utilized for 
-        internal crossreferencing. Works on all tags under the provided Node 
-        or under all Nodes in a NodeList.'''
-        
-        #We need mappings for local files to ref-type attribute values
-        ref_map = {u'bibr': self.bib_frag,
-                   u'fig': self.main_frag,
-                   u'supplementary-material': self.main_frag,
-                   u'table': self.main_frag,
-                   u'aff': self.syn_frag,
-                   u'sec': self.main_frag,
-                   u'table-fn': self.tab_frag,
-                   u'boxed-text': self.main_frag,
-                   u'other': self.main_frag,
-                   u'disp-formula': self.main_frag}
-        
-        try:
-            xref_nodes = topnode.getElementsByTagName('xref')
-        except AttributeError:
-            for item in topnode:
-                self.xrefNodeHandler(item)
-        else:
-            for xref_node in xref_nodes:
-                xref_node.tagName = u'a' #Convert to <a> tag
-                #Handle the ref-type attribute
-                ref_type = xref_node.getAttribute('ref-type')
-                xref_node.removeAttribute('ref-type')
-                #Handle the rid attribute
-                rid = xref_node.getAttribute('rid')
-                xref_node.removeAttribute('rid')
-                #Set the href attribute
-                href = ref_map[ref_type].format(rid)
-                xref_node.setAttribute('href', href)
-                
-    
-    def emailNodeHandler(self, topnode):
-        '''Handles conversion of <email> tags underneath the provided Node 
-        or NodeList.'''
-        
-        try:
-            emails = topnode.getElementsByTagName('email')
-        except AttributeError:
-            for item in topnode:
-                self.emailNodeHandler(item)
-        else:
-            for email in emails:
-                attrs = {'xlink:actuate': None, 'xlink:href': None, 
-                         'xlink:role': None, 'xlink:show': None, 
-                         'xlink:title': None, 'xlink:type': None, 
-                         'xmlns:xlink': None}
-                for attr in attrs:
-                    attrs[attr] = email.getAttribute(attr)
-                    try:
-                        email.removeAttribute(attr)
-                    except xml.dom.NotFoundErr:
-                        pass
-                email.tagName = u'a'
-                address = utils.getTagText(email)
-                href = u'mailto:{0}'.format(address)
-                email.setAttribute('href', href)
-    
-    def fnNodeHandler(self, topnode):
-        '''Handles conversion of <fn> tags where encountered under the 
-        provided topnode. These are used for footnotes, so the general idea is 
-        to convert their tagname and give them a class attribute'''
-        keep_attrs = ['id']
-        
-        try:
-            fns = topnode.getElementsByTagName('fn')
-        except AttributeError:
-            for item in fns:
-                self.fnNodeHandler(item)
-        else:
-            for fn in fns:
-                fn.tagName = u'span'
-                #Handle the potential attributes
-                attrs = {'fn-type': None, 'id': None, 'symbol': None, 
-                         'xml:lang': None}
-                for attr in attrs:
-                    if attr not in keep_attrs:
-                        try:
-                            fn.removeAttribute(attr)
-                        except xml.dom.NotFoundErr:
-                            pass
-                #Assign the class attribute to "footnote"
-                fn.setAttribute('class', 'footnote')
-                #If there is a <p> tag inside, take it's children and remove <p>
-                fn_ps = fn.getElementsByTagName('p')
-                for fn_p in fn_ps:
-                    for child in fn_p.childNodes:
-                        fn.insertBefore(child, fn_p)
-                    fn.removeChild(fn_p)
-    
-    def extLinkNodeHandler(self, topnode):
-        '''Handles conversion of <ext-link> tags. These tags are utilized for 
-        external referencing. Works on all tags under the provided Node or 
-        under all Nodes in a NodeList.'''
-        
-        keep_attrs = ['id']
-        
-        try:
-            ext_links = topnode.getElementsByTagName('ext-link')
-        except AttributeError:
-            for item in topnode:
-                self.extLinkNodeHandler(item)
-        else:
-            for ext_link in ext_links:
-                ext_link.tagName = u'a' #convert to <a>
-                #Handle the potential attributes
-                attrs = {'ext-link-type': None, 'id': None,
-                         'xlink:actuate': None, 'xlink:href': None,
-                         'xlink:role': None, 'xlink:show': None,
-                         'xlink:title': None, 'xlink:type': None,
-                         'xmlns:xlink': None}
-                
-                for attr in attrs:
-                    attrs[attr] = ext_link.getAttribute(attr)
-                    if attr not in keep_attrs:
-                        try:
-                            ext_link.removeAttribute(attr)
-                        except xml.dom.NotFoundErr:
-                            pass
-                    #Set the href value from the xlink:href
-                    if attrs['xlink:href']:
-                        ext_link.setAttribute('href', attrs['xlink:href'])
-                    
-                    #Logging and Debug section
-                    if not attrs['ext-link-type'] == u'uri':
-                        logging.info('<ext-link> attribute \"ext-link-type\" = {0}'.format(attrs['ext-link-type']))
-                    if not attrs['xlink:type'] == u'simple':
-                        logging.info('<ext-link> attribute \"xlink:type\" = {0}'.format(attrs['xlink:type']))
-    
-    def listNodeHandler(self, topnode, doc):
-        '''Handles conversion of <list> tags which are used to represent data
-        in either a linked fashion with or without linear order. Finds all
-        <list> elements under the provided Node; also works on NodeLists by
-        calling itself on each element in the list'''
-        
-        types = {'order': 'ol', 'bullet': 'ul', 'alpha-lower': 'ol', 
-                 'alpha-upper': 'ol', 'roman-lower': 'ol', 'roman-upper': 'ol', 
+        #Set the href value from the xlink:href
+        if attrs['xlink:href']:
+            ext_link.setAttribute('href', attrs['xlink:href'])
+
+        #Logging and Debug section
+        if not attrs['ext-link-type'] == u'uri':
+            logging.info('<ext-link> attribute \"ext-link-type\" = {0}'.format(attrs['ext-link-type']))
+        if not attrs['xlink:type'] == u'simple':
+            logging.info('<ext-link> attribute \"xlink:type\" = {0}'.format(attrs['xlink:type']))
+
+    def listElementHandler(self, list, doc):
+        '''Handles conversion of a <list> element, used to represent data in
+        either a linked fashion with or without linear order'''
+
+        types = {'order': 'ol', 'bullet': 'ul', 'alpha-lower': 'ol',
+                 'alpha-upper': 'ol', 'roman-lower': 'ol', 'roman-upper': 'ol',
                  'simple': 'ul', '': 'ul'}
-        
-        try: 
-            lists = topnode.getElementsByTagName('list')
-        except AttributeError:
-            for item in topnode:
-                self.listNodeHandler(item, doc)
-        else:
-            for list in lists:
-                
-                parent = list.parentNode
-                grandparent = parent.parentNode
-                list_index = parent.childNodes.index(list)
-                parent_sibling = parent.nextSibling
-                
-                if parent.tagName == 'p':
-                    grandparent.insertBefore(list, parent_sibling)
-                    new_p = doc.createElement('p')
-                    grandparent.insertBefore(new_p, parent_sibling)
-                    for each in parent.childNodes[list_index + 1:]:
-                        new_p.appendChild(each)
-                
-                attrs = {'id': None, 'list-content': None, 'list-type': None, 
-                         'prefix-word': None}
-                
-                #Collect all attribute values into dict and remove from DOM
-                for attr in attrs:
-                    attrs[attr] = list.getAttribute(attr)
-                    try:
-                        list.removeAttribute(attr)
-                    except xml.dom.NotFoundErr:
-                        pass
-                
-                try: #A list has zero or one title elements
-                    list_title_node = list.getElementsByTagName('list')[0]
-                except IndexError:
-                    list_title_node = None
-                else: #Do something with the title element
-                    list.setAttribute('title', utils.serializeText(list_title_node))
-                    list.removeChild(list_title_node)
-                
-                try: #Set tagName as mapped in types{} based on list-type value
-                    list.tagName = types[attrs['list-type']]
-                except KeyError:
-                    logging.warning('unknown list-type value found: {0}'.format(attrs['list-type']))
-                    list.tagName = 'ul'
-                    list.setAttribute('style', 'simple')
-                
-                #Lists can be stacked: we cannot simply use getElementsByTagName
-                
-                list_items = []
-                for child in list.childNodes:
-                    try:
-                        if child.tagName == 'list-item':
-                            list_items.append(child)
-                    except AttributeError:
-                        pass
-                
-                for list_item in list_items:
-                    list_item.tagName = u'li'
-                
-    
-    def graphicNodeHandler(self, topnode):
-        '''Handles rudimentary conversion of <graphic> tags. Typically when 
-        found when not enclosed in any other structure. Finds all <graphic> 
-        tags under the provided topnode. Also works on NodeLists by calling 
-        itself on each node in the NodeList.'''
-        
+
+        parent = list.parentNode
+        grandparent = parent.parentNode
+        list_index = parent.childNodes.index(list)
+        parent_sibling = parent.nextSibling
+
+        if parent.tagName == 'p':
+            tagindex.transplant(list, grandparent, parent_sibling)
+            new_p = doc.createElement('p')
+            grandparent.insertBefore(new_p, parent_sibling)
+            #The list has left the paragraph, what followed it now begins at
+            #its former index
+            for each in parent.childNodes[list_index:]:
+                tagindex.detaching(each)
+                new_p.appendChild(each)
+            tagindex.attached(new_p)
+
+        attrs = {'id': None, 'list-content': None, 'list-type': None,
+                 'prefix-word': None}
+
+        #Collect all attribute values into dict and remove from DOM
+        for attr in attrs:
+            attrs[attr] = list.getAttribute(attr)
+            try:
+                list.removeAttribute(attr)
+            except xml.dom.NotFoundErr:
+                pass
+
+        #A list has zero or one title elements, before its items
+        for child in list.childNodes:
+            if child.nodeType == child.ELEMENT_NODE and child.tagName == 'title':
+                list.setAttribute('title', utils.serializeText(child, stringlist = []))
+                tagindex.detaching(child)
+                list.removeChild(child)
+                break
+
+        try: #Set tagName as mapped in types{} based on list-type value
+            tagindex.rename(list, types[attrs['list-type']])
+        except KeyError:
+            logging.warning('unknown list-type value found: {0}'.format(attrs['list-type']))
+            tagindex.rename(list, 'ul')
+            list.setAttribute('style', 'simple')
+
+        #Lists can be stacked: we cannot simply use getElementsByTagName
+
+        list_items = []
+        for child in list.childNodes:
+            try:
+                if child.tagName == 'list-item':
+                    list_items.append(child)
+            except AttributeError:
+                pass
+
+        for list_item in list_items:
+            tagindex.rename(list_item, u'li')
+
+    def graphicElementHandler(self, graphic, doc):
+        '''Handles rudimentary conversion of a <graphic> element. Typically
+        found when not enclosed in any other structure.'''
+
         #<graphic> elements are commonly found in special contexts:
         #In those cases, decide if this method provides the needed support
         #or if special handling is needed.
-        try:
-            graphics = topnode.getElementsByTagName('graphic')
-        except AttributeError:
-            for item in topnode:
-                self.graphicNodeHandler()
+
+        #Handle graphic Attributes
+        attrs = {'alt-version': None, 'alternate-form-of': None,
+                 'id': None, 'mime-subtype': None, 'mimetype': None,
+                 'position': None, 'xlink:actuate': None,
+                 'xlink:href': None, 'xlink:role': None,
+                 'xlink:title': None, 'xlink:type': None,
+                 'xmlns:xlink': None}
+        for attr in attrs:
+            attrs[attr] = graphic.getAttribute(attr)
+            try:
+                graphic.removeAttribute(attr)
+            except xml.dom.NotFoundErr:
+                pass
+
+        name = attrs['xlink:href'].split('.')[-1]
+        img = self.findImage(name)
+
+        #modify the <graphic> tag to <img>
+        if img:
+            tagindex.rename(graphic, 'img')
+            graphic.setAttribute('src', img)
         else:
-            for graphic in graphics:
-                #Handle graphic Attributes
-                attrs = {'alt-version': None, 'alternate-form-of': None, 
-                         'id': None, 'mime-subtype': None, 'mimetype': None, 
-                         'position': None, 'xlink:actuate': None, 
-                         'xlink:href': None, 'xlink:role': None, 
-                         'xlink:title': None, 'xlink:type': None, 
-                         'xmlns:xlink': None}
-                for attr in attrs:
-                    attrs[attr] = graphic.getAttribute(attr)
-                    try:
-                        graphic.removeAttribute(attr)
-                    except xml.dom.NotFoundErr:
-                        pass
-                
-                name = attrs['xlink:href'].split('.')[-1]
-                img = None
-                startpath = os.getcwd()
-                os.chdir(self.outdir)
-                for path, _subdirs, filenames in os.walk('images-{0}'.format(self.jid)):
-                    for filename in filenames:
-                        if os.path.splitext(filename)[0] == name:
-                            img = os.path.join(path, filename)
-                os.chdir(startpath)
-                
-                #modify the <graphic> tag to <img>
-                if img:
-                    graphic.tagName = 'img'
-                    graphic.setAttribute('src', img)
-                else:
-                    logging.error('graphicNodeHandler: Image source not found')
-    
-    
+            logging.error('graphicElementHandler: Image source not found')
+
     def divTitleFormat(self, fromnode, depth = 0):
         '''A method for converting title tags to heading format tags'''
-        taglist = ['h2', 'h3', 'h4', 'h5', 'h6']
+        taglist = self.heading_tags
         for item in fromnode.childNodes:
             try:
                 tag = item.tagName
@@ -1751,9 +1774,10 @@ class OPSContent(object):
                         pass
                     else:
                         if not divtitle.childNodes:
+                            tagindex.detaching(divtitle)
                             item.removeChild(divtitle)
                         else:
-                            divtitle.tagName = taglist[depth]
+                            tagindex.rename(divtitle, taglist[depth])
                         depth += 1
                         self.divTitleFormat(item, depth)
                         depth -= 1
@@ -1761,12 +1785,8 @@ class OPSContent(object):
     def initiateDocument(self, titlestring):
         '''A method for conveniently initiating a new xml.DOM Document'''
         
-        impl = minidom.getDOMImplementation()
-        
-        mytype = impl.createDocumentType('html', 
-                                         '-//W3C//DTD XHTML 1.1//EN', 
-                                         'http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd')
-        doc = impl.createDocument(None, 'html', mytype)
+        doc = xmlbackend.createDocument('html', '-//W3C//DTD XHTML 1.1//EN',
+                                        'http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd')
         
         root = doc.lastChild #IGNORE:E1101
         root.setAttribute('xmlns', 'http://www.w3.org/1999/xhtml')
@@ -0,0 +1,144 @@
+'''Discovery of the article xml files of a batch directory. The directory is
+read with scandir, from os or, before Python 3.5, the scandir package listed
+in requirements.txt, so that the type of each entry comes from the directory
+listing rather than a stat of its own, and the files are yielded as they are
+found rather than gathered first. Without scandir, an entry named as an input
+is taken to be a file, and other entries are only examined when
+subdirectories are searched. Subdirectories, such as one per journal, are
+searched when recursive; those reached through symbolic links are followed,
+but a directory already searched, such as by a link back up the tree, is not
+searched again.
+
+Files ending in one of extensions are inputs, including those compressed with
+gzip, which are read with openInput(). Inputs may be selected with include and
+exclude glob patterns, each matched against both the name of a file and its
+path relative to the batch directory, with / as the separator; an excluded
+directory is not searched.
+
+Inputs are yielded in order of their names, each directory being sorted in
+turn, or by size, largest first, so that a pool of processes is not left
+waiting on a large article at the end of a batch, or in the order the
+directories list them. Ordering by name must read each directory before
+yielding its first input, and by size every directory; unordered, each input
+is yielded as soon as it is read.
+
+Inputs in different subdirectories may share a name, so whatever is named
+after an input, such as its ePub, is named by relativePath().'''
+
+import fnmatch
+import gzip
+import os
+import os.path
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+#The endings of article xml files, plain or compressed
+extensions = ['.xml', '.xml.gz']
+
+
+def isInput(name):
+    '''Determines if the file name is an article xml file'''
+    return any(name.endswith(extension) for extension in extensions)
+
+
+def inputName(filename):
+    '''Returns the name of the article xml file filename, without its
+    directory or its extension'''
+    name = os.path.basename(filename)
+    for extension in sorted(extensions, key = len, reverse = True):
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return os.path.splitext(name)[0]
+
+
+def openInput(filename):
+    '''Opens the article xml file filename for reading, decompressing it if it
+    is compressed with gzip'''
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def relativePath(filename, directory):
+    '''Returns the path of filename relative to directory, with / as the
+    separator'''
+    return os.path.relpath(filename, directory).replace(os.sep, '/')
+
+
+def listDirectory(directory):
+    '''Yields the (name, path, is directory) of each entry of directory as it
+    is read. Without scandir, whether an entry is a directory is not known
+    and given as None.'''
+    if scandir is not None:
+        for entry in scandir(directory):
+            yield entry.name, entry.path, entry.is_dir()
+        return
+    for name in os.listdir(directory):
+        yield name, os.path.join(directory, name), None
+
+
+def matches(name, relpath, patterns):
+    '''Determines if the name or the relative path relpath of a file matches
+    any of the glob patterns'''
+    return any(fnmatch.fnmatch(name, pattern) or
+               fnmatch.fnmatch(relpath, pattern) for pattern in patterns)
+
+
+def walk(directory, recursive = False, include = None, exclude = None,
+         ordered = True):
+    '''Yields the path of each input in directory, in order of their names if
+    ordered and otherwise as they are read, searching its subdirectories if
+    recursive. Given include patterns, only the inputs matching one are
+    yielded; those matching an exclude pattern never are.'''
+    #Directories still to be searched, with their paths relative to
+    #directory, the next on top
+    stack = [(directory, '')]
+    #The (device, inode) of each directory searched
+    searched = set()
+    while stack:
+        top, relative = stack.pop()
+        stat = os.stat(top)
+        if (stat.st_dev, stat.st_ino) in searched:
+            continue
+        searched.add((stat.st_dev, stat.st_ino))
+        entries = listDirectory(top)
+        if ordered:
+            entries = sorted(entries)
+        subdirs = []
+        for name, path, is_dir in entries:
+            relpath = relative + name
+            if exclude and matches(name, relpath, exclude):
+                continue
+            if is_dir is None:
+                is_dir = (recursive and not isInput(name) and
+                          os.path.isdir(path))
+            if is_dir:
+                if recursive:
+                    subdirs.append((path, relpath + '/'))
+            elif isInput(name):
+                if include and not matches(name, relpath, include):
+                    continue
+                yield path
+        stack.extend(reversed(subdirs))
+
+
+def discover(directory, recursive = False, include = None, exclude = None,
+             order = 'name'):
+    '''Yields the inputs in directory as walk() does, in the given order,
+    'name', 'size' or 'none', for the order in which they are read'''
+    if order == 'none':
+        return walk(directory, recursive, include, exclude, False)
+    if order == 'name':
+        return walk(directory, recursive, include, exclude)
+    if order == 'size':
+        inputs = walk(directory, recursive, include, exclude)
+        sizes = [(os.path.getsize(path), path) for path in inputs]
+        sizes.sort(key = lambda size: size[0], reverse = True)
+        return (path for _size, path in sizes)
+    raise ValueError('Unknown order: {0}'.format(order))
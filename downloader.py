@@ -0,0 +1,651 @@
+'''Fetching of article resources over HTTP. Every network request of the
+project goes through the shared Session, which keeps idle connections open in
+a pool per host so that later requests to the same publisher reuse them
+instead of connecting again. Session.opened and Session.reused count the
+connections made and the requests which found one waiting.
+
+The requests for a batch of URLs are spread over a bounded pool of threads.
+The requests to each host are paced and their number in flight is adapted to
+how the server responds, so that a publisher's server is kept as busy as it
+will tolerate without being flooded, and failed requests are retried with
+backoff. Results are handed back in the order the URLs were given, so callers
+may write them out as they arrive without any locking of their own.
+
+Requests may be made conditional on a resource having changed since it was
+cached, with the validators the server gave for it (see conditions() and
+responseMetadata()), so that an unchanged resource costs a 304 Not Modified
+response rather than a full transfer.
+
+Bodies may be streamed into files, chunk_size bytes at a time, rather than
+read into memory, and their length is checked against the Content-Length the
+server gave. A progress callback, such as a Throughput, may watch them
+arrive.
+
+The fetcher shared by the rest of the run is configured with configure().'''
+
+import httplib
+import logging
+import os
+import os.path
+import random
+import socket
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from cStringIO import StringIO
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+#Streamed bodies are read and written this many bytes at a time
+chunk_size = 64 * 1024
+
+
+class Response(object):
+    '''A complete HTTP response, read before its connection went back to the
+    pool. It offers the parts of the urllib2 response interface used here.
+    The body of a streamed response is not held; it was written to a file,
+    named by filename where the Fetcher made it.'''
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.code = status
+        self.msg = reason
+        self.headers = headers
+        self.body = body
+        self.filename = None
+
+    def read(self):
+        if self.body is None and self.filename is not None:
+            with open(self.filename, 'rb') as body:
+                return body.read()
+        return self.body
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+
+class Session(object):
+    '''Makes HTTP GET requests over persistent connections, keeping up to
+    max_idle idle connections to each host. Proxies are taken from the
+    environment, as urllib2 does, and redirects are followed. Errors are
+    raised as urllib2.HTTPError and urllib2.URLError, so that callers may
+    handle them as they would for urllib2.urlopen().'''
+    def __init__(self, max_idle = 4, timeout = 60):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.proxies = urllib.getproxies()
+        #(scheme, host) -> list of idle connections
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def stats(self):
+        '''Returns a description of the connection counters'''
+        msg = '{0} HTTP connections opened, {1} requests reused a connection'
+        return msg.format(self.opened, self.reused)
+
+    def route(self, url):
+        '''Returns the (scheme, host) to connect to for url, the host given
+        to a proxy tunnel (or None), and the path to request'''
+        parts = urlparse.urlsplit(url)
+        path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query,
+                                    ''))
+        proxy = self.proxies.get(parts.scheme)
+        if not proxy or urllib.proxy_bypass(parts.hostname or ''):
+            return (parts.scheme, parts.netloc), None, path
+        proxy = urlparse.urlsplit(proxy)
+        if parts.scheme == 'https':
+            return (proxy.scheme, proxy.netloc), parts.netloc, path
+        #A plain HTTP proxy is sent the whole URL
+        return (proxy.scheme, proxy.netloc), None, url
+
+    def connect(self, key, tunnel):
+        '''Returns an idle connection for key, or a new one, and whether it
+        was reused'''
+        with self.lock:
+            try:
+                connection = self.idle[key].pop()
+            except (KeyError, IndexError):
+                self.opened += 1
+            else:
+                self.reused += 1
+                return connection, True
+        scheme, host = key
+        if scheme == 'https' and not tunnel:
+            connection = httplib.HTTPSConnection(host, timeout = self.timeout)
+        else:
+            connection = httplib.HTTPConnection(host, timeout = self.timeout)
+        if tunnel:
+            connection.set_tunnel(tunnel)
+        return connection, False
+
+    def release(self, key, connection):
+        '''Returns a connection to the pool, or closes it if the pool for
+        its host is full'''
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, url, headers = None, output = None, progress = None):
+        '''Makes a single GET request for url, with any extra headers,
+        returning the Response. Given a file object output, a successful
+        response's body is streamed into it, with progress, rather than
+        kept; see copyBody().'''
+        key, tunnel, path = self.route(url)
+        host = urlparse.urlsplit(url).netloc
+        headers = dict(headers or {}, Host = host)
+        headers.setdefault('User-Agent', 'OpenAccess_EPUB')
+        connection, reused = self.connect(key, tunnel)
+        try:
+            connection.request('GET', path, headers = headers)
+            response = connection.getresponse()
+            if output is not None and 200 <= response.status < 300:
+                copyBody(url, response, output, progress)
+                body = None
+            else:
+                body = response.read()
+        except (httplib.HTTPException, socket.error), e:
+            connection.close()
+            if output is not None:
+                output.seek(0)
+                output.truncate()
+            if reused:  # The server may have closed an idle connection
+                return self.request(url, headers, output, progress)
+            raise urllib2.URLError(e)
+        except:
+            #Such as a cancelled download, or a timeout; the rest of the
+            #response is unread, so the connection cannot be reused
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(key, connection)
+        return Response(url, response.status, response.reason, response.msg,
+                        body)
+
+    def open(self, url, redirects = 10, headers = None, output = None,
+             progress = None):
+        '''Returns the Response for a GET of url, following redirects, like
+        urllib2.urlopen(url). Raises urllib2.HTTPError for error statuses.
+        A conditional request, given If-None-Match or If-Modified-Since
+        headers, may return a Response with the code 304 and no body. The
+        body is streamed into output, if given, as request() does.'''
+        for _redirect in range(redirects + 1):
+            response = self.request(url, headers, output, progress)
+            if response.code in (301, 302, 303, 307, 308):
+                location = response.headers.getheader('location')
+                if location:
+                    url = urlparse.urljoin(url, location)
+                    continue
+            if response.code >= 400:
+                raise urllib2.HTTPError(url, response.code, response.msg,
+                                        response.headers,
+                                        StringIO(response.body))
+            return response
+        raise urllib2.URLError('Too many redirects for {0}'.format(url))
+
+
+session = Session()
+
+
+def copyBody(url, response, output, progress = None):
+    '''Copies the body of the httplib response for url into the file object
+    output, chunk_size bytes at a time, calling progress(url, received,
+    total, elapsed) after each chunk, where total is the Content-Length or
+    None and elapsed is in seconds. Raises httplib.IncompleteRead if the
+    body is shorter or longer than its Content-Length.'''
+    try:
+        total = int(response.getheader('content-length'))
+    except (TypeError, ValueError):
+        total = None
+    received = 0
+    start = time.time()
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        output.write(chunk)
+        received += len(chunk)
+        if progress is not None:
+            progress(url, received, total, time.time() - start)
+    if total is not None and received != total:
+        raise httplib.IncompleteRead('', total - received)
+
+
+class Throughput(object):
+    '''A progress callback measuring the bytes received by streamed
+    downloads and the time spent receiving them'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        #url -> (bytes received, seconds), as last reported
+        self.downloads = {}
+
+    def __call__(self, url, received, total, elapsed):
+        with self.lock:
+            self.downloads[url] = (received, elapsed)
+
+    def summary(self):
+        '''Returns a description of the downloads, with their mean rate'''
+        with self.lock:
+            downloads = self.downloads.values()
+        received = sum(size for size, _seconds in downloads)
+        elapsed = sum(seconds for _size, seconds in downloads)
+        rate = received / 1024.0 / elapsed if elapsed else 0.0
+        msg = '{0} files streamed, {1} bytes at {2:.1f} KiB/s per download'
+        return msg.format(len(downloads), received, rate)
+
+
+def responseMetadata(response):
+    '''Returns the metadata worth caching with the body of a Response: its
+    validators, the etag and last_modified given by its ETag and
+    Last-Modified headers, and the filename of its Content-Disposition,
+    those it has'''
+    metadata = {}
+    etag = response.headers.getheader('etag')
+    if etag:
+        metadata['etag'] = etag
+    last_modified = response.headers.getheader('last-modified')
+    if last_modified:
+        metadata['last_modified'] = last_modified
+    disposition = response.headers.getheader('content-disposition')
+    if disposition and '"' in disposition:
+        metadata['filename'] = disposition.split('"')[1]
+    return metadata
+
+
+def conditions(metadata):
+    '''Returns the headers making a request conditional on the resource
+    having changed since it was given with metadata, from
+    responseMetadata()'''
+    headers = {}
+    if metadata.get('etag'):
+        headers['If-None-Match'] = metadata['etag']
+    if metadata.get('last_modified'):
+        headers['If-Modified-Since'] = metadata['last_modified']
+    return headers
+
+
+class DownloadError(IOError):
+    '''Raised when some of the resources of an article could not be fetched'''
+    pass
+
+
+#Statuses with which a server asks for fewer or slower requests
+THROTTLED = (429, 503)
+#Statuses worth trying again, as they may pass
+RETRYABLE = (429, 500, 502, 503, 504)
+
+
+class HostLimit(object):
+    '''Admission control for the requests to one host. An AIMD window bounds
+    the requests in flight: the window grows by one for each window\'s worth
+    of healthy responses, up to max_window, and is halved when the server
+    throttles. A Retry-After from the server pauses the host entirely.
+
+    Given a rate, a token bucket also paces the requests, with bursts of up
+    to burst requests. The rate adapts in the same way, starting at rate and
+    never exceeding it: it is halved, down to min_rate, when the server
+    throttles, and grows back by one request per second for each healthy
+    response.'''
+    #The lowest rate a throttling server drives the pacing down to
+    min_rate = 0.1
+
+    def __init__(self, rate, burst, max_window):
+        self.ceiling = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.time()
+        self.max_window = max_window
+        self.window = 1.0
+        self.active = 0
+        self.paused_until = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, deadline = None, cancelled = None):
+        '''Waits until a request may be made, returning False instead if
+        the deadline passes or the Event cancelled is set first; see wake()'''
+        with self.condition:
+            while True:
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    return False
+                if cancelled is not None and cancelled.is_set():
+                    return False
+                if self.rate:
+                    self.tokens = min(self.burst, self.tokens +
+                                      (now - self.stamp) * self.rate)
+                    self.stamp = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.active >= int(self.window):
+                    wait = None  # Until a request is released
+                elif self.rate and self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    if self.rate:
+                        self.tokens -= 1
+                    self.active += 1
+                    return True
+                if deadline is not None:
+                    wait = min(wait, deadline - now) if wait else deadline - now
+                self.condition.wait(wait)
+
+    def wake(self):
+        '''Wakes the requests waiting in acquire(), so that those which
+        were cancelled give up'''
+        with self.condition:
+            self.condition.notify_all()
+
+    def release(self, healthy = True, throttled = False, retry_after = None):
+        '''Ends a request, adjusting the window by how the server answered'''
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.window = max(1.0, self.window / 2)
+                if self.rate:
+                    self.rate = max(self.min_rate, self.rate / 2)
+                if retry_after:
+                    self.paused_until = max(self.paused_until,
+                                            time.time() + retry_after)
+            elif healthy:
+                self.window = min(self.max_window,
+                                  self.window + 1.0 / self.window)
+                if self.rate:
+                    self.rate = min(self.ceiling, self.rate + 1.0)
+            self.condition.notify_all()
+
+
+def retryAfter(error):
+    '''Returns the seconds to wait given by the Retry-After header of an
+    HTTPError, or None'''
+    try:
+        return min(60, max(0, int(error.hdrs.getheader('retry-after'))))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class Fetcher(object):
+    '''Fetches URLs with up to threads requests at once. The requests to
+    each host are admitted by a HostLimit, allowing at most per_host at once
+    and rate per second. Failed requests are tried up to retries more times
+    after a jittered exponential backoff, and the fetch of each list of URLs
+    must finish within budget seconds, if a budget is given. Streamed bodies
+    are reported to progress, if given; see copyBody().'''
+    def __init__(self, threads = 8, per_host = 4, rate = None, retries = 4,
+                 budget = None, progress = None):
+        self.threads = threads
+        self.per_host = per_host
+        self.rate = rate
+        self.retries = retries
+        self.budget = budget
+        self.progress = progress
+        #The backoff before retry n is up to min(backoff_cap, backoff * 2**n)
+        self.backoff = 0.5
+        self.backoff_cap = 30
+        self.pool = None
+        #The Fetch of each fetchResponses() call in progress
+        self.fetches = set()
+        self.fetches_lock = threading.Lock()
+        #host -> HostLimit
+        self.hosts = {}
+        self.hosts_lock = threading.Lock()
+
+    def hostLimit(self, url):
+        '''Returns the HostLimit for the host of url'''
+        host = urlparse.urlparse(url).netloc
+        with self.hosts_lock:
+            try:
+                return self.hosts[host]
+            except KeyError:
+                limit = HostLimit(self.rate, self.per_host, self.per_host)
+                self.hosts[host] = limit
+                return limit
+
+    def watch(self, cancelled):
+        '''Returns the progress callback for a download which stops, raising
+        urllib2.URLError, once the Event cancelled is set'''
+        def progress(url, received, total, elapsed):
+            if cancelled.is_set():
+                raise urllib2.URLError('Cancelled')
+            if self.progress is not None:
+                self.progress(url, received, total, elapsed)
+        return progress
+
+    def open(self, url, deadline = None, headers = None, output = None,
+             cancelled = None):
+        '''Returns the Response for url, requested with any extra headers,
+        retrying as needed, with its body streamed into the file object
+        output if one is given. Raises the last error if every attempt fails,
+        or urllib2.URLError if the deadline passes first or the Event
+        cancelled is set.'''
+        limit = self.hostLimit(url)
+        progress = self.progress
+        if cancelled is not None:
+            progress = self.watch(cancelled)
+        for attempt in range(self.retries + 1):
+            if not limit.acquire(deadline, cancelled):
+                if cancelled is not None and cancelled.is_set():
+                    raise urllib2.URLError('Cancelled')
+                raise urllib2.URLError('Time budget exceeded')
+            if output is not None:  # Discard any earlier partial body
+                output.seek(0)
+                output.truncate()
+            #How the request ended, for the HostLimit; the slot is released
+            #however it ends, even by an exception from outside, such as the
+            #timeout of a batch job
+            outcome = (False,)
+            try:
+                response = session.open(url, headers = headers,
+                                        output = output,
+                                        progress = progress)
+            except urllib2.HTTPError, e:
+                outcome = (False, e.code in THROTTLED, retryAfter(e))
+                if e.code not in RETRYABLE or attempt == self.retries:
+                    raise
+                logging.warning('HTTP {0} for {1}'.format(e.code, url))
+            except (urllib2.URLError, IOError), e:
+                if attempt == self.retries or (cancelled is not None and
+                                               cancelled.is_set()):
+                    raise
+                logging.warning('Retrying {0}: {1}'.format(url, e))
+            else:
+                outcome = (True,)
+                #Nobody will take a body which arrived after the fetch was
+                #cancelled; raising has download() remove its file
+                if cancelled is not None and cancelled.is_set():
+                    raise urllib2.URLError('Cancelled')
+                return response
+            finally:
+                limit.release(*outcome)
+            delay = min(self.backoff_cap, self.backoff * 2 ** attempt)
+            delay = random.uniform(0, delay)  # Full jitter
+            if deadline is not None and time.time() + delay >= deadline:
+                raise urllib2.URLError('Time budget exceeded')
+            if cancelled is not None:
+                cancelled.wait(delay)
+            else:
+                time.sleep(delay)
+
+    def download(self, url, directory, deadline = None, headers = None,
+                 cancelled = None):
+        '''Returns the Response for url, as open() does, with a successful
+        response's body streamed into a new file in directory, named by its
+        filename. The file is removed if the download fails.'''
+        output = tempfile.NamedTemporaryFile(dir = directory, delete = False)
+        try:
+            with output:
+                response = self.open(url, deadline, headers, output,
+                                     cancelled)
+        except:
+            os.remove(output.name)
+            raise
+        if response.body is None:
+            response.filename = output.name
+        else:  # Not streamed, such as a 304 Not Modified
+            os.remove(output.name)
+        return response
+
+    def tryOpen(self, url, deadline = None, headers = None, directory = None,
+                cancelled = None):
+        '''Returns the Response for url, downloaded into directory if one is
+        given, or None if it could not be fetched'''
+        try:
+            if directory is not None:
+                return self.download(url, directory, deadline, headers,
+                                     cancelled)
+            return self.open(url, deadline, headers, cancelled = cancelled)
+        except (urllib2.URLError, IOError), e:
+            if cancelled is not None and cancelled.is_set():
+                logging.debug('Abandoned {0}'.format(url))
+            else:
+                logging.error('Could not fetch {0}: {1}'.format(url, e))
+            return None
+
+    def fetchResponses(self, urls, headers = None, directory = None):
+        '''Yields (url, response) for each of urls, a list, in order, where
+        response is None if the url could not be fetched. headers may map
+        urls to the extra headers to request them with, such as those of
+        conditions(). Given a directory, bodies are streamed into files
+        there, as download() does, which the caller must move or remove.
+        Later urls are being fetched while earlier results are consumed.
+        If the consumer stops early, such as when a batch job times out, the
+        fetches still to come are cancelled and their files removed.'''
+        headers = headers or {}
+        if self.budget:
+            deadline = time.time() + self.budget
+        else:
+            deadline = None
+        fetch = Fetch(len(urls))
+        get = lambda url: self.tryOpen(url, deadline, headers.get(url),
+                                       directory, fetch.cancelled)
+        if self.threads < 2:
+            for url in urls:
+                yield url, get(url)
+            return
+        if self.pool is None:
+            self.pool = ThreadPool(self.threads)
+        fetch.results = self.pool.imap(get, urls)
+        with self.fetches_lock:
+            self.fetches.add(fetch)
+        try:
+            for url in urls:
+                #Waiting with a timeout lets signals, such as the alarm of a
+                #batch job's deadline, be delivered in Python 2
+                response = fetch.results.next(2 ** 31)
+                fetch.pending -= 1
+                yield url, response
+        finally:
+            self.abandon(fetch)
+
+    def abandon(self, fetch):
+        '''Abandons the Fetch fetch, if it is still in progress. A fetch
+        which is being drained is kept, for cancel() to wait upon.'''
+        if fetch.abandon():
+            with self.hosts_lock:
+                limits = list(self.hosts.values())
+            for limit in limits:
+                limit.wake()
+        elif fetch.drain is None:
+            with self.fetches_lock:
+                self.fetches.discard(fetch)
+
+    def cancel(self, wait = 10):
+        '''Abandons every fetch still in progress, as when the article they
+        are for has run out of time, and waits up to wait seconds for their
+        files to be removed. A generator left suspended is not always closed
+        promptly, so this is not left to its garbage collection. Files still
+        arriving after the wait are left to ContentCache.prune().'''
+        with self.fetches_lock:
+            fetches = list(self.fetches)
+        for fetch in fetches:
+            self.abandon(fetch)
+        deadline = time.time() + wait
+        for fetch in fetches:
+            if fetch.drain is not None:
+                fetch.drain.join(max(0, deadline - time.time()))
+        with self.fetches_lock:
+            self.fetches.difference_update(fetch for fetch in fetches
+                                           if fetch.drain is None or
+                                           not fetch.drain.is_alive())
+
+
+class Fetch(object):
+    '''The state of a call to Fetcher.fetchResponses(): the iterator of its
+    results, the number of them not yet consumed, and the Event which
+    cancels its requests'''
+    def __init__(self, pending):
+        self.pending = pending
+        self.results = None
+        self.cancelled = threading.Event()
+        #The thread removing the files of results nobody will consume
+        self.drain = None
+
+    def abandon(self):
+        '''Cancels the requests still to be made and removes the files of
+        the results nobody will consume, in a thread of its own. Returns
+        False if there was nothing left to abandon.'''
+        if self.cancelled.is_set() or not self.pending:
+            return False
+        self.cancelled.set()
+        if self.results is not None:
+            self.drain = threading.Thread(target = discard,
+                                          args = (self.results, self.pending))
+            self.drain.daemon = True
+            self.drain.start()
+        return True
+
+
+def discard(results, count):
+    '''Waits for the next count Responses of the iterator results, which
+    nobody will consume, and removes the files of any which were downloaded.
+    Gives up after an hour, as a result whose wait was interrupted by a
+    signal is lost.'''
+    deadline = time.time() + 3600
+    while count and time.time() < deadline:
+        #A wait interrupted by a signal leaves its waiter behind in Python 2,
+        #where it may take the notification of the next result; waiting in
+        #short steps finds the result regardless
+        try:
+            response = results.next(1)
+        except multiprocessing.TimeoutError:
+            continue
+        except Exception:
+            count -= 1
+            continue
+        count -= 1
+        if response is not None and response.filename is not None:
+            try:
+                os.remove(response.filename)
+            except OSError:
+                pass
+
+
+fetcher = Fetcher()
+
+
+def configure(threads, per_host, rate = None, retries = 4, budget = None,
+              progress = None):
+    '''Replaces the shared fetcher with one using the given limits'''
+    global fetcher
+    fetcher = Fetcher(threads, per_host, rate, retries, budget, progress)
+    #Every connection a host is allowed at once may be kept for reuse
+    session.max_idle = max(session.max_idle, per_host)
+
+
+def stats():
+    '''Returns a description of the connection counters and, if the shared
+    fetcher measures its Throughput, of that'''
+    if isinstance(fetcher.progress, Throughput):
+        return '{0}; {1}'.format(session.stats(), fetcher.progress.summary())
+    return session.stats()
@@ -0,0 +1,197 @@
+'''Writers for the contents of an ePub. Every file of the ePub is handed to a
+writer under its name within the ePub, such as 'OPS/toc.ncx', and the writer
+keeps a registry of those names in the order they were written. The OPF
+manifest is made from this registry, and image lookups are made against it,
+so that nothing needs to read the ePub back once it is written.
+
+ZipWriter writes each file straight into the .epub archive, beginning with an
+uncompressed mimetype entry as the OCF specification requires, and leaves no
+directory behind. Archive decides the compression of each entry.
+DirectoryWriter writes the files to an output directory, which is kept, and
+zips it when closed; it is used when settings.cleanup is False.'''
+
+import os
+import os.path
+import posixpath
+import shutil
+import tempfile
+import time
+import zipfile
+from cStringIO import StringIO
+from contextlib import contextmanager
+
+import cache
+import utils
+import xmlbackend
+
+
+def baseEntries(base_epub):
+    '''Returns the (name, filename) pairs of the files in the base_epub
+    directory, with mimetype first, then those of META-INF and OPS.'''
+    entries = [('mimetype', os.path.join(base_epub, 'mimetype'))]
+    for directory in ['META-INF', 'OPS']:
+        top = os.path.join(base_epub, directory)
+        for path, subdirs, filenames in os.walk(top):
+            subdirs.sort()
+            for filename in sorted(filenames):
+                filepath = os.path.join(path, filename)
+                relpath = os.path.relpath(filepath, base_epub)
+                entries.append((relpath.replace(os.sep, '/'), filepath))
+    return entries
+
+
+class DirectoryWriter(object):
+    '''Writes the ePub's files into the outdirect directory and zips them into
+    outdirect.epub, at the given zlib level, when closed. The directory is
+    left in place.'''
+    def __init__(self, base_epub, outdirect, level = 6):
+        self.outdirect = outdirect
+        self.level = level
+        self.names = []
+        shutil.copytree(base_epub, outdirect)
+        for name, _filename in baseEntries(base_epub):
+            self.names.append(name)
+
+    def path(self, name):
+        '''Returns the location on disk of the file name, creating its parent
+        directory if needed'''
+        filename = os.path.join(self.outdirect, *name.split('/'))
+        parent = os.path.dirname(filename)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        return filename
+
+    def writeFile(self, name, filename):
+        '''Places the existing file filename into the ePub as name. Files are
+        often in the cache, so they are linked rather than copied where
+        possible; see cache.materialize().'''
+        cache.materialize(filename, self.path(name))
+        self.names.append(name)
+
+    def writeData(self, name, data):
+        '''Writes the string data into the ePub as name'''
+        with open(self.path(name), 'wb') as output:
+            output.write(data)
+        self.names.append(name)
+
+    def writeDocument(self, name, document):
+        '''Serializes the Document into the ePub as name'''
+        xmlbackend.write(document, self.path(name))
+        self.names.append(name)
+
+    @contextmanager
+    def open(self, name):
+        '''Provides a file object for writing name a piece at a time'''
+        with open(self.path(name), 'wb') as output:
+            yield output
+        self.names.append(name)
+
+    def close(self):
+        '''Zips the directory into the ePub file'''
+        utils.epubZip(self.outdirect, self.level)
+
+    def abort(self):
+        '''Removes the incomplete output directory'''
+        shutil.rmtree(self.outdirect, ignore_errors = True)
+
+
+class ZipWriter(object):
+    '''Writes the ePub's files directly into the archive outdirect.epub,
+    compressed at the given zlib level as described for Archive'''
+    def __init__(self, base_epub, outdirect, level = 6):
+        self.filename = outdirect + '.epub'
+        self.names = []
+        self.archive = Archive(self.filename, level)
+        #The mimetype entry must be the first in the archive and uncompressed
+        for name, filename in baseEntries(base_epub):
+            self.writeFile(name, filename)
+
+    def writeFile(self, name, filename):
+        '''Copies the existing file filename into the ePub as name'''
+        self.archive.write(filename, name)
+        self.names.append(name)
+
+    def writeData(self, name, data):
+        '''Writes the string data into the ePub as name'''
+        self.archive.writestr(name, data)
+        self.names.append(name)
+
+    def writeDocument(self, name, document):
+        '''Serializes the Document into the ePub as name'''
+        output = StringIO()
+        xmlbackend.write(document, output)
+        self.writeData(name, output.getvalue())
+
+    @contextmanager
+    def open(self, name):
+        '''Provides a file object for writing name a piece at a time. As the
+        zipfile module can only add whole files, the pieces are gathered in a
+        temporary file beside the ePub, which is then added and removed.'''
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        output = tempfile.NamedTemporaryFile(dir = directory, delete = False)
+        try:
+            with output:
+                yield output
+            self.writeFile(name, output.name)
+        finally:
+            os.remove(output.name)
+
+    def close(self):
+        '''Finishes the ePub file'''
+        self.archive.close()
+
+    def abort(self):
+        '''Closes and removes the incomplete ePub file'''
+        try:
+            self.archive.close()
+        finally:
+            os.remove(self.filename)
+
+
+#Entries with these extensions are already compressed and are always stored
+stored_extensions = ['png', 'jpg', 'jpeg', 'gif']
+
+
+class Archive(object):
+    '''A zip archive for an ePub, with the write() and writestr() methods of
+    zipfile.ZipFile. The compression of each entry depends on its media type:
+    the mimetype entry and images (see stored_extensions) are stored, all else
+    (XHTML, NCX, OPF, CSS) is deflated at zlib's default level, 6, the one
+    zipfile uses. A level of 0 stores everything.'''
+    def __init__(self, filename, level = 6):
+        self.zipf = zipfile.ZipFile(filename, 'w')
+        self.level = level
+
+    def compressType(self, name):
+        '''Returns the zipfile compression type for the entry name'''
+        if name == 'mimetype' or not self.level:
+            return zipfile.ZIP_STORED
+        ext = os.path.splitext(name)[1][1:].lower()
+        if ext in stored_extensions:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def write(self, filename, arcname = None):
+        '''Adds the file filename to the archive as arcname, which defaults to
+        filename'''
+        if arcname is None:
+            arcname = filename
+        self.zipf.write(filename, arcname, self.compressType(arcname))
+
+    def writestr(self, arcname, data):
+        '''Adds the string data to the archive as arcname'''
+        info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+        info.external_attr = 0100644 << 16L
+        info.compress_type = self.compressType(arcname)
+        self.zipf.writestr(info, data)
+
+    def close(self):
+        '''Closes the archive'''
+        self.zipf.close()
+
+
+def imageName(jid, path):
+    '''Returns the ePub name of an image of the article jid, from its path
+    relative to the article's image directory'''
+    return posixpath.join('OPS', 'images-{0}'.format(jid),
+                          *path.split(os.sep))
@@ -4,19 +4,36 @@ __version__ = '0.0.15'
 
 #Standard Library Modules
 import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import signal
 import sys
 import os.path
 import shutil
-import urllib2
+import time
 import urlparse
 import logging
+from collections import deque
+from itertools import izip
+from StringIO import StringIO
 
 #OpenAccess_EPUB Modules
 import utils
 import metadata
 import opf
+import prefetch
 import tocncx
 import content
+import xslt
+import cache
+import catalog
+import discovery
+import downloader
+import epubwriter
+import manifest
+import xmlbackend
 from settings import Settings
 from article import Article
 
@@ -26,73 +43,347 @@ settings = Settings()
 def initCache(cache_loc):
     '''Initiates the cache if it does not exist'''
     os.mkdir(cache_loc)
-    os.mkdir(os.path.join(cache_loc, 'model'))
-    os.mkdir(os.path.join(cache_loc, 'PLoS'))
-    os.mkdir(os.path.join(cache_loc, 'Frontiers'))
-    os.mkdir(os.path.join(cache_loc, 'model', 'images'))
-    os.mkdir(os.path.join(cache_loc, 'model', 'images', 'figures'))
-    os.mkdir(os.path.join(cache_loc, 'model', 'images', 'tables'))
-    os.mkdir(os.path.join(cache_loc, 'model', 'images', 'equations'))
-    os.mkdir(os.path.join(cache_loc, 'model', 'images', 'supplementary'))
+    cache.ContentCache(os.path.join(cache_loc, 'images')).close()
 
 
-def urlInput(input, xml_dir):
-    '''Handles input in URL form to instantiate the document'''
+def parseSize(size):
+    '''Converts a size in bytes, which may have a K, M or G suffix, to an
+    int'''
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper().rstrip('B')
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: {0}'.format(size))
+
+
+def parseShard(shard):
+    '''Converts a shard given as i/N, the ith of N shares of the work
+    counting from 1, to (i, N)'''
     try:
-        if '%2F10.1371%2F' in input:  # This is a PLoS page
-            publisher = 'PLoS'
-            address = urlparse.urlparse(input)
-            _fetch = '/article/fetchObjectAttachment.action?uri='
-            print(address.path)
-            _id = address.path.split('/')[2]
-            _rep = '&representation=XML'
-            access = '{0}://{1}{2}{3}{4}'.format(address.scheme, address.netloc,
-                                    _fetch, _id, _rep)
-            print('Opening {0}'.format(access.__str__()))
-            open_xml = urllib2.urlopen(access)
-        elif '/10.3389/' in input:  # This is a Frontiers page
-            publisher = 'Frontiers'
-            print('OpenAccess_EPUB does not yet support Frontiers')
-            sys.exit(0)
-        else:  # We don't know how to handle this input
-            print('Invalid Link: Bad URL or unsupported publisher')
+        index, count = [int(part) for part in shard.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid shard: {0}'.format(shard))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('invalid shard: {0}'.format(shard))
+    return index, count
+
+
+def inShard(name, shard):
+    '''Determines if the input name, the name of an xml file or a DOI, falls
+    in the shard (i, N). Inputs are assigned by a hash of their name, so that
+    every machine given the same inputs assigns them alike. A shard of None
+    holds every input.'''
+    if shard is None:
+        return True
+    index, count = shard
+    return int(hashlib.sha1(name).hexdigest(), 16) % count == index - 1
+
+
+def shardFiles(filenames, shard, directory):
+    '''Yields those of filenames, in directory, which fall in the shard, by
+    their paths relative to directory, which may be mounted elsewhere on each
+    machine'''
+    for filename in filenames:
+        if inShard(discovery.relativePath(filename, directory), shard):
+            yield filename
+
+
+def batchInputs(args):
+    '''Yields the xml files of the batch directory in the shard, as selected
+    and ordered by the command line arguments args; see the discovery
+    module'''
+    inputs = discovery.discover(args.batch, args.recursive, args.include,
+                                args.exclude, args.order)
+    return shardFiles(inputs, args.shard, args.batch)
+
+
+def shardSuffix(shard):
+    '''Returns the suffix naming the files written for the shard, such as
+    the build manifest, so that shards may share a directory'''
+    if shard is None:
+        return ''
+    return '-{0}of{1}'.format(*shard)
+
+
+def mergeMain(argv):
+    '''Combines the build manifests of shards, run as "main.py merge"'''
+    parser = argparse.ArgumentParser(prog='main.py merge',
+                                     description='''Combine the build \
+                                     manifests of batch shards''')
+    parser.add_argument('-o', '--output', action='store',
+                        default=settings.default_output,
+                        help='''The output directory whose manifest the \
+                                others are merged into''')
+    parser.add_argument('manifests', nargs='+',
+                        help='The manifest files of the shards')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.output):
+        os.mkdir(args.output)
+    target = os.path.join(args.output, 'manifest.sqlite')
+    count = manifest.merge(target, args.manifests)
+    print(u'Merged {0} manifests into {1}, which lists {2} ePubs'.format(
+          len(args.manifests), target, count))
+
+
+def cacheMain(argv):
+    '''The cache management commands, run as "main.py cache <command>"'''
+    parser = argparse.ArgumentParser(prog='main.py cache',
+                                     description='OpenAccess_EPUB cache')
+    parser.add_argument('-c', '--cache', action='store',
+                        default=settings.cache_location,
+                        help='Use to specify a non-default cache directory')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('report', help='Describe the contents of the cache')
+    verify = commands.add_parser('verify',
+                                 help='Check cached files against their hashes')
+    verify.add_argument('--repair', action='store_true', default=False,
+                        help='Use to remove the files which fail the check')
+    prune = commands.add_parser('prune',
+                                help='Evict the least recently used files')
+    prune.add_argument('--limit', action='store', type=parseSize,
+                       default=settings.cache_size_limit,
+                       help='''The size to prune the cache to, such as \
+                               500M; by default that of the settings''')
+    warm = commands.add_parser('warm',
+                               help='Download the images of a batch directory')
+    warm.add_argument('batch', help='The batch directory of article xml files')
+    args = parser.parse_args(argv)
+    cache.size_limit = settings.cache_size_limit
+    cache.ttl = settings.cache_ttl
+    if not os.path.isdir(args.cache):
+        initCache(args.cache)
+    image_cache = cache.ContentCache(os.path.join(args.cache, 'images'))
+    if args.command == 'report':
+        stats = image_cache.report()
+        print(u'Cache: {0}'.format(image_cache.root))
+        print(u'Entries: {entries} ({unused} never used), hits: {hits}'.format(
+              **stats))
+        print(u'Files: {objects}, {bytes} bytes'.format(**stats))
+        print(u'Size limit: {0} bytes'.format(settings.cache_size_limit))
+        print(u'Articles: {articles} ({complete} complete)'.format(**stats))
+        if stats['oldest']:
+            oldest = datetime.datetime.fromtimestamp(stats['oldest'])
+            print(u'Least recently used: {0:%Y-%m-%d %H:%M}'.format(oldest))
+    elif args.command == 'verify':
+        bad = image_cache.verify(args.repair)
+        for sha1 in bad:
+            print(u'Damaged or missing: {0}'.format(sha1))
+        print(u'{0} files failed verification'.format(len(bad)))
+        if bad and not args.repair:
             sys.exit(1)
+    elif args.command == 'prune':
+        count, freed = image_cache.prune(args.limit)
+        print(u'Removed {0} files, {1} bytes'.format(count, freed))
+    elif args.command == 'warm':
+        warm = prefetch.Prefetcher(image_cache)
+        warm.run(discovery.discover(args.batch))
+        print(warm.summary())
+    image_cache.close()
+
+
+def xmlCache():
+    '''Returns the cache of article xml files and DOI resolutions'''
+    return cache.ContentCache(os.path.join(settings.cache_location, 'xml'))
+
+
+def fetchXMLFiles(accesses, xml_dir):
+    '''Downloads the article xml files at the access URLs into xml_dir,
+    concurrently, returning a list of their locations with None for any which
+    could not be downloaded. With caching, the files are kept in the cache
+    with the validators the server gave for them, and a file is not
+    downloaded again while it is current or if the server answers that it is
+    unchanged.'''
+    filenames = []
+    if not settings.caching:
+        responses = downloader.fetcher.fetchResponses(accesses, None, xml_dir)
+        for access, open_xml in responses:
+            if open_xml is None:
+                filenames.append(None)
+                continue
+            filename = open_xml.headers['Content-Disposition'].split('\"')[1]
+            filename = os.path.join(xml_dir, filename)
+            #The file was streamed beside its destination, and is renamed
+            os.rename(open_xml.filename, filename)
+            filenames.append(filename)
+        return filenames
+    xml_cache = xmlCache()
+    try:
+        cached = dict((access, xml_cache.current(access))
+                      for access in accesses)
+        stale = [(access, access) for access in sorted(cached)
+                 if cached[access] is None]
+        for access, _key, location, status in xml_cache.update(stale):
+            logging.info('Article xml {0}: {1}'.format(access, status))
+            cached[access] = location
+        for access in accesses:
+            if cached[access] is None:
+                filenames.append(None)
+                continue
+            filename = xml_cache.record(access)['filename']
+            filename = os.path.join(xml_dir, filename)
+            #A copy, as the file may be edited or removed
+            shutil.copyfile(cached[access], filename)
+            filenames.append(filename)
+    finally:
+        xml_cache.close()
+    return filenames
+
+
+def fetchXML(access, xml_dir):
+    '''Downloads the article xml file at the access URL into xml_dir, as
+    fetchXMLFiles() does, returning its location'''
+    filename = fetchXMLFiles([access], xml_dir)[0]
+    if filename is None:
+        msg = 'Could not download {0}'.format(access)
+        raise downloader.DownloadError(msg)
+    return filename
+
+
+def urlAccess(input):
+    '''Returns the access URL of the article xml file for input in URL
+    form'''
+    if '%2F10.1371%2F' in input:  # This is a PLoS page
+        publisher = 'PLoS'
+        address = urlparse.urlparse(input)
+        _fetch = '/article/fetchObjectAttachment.action?uri='
+        print(address.path)
+        _id = address.path.split('/')[2]
+        _rep = '&representation=XML'
+        access = '{0}://{1}{2}{3}{4}'.format(address.scheme, address.netloc,
+                                _fetch, _id, _rep)
+        print('Opening {0}'.format(access.__str__()))
+        return access
+    elif '/10.3389/' in input:  # This is a Frontiers page
+        publisher = 'Frontiers'
+        print('OpenAccess_EPUB does not yet support Frontiers')
+        sys.exit(0)
+    else:  # We don't know how to handle this input
+        print('Invalid Link: Bad URL or unsupported publisher')
+        sys.exit(1)
+
+
+def urlDownload(input, xml_dir):
+    '''Downloads the xml file for input in URL form into xml_dir, returning
+    its location'''
+    try:
+        filename = fetchXML(urlAccess(input), xml_dir)
     except:
         print('Invalid Link: Enter a corrected link or use local file')
         sys.exit(1)
     else:
-        filename = open_xml.headers['Content-disposition'].split('\"')[1]
-        filename = os.path.join(xml_dir, filename)
-        with open(filename, 'wb') as xml_file:
-            xml_file.write(open_xml.read())
-        document = Article(filename)
-        return(document, filename)
+        return filename
 
 
-def doiInput(input, xml_dir):
-    '''Handles input in DOI form to instantiate the document'''
+def urlInput(input, xml_dir):
+    '''Handles input in URL form to instantiate the document'''
+    filename = urlDownload(input, xml_dir)
+    document = Article(filename)
+    return(document, filename)
+
+
+def doiAccess(page_url):
+    '''Returns the access URL of the article xml file for the article page
+    that a DOI resolved to'''
+    address = urlparse.urlparse(page_url)
+    path = address.path.replace(':', '%3A').replace('/', '%2F')
+    _fetch = '/article/fetchObjectAttachment.action?uri='
+    _id = path.split('article%2F')[1]
+    _rep = '&representation=XML'
+    return '{0}://{1}{2}{3}{4}'.format(address.scheme, address.netloc,
+                                       _fetch, _id, _rep)
+
+
+def resolveDOIs(dois):
+    '''Returns a dictionary of the access URLs of the article xml files for
+    the DOIs, with None for those which could not be resolved. With caching,
+    resolutions are kept in the xml cache, so that a DOI is only sent to the
+    resolver once; the rest are sent concurrently.'''
+    accesses = dict.fromkeys(dois)
+    xml_cache = None
+    if settings.caching:
+        xml_cache = xmlCache()
+        for doi in accesses:
+            accesses[doi] = xml_cache.resolve(doi)
     try:
-        doi_url = 'http://dx.doi.org/' + input[4:]
-        page = urllib2.urlopen(doi_url)
-        address = urlparse.urlparse(page.geturl())
-        path = address.path.replace(':', '%3A').replace('/', '%2F')
-        _fetch = '/article/fetchObjectAttachment.action?uri='
-        _id = path.split('article%2F')[1]
-        _rep = '&representation=XML'
-        access = '{0}://{1}{2}{3}{4}'.format(address.scheme, address.netloc,
-                                    _fetch, _id, _rep)
-        open_xml = urllib2.urlopen(access)
+        unresolved = sorted(doi for doi in accesses if accesses[doi] is None)
+        doi_urls = ['http://dx.doi.org/' + doi for doi in unresolved]
+        pages = downloader.fetcher.fetchResponses(doi_urls)
+        for doi, (_doi_url, page) in izip(unresolved, pages):
+            if page is None:
+                continue
+            try:
+                accesses[doi] = doiAccess(page.geturl())
+            except IndexError:
+                logging.error(u'{0} resolved to {1}, not a PLoS article'.format(
+                              doi, page.geturl()))
+                continue
+            if xml_cache is not None:
+                xml_cache.alias(doi, accesses[doi])
+    finally:
+        if xml_cache is not None:
+            xml_cache.close()
+    return accesses
+
+
+def doiDownload(input, xml_dir):
+    '''Downloads the xml file for input in DOI form into xml_dir, returning
+    its location'''
+    try:
+        access = resolveDOIs([input[4:]])[input[4:]]
+        if access is None:
+            raise downloader.DownloadError('Could not resolve ' + input)
+        filename = fetchXML(access, xml_dir)
     except:
         print('Invalid DOI Link: Check for correct address and format')
         print('A valid entry looks like: \"doi:10.1371/journal.pcbi.1002222\"')
         sys.exit(1)
     else:
-        filename = open_xml.headers['Content-Disposition'].split('\"')[1]
-        filename = os.path.join(xml_dir, filename)
-        with open(filename, 'wb') as xml_file:
-            xml_file.write(open_xml.read())
-        document = Article(filename)
-        return(document, filename)
+        return filename
+
+
+def doiInput(input, xml_dir):
+    '''Handles input in DOI form to instantiate the document'''
+    filename = doiDownload(input, xml_dir)
+    document = Article(filename)
+    return(document, filename)
+
+
+def collectionFiles(collection, xml_dir, shard = None):
+    '''Returns the local xml files for the inputs listed in the collection
+    file, downloading those given as URLs or DOIs into xml_dir. The DOIs are
+    resolved together, then the files are downloaded together; see
+    resolveDOIs() and fetchXMLFiles(). Only the inputs in the shard are
+    taken, by their DOI, URL or path.'''
+    with open(collection, 'r') as inputs:
+        inputs = [i.rstrip('\n') for i in inputs.readlines()]
+    inputs = [i for i in inputs
+              if i and inShard(i[4:] if i[:4] == 'doi:' else i, shard)]
+    dois = resolveDOIs([i[4:] for i in inputs
+                        if 'http://www' not in i and i[:4] == 'doi:'])
+    accesses = {}
+    for i in inputs:
+        if 'http://www' in i:
+            accesses[i] = urlAccess(i)
+        elif i[:4] == 'doi:':
+            accesses[i] = dois[i[4:]]
+            if accesses[i] is None:
+                print(u'Invalid DOI Link: could not resolve {0}'.format(i))
+                sys.exit(1)
+    downloads = sorted(set(accesses.values()))
+    filenames = dict(izip(downloads, fetchXMLFiles(downloads, xml_dir)))
+    files = []
+    for i in inputs:
+        if i not in accesses:
+            files.append(i)
+        elif filenames[accesses[i]] is None:
+            print(u'Could not download the xml file for {0}'.format(i))
+            sys.exit(1)
+        else:
+            files.append(filenames[accesses[i]])
+    return files
 
 
 def localInput(input):
@@ -125,24 +416,28 @@ def makeEPUB(document, xml_local, cache_dir, outdirect, log_to):
     print(u'Processing output to {0}.epub'.format(outdirect))
     if not os.path.isdir(settings.base_epub):
         utils.makeEPUBBase(settings.base_epub, settings.css_location)
-    shutil.copytree(settings.base_epub, outdirect)
-    DOI = document.getDOI()
-    if DOI.split('/')[0] == '10.1371':
-        document.fetchPLoSImages(cache_dir, outdirect, settings.caching)
-    elif DOI.split('/')[0] == '10.3389':
-        document.fetchFrontiersImages(cache_dir, outdirect, settings.caching)
-    content.OPSContent(xml_local, DOI, outdirect, document)
-    toc = tocncx.TocNCX()
-    toc.takeArticle(document)
-    toc.write(outdirect)
-    myopf = opf.ContentOPF(outdirect)
-    myopf.takeArticle(document)
-    myopf.write()
-    utils.epubZip(outdirect)
-    #WARNING: shutil.rmtree() is a recursive deletion function, care should be
-    #taken whenever modifying this code
-    if settings.cleanup:
-        shutil.rmtree(outdirect)
+    epub = openEPUB(outdirect)
+    #An ePub left incomplete by an error, such as a failed image download,
+    #is removed rather than left in the output
+    try:
+        DOI = document.getDOI()
+        if DOI.split('/')[0] == '10.1371':
+            document.fetchPLoSImages(cache_dir, epub, settings.caching)
+        elif DOI.split('/')[0] == '10.3389':
+            document.fetchFrontiersImages(cache_dir, epub, settings.caching)
+        #The NCX and OPF take what they need of the article first, as its
+        #body is moved into the main document by the conversion
+        toc = tocncx.TocNCX()
+        toc.takeArticle(document)
+        myopf = opf.ContentOPF(epub)
+        myopf.takeArticle(document)
+        content.OPSContent(DOI, epub, document, settings.engine)
+        toc.write(epub)
+        myopf.write()
+    except:
+        epub.abort()
+        raise
+    epub.close()
 
 
 def makeCollectionEPUB(documents, cache_dir, outdirect, log_to):
@@ -152,22 +447,284 @@ def makeCollectionEPUB(documents, cache_dir, outdirect, log_to):
     and now we may generate the file.
     '''
     print(u'Processing output to {0}.epub'.format(outdirect))
-    shutil.copytree(settings.base_epub, outdirect)
-    mytoc = tocncx.TocNCX(collection_mode=True)
-    myopf = opf.ContentOPF(outdirect, collection_mode=True)
-    for (doc, xml) in documents:
-        DOI = doc.getDOI()
-        doc.fetchPLoSImages(cache_dir, outdirect, settings.caching)
-        content.OPSContent(xml, DOI, outdirect, doc)
-        mytoc.takeArticle(doc)
-        myopf.takeArticle(doc)
-    mytoc.write(outdirect)
-    myopf.write()
-    utils.epubZip(outdirect)
-    #WARNING: shutil.rmtree() is a recursive deletion function, care should be
-    #taken whenever modifying this code
+    epub = openEPUB(outdirect)
+    try:
+        mytoc = tocncx.TocNCX(collection_mode=True)
+        myopf = opf.ContentOPF(epub, collection_mode=True)
+        for (doc, xml) in documents:
+            DOI = doc.getDOI()
+            doc.fetchPLoSImages(cache_dir, epub, settings.caching)
+            mytoc.takeArticle(doc)
+            myopf.takeArticle(doc)
+            content.OPSContent(DOI, epub, doc, settings.engine)
+        mytoc.write(epub)
+        myopf.write()
+    except:
+        epub.abort()
+        raise
+    epub.close()
+
+
+def openEPUB(outdirect):
+    '''Returns the epubwriter for outdirect.epub. The files are written
+    straight into the ePub, unless settings.cleanup is False, in which case
+    the output directory outdirect is also written and kept.'''
     if settings.cleanup:
-        shutil.rmtree(outdirect)
+        return epubwriter.ZipWriter(settings.base_epub, outdirect,
+                                    settings.compression_level)
+    return epubwriter.DirectoryWriter(settings.base_epub, outdirect,
+                                      settings.compression_level)
+
+
+def initWorker(log_to, jobs):
+    '''Prepares a worker process of a parallel batch. It logs to a file of
+    its own in log_to, drops the connections inherited from the parent, and
+    takes a 1/jobs share of the download limits of each host, so that the
+    workers together keep close to those of a single process.'''
+    #Interrupts are left to the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    name = multiprocessing.current_process().name
+    logging.basicConfig(filename=os.path.join(log_to, name + '.log'),
+                        level=logging.DEBUG)
+    rate = settings.host_request_rate
+    downloader.session = downloader.Session()
+    downloader.configure(settings.download_threads,
+                         max(1, settings.downloads_per_host // jobs),
+                         rate / float(jobs) if rate else rate,
+                         settings.download_retries,
+                         settings.download_budget,
+                         downloader.Throughput())
+
+
+class ArticleTimeout(BaseException):
+    '''Raised in a batch job which runs past its deadline. It is not an
+    Exception, so that the conversion code does not catch it as one.'''
+    pass
+
+
+def raiseTimeout(signum, frame):
+    '''The SIGALRM handler of batch jobs'''
+    raise ArticleTimeout()
+
+
+def batchJob(job):
+    '''Converts one article of a batch, given (xml file, output directory,
+    timeout in seconds or None). Any exception or exit, or running past the
+    timeout, fails only this article. The printed output is gathered rather
+    than written, so that the reports of parallel jobs are not interleaved.
+    Returns (xml file, failure or None, seconds taken, printed output,
+    images), where a failure is a dictionary for the failure report and the
+    images are those of builtImages().'''
+    filename, output, timeout = job
+    start = time.time()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    failure = None
+    images = None
+    #The deadline is checked between Python operations; downloads are also
+    #bounded by settings.download_budget
+    if timeout:
+        signal.signal(signal.SIGALRM, raiseTimeout)
+        signal.alarm(timeout)
+    try:
+        doc, xml_local = localInput(filename)
+        output_name = os.path.join(output, discovery.inputName(xml_local))
+        if os.path.isdir(output_name):
+            dirExists(output_name, True)
+        makeEPUB(doc, xml_local, settings.cache_location, output_name, None)
+        images = builtImages(doc.getDOI())
+    except ArticleTimeout:
+        failure = {'kind': 'timeout',
+                   'error': u'Timed out after {0} s'.format(timeout)}
+    except SystemExit as e:
+        failure = {'kind': 'exit',
+                   'error': u'Exited with status {0}'.format(e.code or 0)}
+    except Exception as e:
+        failure = {'kind': 'exception',
+                   'error': u'{0}: {1}'.format(type(e).__name__, e)}
+    finally:
+        signal.alarm(0)
+        #Downloads for an article which failed, such as by timing out, would
+        #otherwise carry on beside the next one and leave their files behind
+        downloader.fetcher.cancel()
+        printed = sys.stdout.getvalue()
+        sys.stdout = stdout
+    seconds = time.time() - start
+    if failure is not None:
+        logging.error(u'Could not convert {0}: {1}'.format(filename,
+                                                           failure['error']),
+                      exc_info = True)
+        failure.update(file = filename, seconds = round(seconds, 3),
+                       log = logFile())
+    logging.info(downloader.stats())
+    return filename, failure, seconds, printed, images
+
+
+def builtImages(doi):
+    '''Returns the SHA-1 of each cached image of the article doi by its key,
+    for the build manifest'''
+    if not settings.caching:
+        return {}
+    image_cache = cache.ContentCache(os.path.join(settings.cache_location,
+                                                  'images'))
+    try:
+        article = image_cache.article(doi)
+        if article is None:
+            return {}
+        images = {}
+        for key in article['keys']:
+            record = image_cache.record(key)
+            if record is not None:
+                images[key] = record['sha1']
+        return images
+    finally:
+        image_cache.close()
+
+
+def epubFile(filename, output):
+    '''Returns the ePub made from the xml file filename in output'''
+    return os.path.join(output, discovery.inputName(filename) + '.epub')
+
+
+def batchOutput(filename, batch, output):
+    '''Returns the directory in output for the ePub of the xml file filename
+    of the batch directory batch: that of filename relative to batch, so that
+    inputs of the same name in different subdirectories do not collide'''
+    relative = os.path.dirname(discovery.relativePath(filename, batch))
+    return os.path.join(output, *relative.split('/')) if relative else output
+
+
+def logFile():
+    '''Returns the file the root logger writes to, or None'''
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler):
+            return handler.baseFilename
+    return None
+
+
+def awaitJob(job, result, timeout):
+    '''Returns the outcome of the batch job submitted to a pool, given its
+    AsyncResult result, as batchJob() returns it. The pool starts jobs in
+    order, so the oldest is running. A worker killed outright, or stuck where
+    the alarm cannot reach it, never answers; the wait is bounded for that,
+    and the job is then failed as lost. Waiting with a timeout also lets
+    Python 2 deliver KeyboardInterrupt.'''
+    waited = time.time()
+    try:
+        return result.get(timeout + 60 if timeout else 2 ** 31)
+    except multiprocessing.TimeoutError:
+        seconds = time.time() - waited
+        failure = {'kind': 'lost', 'file': job[0],
+                   'error': u'The worker did not answer',
+                   'seconds': round(seconds, 3), 'log': None}
+        return job[0], failure, seconds, '', None
+
+
+def reportJob(outcome, output, builds, failures):
+    '''Reports the outcome of a batch job, as batchJob() returns it, whose
+    ePub is in the directory output, recording the ePub in the BuildManifest
+    builds or its failure in the list failures'''
+    filename, failure, seconds, printed, images = outcome
+    sys.stdout.write(printed)
+    if failure is None:
+        builds.record(filename, epubFile(filename, output), images)
+        print(u'Converted {0} in {1:.1f} s'.format(filename, seconds))
+    else:
+        print(u'Failed to convert {0}: {1}'.format(filename,
+                                                   failure['error']))
+        failures.append(failure)
+
+
+def batchEPUBs(filenames, batch, output, log_to, jobs = 1, timeout = None,
+               force = False, shard = None):
+    '''Converts each of the xml files filenames of the batch directory, which
+    may be an iterator, to an ePub in output, placed as the file is beneath
+    the batch directory (see batchOutput()), in a pool of jobs processes if jobs is more than 1,
+    allowing each article up to timeout seconds. The files are taken as they
+    are needed, so that no more than twice as many jobs as processes wait in
+    the pool. Articles whose ePubs the build manifest of output finds up to
+    date are skipped, unless force is True. The result of each article
+    converted is reported in the order given, then a summary, and the
+    failures are written to log_to/batch-failures.json as a list of
+    dictionaries. A shard writes its own manifest and failure report, named
+    with shardSuffix(). Returns the failures.'''
+    start = time.time()
+    #Made once here, rather than by each worker as it finds it missing
+    if not os.path.isdir(settings.base_epub):
+        utils.makeEPUBBase(settings.base_epub, settings.css_location)
+    suffix = shardSuffix(shard)
+    manifest_file = os.path.join(output, 'manifest{0}.sqlite'.format(suffix))
+    builds = manifest.BuildManifest(manifest_file, __version__, settings)
+    image_cache = None
+    if settings.caching:
+        image_cache = cache.ContentCache(os.path.join(settings.cache_location,
+                                                      'images'))
+    pool = None
+    #The (job, AsyncResult) of each job submitted to the pool and not yet
+    #reported, oldest first
+    pending = deque()
+    failures = []
+    inputs = 0
+    stale = 0
+    try:
+        for filename in filenames:
+            inputs += 1
+            directory = batchOutput(filename, batch, output)
+            if not force and builds.isCurrent(filename,
+                                              epubFile(filename, directory),
+                                              image_cache):
+                continue
+            stale += 1
+            #Made here rather than by the workers, which could race to make it
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            job = (filename, directory, timeout)
+            if jobs < 2:
+                reportJob(batchJob(job), directory, builds, failures)
+                continue
+            if pool is None:
+                pool = multiprocessing.Pool(jobs, initWorker, (log_to, jobs))
+            pending.append((job, pool.apply_async(batchJob, (job,))))
+            #Finished jobs are reported as they come, in order, and the
+            #number waiting is bounded by waiting on the oldest
+            while pending and (pending[0][1].ready() or
+                               len(pending) > 2 * jobs):
+                job, result = pending.popleft()
+                reportJob(awaitJob(job, result, timeout), job[1], builds,
+                          failures)
+        while pending:
+            job, result = pending.popleft()
+            reportJob(awaitJob(job, result, timeout), job[1], builds,
+                      failures)
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        builds.close()
+        if image_cache is not None:
+            image_cache.close()
+    if pool is not None:
+        #A worker which did not answer may still be stuck
+        if any(failure['kind'] == 'lost' for failure in failures):
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+    msg = u'Converted {0} of {1} articles in {2:.1f} s with {3} jobs, {4} '\
+          u'up to date'
+    print(msg.format(stale - len(failures), stale, time.time() - start, jobs,
+                     inputs - stale))
+    report = os.path.join(log_to, 'batch-failures{0}.json'.format(suffix))
+    with open(report, 'wb') as failure_report:
+        json.dump(failures, failure_report, indent = 2, sort_keys = True)
+    if failures:
+        print(u'{0} failed, see {1}'.format(len(failures), report))
+    return failures
+
 
 def epubcheck(epubname):
     '''This method takes the name of an epub file as an argument. This name is
@@ -185,6 +742,12 @@ def epubcheck(epubname):
 
 def main():
     '''Main Script'''
+    if sys.argv[1:2] == ['cache']:
+        cacheMain(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ['merge']:
+        mergeMain(sys.argv[2:])
+        sys.exit(0)
     parser = argparse.ArgumentParser(description='OpenAccess_EPUB Parser')
     parser.add_argument('--version', action='version',
                         version='OpenAccess_EPUB {0}'.format(__version__))
@@ -202,6 +765,79 @@ def main():
     parser.add_argument('-c', '--cache', action='store',
                         default=settings.cache_location,
                         help='Use to specify a non-default cache directory')
+    parser.add_argument('--cache-ttl', action='store', type=int,
+                        default=settings.cache_ttl,
+                        help='''Use to set the seconds for which cached files \
+                                are used before asking the server whether \
+                                they have changed''')
+    parser.add_argument('-e', '--engine', action='store',
+                        default=settings.engine,
+                        choices=['handlers', 'xslt', 'stream'],
+                        help='''Use to select the engine converting the \
+                                article content, xslt requires lxml and \
+                                stream bounds memory use''')
+    parser.add_argument('-x', '--xml-parser', action='store',
+                        default=settings.xml_parser,
+                        choices=['minidom', 'lxml'],
+                        help='''Use to select the parser of article xml \
+                                files, lxml gives the same Document as \
+                                minidom''')
+    parser.add_argument('-z', '--compression-level', action='store',
+                        type=int, default=settings.compression_level,
+                        choices=[0, 6],
+                        help='''Use 6 to deflate ePub documents, or 0 to \
+                                store them uncompressed''')
+    parser.add_argument('--download-threads', action='store', type=int,
+                        default=settings.download_threads,
+                        help='''Use to set the number of images downloaded \
+                                at once''')
+    parser.add_argument('-j', '--jobs', action='store', type=int,
+                        default=settings.batch_jobs,
+                        help='''Use with batch mode to convert this many \
+                                articles at once, in separate processes''')
+    parser.add_argument('--timeout', action='store', type=int,
+                        default=settings.article_timeout,
+                        help='''Use with batch mode to set the seconds each \
+                                article may take, 0 for no limit''')
+    parser.add_argument('-f', '--force', action='store_true', default=False,
+                        help='''Use with batch mode to convert every article, \
+                                including those whose ePubs are up to date''')
+    parser.add_argument('--shard', action='store', type=parseShard,
+                        help='''Use with batch mode, or collection mode with \
+                                --prefetch, to take only the ith of N shares \
+                                of the articles, given as i/N''')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        default=False,
+                        help='''Use with batch mode to also take the xml \
+                                files in subdirectories of the batch \
+                                directory''')
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                        help='''Use with batch mode to take only the xml \
+                                files whose names or relative paths match \
+                                GLOB; may be given more than once''')
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                        help='''Use with batch mode to skip the xml files, \
+                                and directories, whose names or relative \
+                                paths match GLOB; may be given more than \
+                                once''')
+    parser.add_argument('--order', action='store', default='name',
+                        choices=['name', 'size', 'none'],
+                        help='''Use with batch mode to take the xml files in \
+                                order of name, of size largest first, or as \
+                                they are listed, without waiting to read \
+                                whole directories''')
+    parser.add_argument('-m', '--metadata-only', action='store_true',
+                        default=False,
+                        help='''Use with batch mode to write a catalog of \
+                                the articles' metadata instead of ePubs''')
+    parser.add_argument('-p', '--prefetch', action='store_true',
+                        default=False,
+                        help='''Use with batch or collection mode to download \
+                                the articles' images into the cache instead \
+                                of making ePubs''')
+    parser.add_argument('--catalog-format', action='store', default='jsonl',
+                        choices=['jsonl', 'csv'],
+                        help='Use to select the format of the catalog')
     modes = parser.add_mutually_exclusive_group()
     modes.add_argument('-i', '--input', action='store',
                         help='''Input may be a path to a local directory, a \
@@ -214,6 +850,34 @@ def main():
                         help='''Use to create an ePub file containing \
                                 multiple resources.''')
     args = parser.parse_args()
+    if args.engine == 'xslt' and not xslt.available:
+        parser.error('the xslt engine requires lxml, which is not installed')
+    settings.engine = args.engine
+    if args.xml_parser == 'lxml' and not xmlbackend.available:
+        parser.error('the lxml parser requires lxml, which is not installed')
+    settings.xml_parser = args.xml_parser
+    xmlbackend.use(settings.xml_parser)
+    settings.compression_level = args.compression_level
+    settings.download_threads = args.download_threads
+    settings.cache_location = args.cache
+    settings.cache_ttl = args.cache_ttl
+    cache.size_limit = settings.cache_size_limit
+    cache.ttl = settings.cache_ttl
+    downloader.configure(settings.download_threads,
+                         settings.downloads_per_host,
+                         settings.host_request_rate,
+                         settings.download_retries,
+                         settings.download_budget,
+                         downloader.Throughput())
+    if args.metadata_only and not args.batch:
+        parser.error('--metadata-only may only be used in batch mode')
+    if args.prefetch and not (args.batch or args.collection):
+        parser.error('--prefetch may only be used in batch or collection mode')
+    if args.shard and not (args.batch or args.prefetch):
+        parser.error('--shard may only be used in batch mode, or collection '
+                     'mode with --prefetch')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
     #Check for directory existence, create if not found
     #This will break if the path has no immediate parent directory, this could
     #be fixed but I am not sure if it should
@@ -229,22 +893,58 @@ def main():
     logname = os.path.join(args.log_to, 'temp.log')
     logging.basicConfig(filename=logname, level=logging.DEBUG)
     logging.info('OpenAccess_EPUB Log v.{0}'.format(__version__))
+    #Catalog Mode
+    if args.metadata_only:
+        catalog_name = 'catalog{0}.{1}'.format(shardSuffix(args.shard),
+                                               args.catalog_format)
+        catalog_name = os.path.join(args.output, catalog_name)
+        print(u'Writing catalog to {0}'.format(catalog_name))
+        written = 0
+        skipped = 0
+        with open(catalog_name, 'wb') as output:
+            writer = catalog.CatalogWriter(output, args.catalog_format)
+            for filename in batchInputs(args):
+                #An unreadable or corrupt file, or malformed metadata such as
+                #a non-numeric date, skips only that article
+                try:
+                    record = catalog.extractMetadata(filename, args.batch)
+                except Exception as error:
+                    skipped += 1
+                    message = u'Skipping {0}: {1}: {2}'.format(
+                        filename, type(error).__name__, error)
+                    print(message)
+                    logging.error(message)
+                else:
+                    writer.write(record)
+                    written += 1
+        print(u'Wrote {0} articles to the catalog, {1} skipped'.format(
+              written, skipped))
+        sys.exit(1 if skipped else 0)
+
+    #Prefetch Mode
+    if args.prefetch:
+        if args.batch:
+            xml_files = batchInputs(args)
+        else:
+            xml_files = collectionFiles(args.collection, args.save_xml,
+                                        args.shard)
+        image_cache = cache.ContentCache(os.path.join(args.cache, 'images'))
+        prefetcher = prefetch.Prefetcher(image_cache)
+        prefetcher.run(xml_files)
+        image_cache.close()
+        print(prefetcher.summary())
+        logging.info(prefetcher.summary())
+        logging.info(downloader.stats())
+        sys.exit(0)
+
     #Batch Mode
     if args.batch:
         download = False
-        files = os.listdir(args.batch)
-        for file in files:
-            if not os.path.splitext(file)[1] == '.xml':
-                pass
-            else:
-                filename = os.path.join(args.batch, file)
-                doc, xml_local = localInput(filename)
-                input_name = os.path.splitext(os.path.split(xml_local)[1])[0]
-                output_name = os.path.join(args.output, input_name)
-                if os.path.isdir(output_name):
-                    dirExists(output_name, args.batch)
-                makeEPUB(doc, xml_local, args.cache, output_name, args.log_to)
-        sys.exit(0)
+        failed = batchEPUBs(batchInputs(args), args.batch, args.output,
+                            args.log_to, args.jobs, args.timeout or None,
+                            args.force, args.shard)
+        logging.info(downloader.stats())
+        sys.exit(1 if failed else 0)
 
     #Collection Mode
     if args.collection:
@@ -252,24 +952,11 @@ def main():
         output_name = os.path.join(args.output, t)
         if os.path.isdir(output_name):
             dirExists(output_name, args.batch)
-        with open(args.collection, 'r') as collection:
-            inputs = collection.readlines()
         documents = []
-        for i in inputs:
-            if 'http://www' in i:
-                download = True
-                document, xml_local = urlInput(i.rstrip('\n'), args.save_xml)
-            elif i[:4] == 'doi:':
-                download = True
-                document, xml_local = doiInput(i.rstrip('\n'), args.save_xml)
-            else:
-                if not i:
-                    pass
-                else:
-                    download = False
-                    document, xml_local = localInput(i.rstrip('\n'))
-            documents += [(document, xml_local)]
+        for xml_local in collectionFiles(args.collection, args.save_xml):
+            documents += [localInput(xml_local)]
         makeCollectionEPUB(documents, args.cache, output_name, args.log_to)
+        logging.info(downloader.stats())
         epubcheck('{0}.epub'.format(output_name))
         sys.exit(0)
 
@@ -289,11 +976,12 @@ def main():
         #The name of the directory and the .epub should be a string like
         #journal.pcbi.1002211
         #or if already re-named, it will assume the xml name
-        input_name = os.path.splitext(os.path.split(xml_local)[1])[0]
+        input_name = discovery.inputName(xml_local)
         output_name = os.path.join(args.output, input_name)
         if os.path.isdir(output_name):
             dirExists(output_name, args.batch)
         makeEPUB(document, xml_local, args.cache, output_name, args.log_to)
+        logging.info(downloader.stats())
         if download and not settings.save_xml:
             os.remove(xml_local)
             newname = u'{0}.log'.format(input_name)
@@ -0,0 +1,149 @@
+'''A manifest of the ePubs built in batch mode, so that running a batch again
+rebuilds only the articles which have changed. The manifest is an SQLite file
+in the output directory with a row per ePub, named by its path relative to
+that directory, recording:
+  the xml file it was made from, with its size, modification time and SHA-1
+  the version of the converter and a hash of the settings affecting output
+  the SHA-1 of each cached image it was made with, by cache key
+  the size and modification time of the ePub itself
+
+An ePub is up to date while all of these still hold. The check costs a stat
+of the xml file and of the ePub, and lookups in the index of the image cache;
+the xml file is only hashed again if its size or modification time differ,
+such as after it was downloaded again or copied.
+
+A batch split into shards over several machines has a manifest per shard, and
+these are combined with merge().'''
+
+import hashlib
+import json
+import os
+import os.path
+import sqlite3
+import time
+
+#The settings whose values change the ePubs made
+relevant_settings = ['engine', 'cleanup', 'caching', 'base_epub',
+                     'css_location']
+
+
+#The manifest table, with a row per ePub
+schema = '''CREATE TABLE IF NOT EXISTS builds (
+    epub TEXT PRIMARY KEY, source TEXT, size INTEGER, mtime REAL, sha1 TEXT,
+    version TEXT, settings TEXT, images TEXT, epub_size INTEGER,
+    epub_mtime REAL, built REAL)'''
+
+
+def connect(filename):
+    '''Opens the manifest file filename, creating it if needed'''
+    db = sqlite3.connect(filename, timeout = 60)
+    with db:
+        db.execute(schema)
+    return db
+
+
+def fileDigest(filename):
+    '''Returns the SHA-1 hex digest of the file filename'''
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as source:
+        for chunk in iter(lambda: source.read(1 << 16), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settingsDigest(settings):
+    '''Returns a hash of the relevant_settings of the Settings settings'''
+    values = dict((name, getattr(settings, name))
+                  for name in relevant_settings)
+    return hashlib.sha1(json.dumps(values, sort_keys = True)).hexdigest()
+
+
+class BuildManifest(object):
+    '''The manifest file filename, for ePubs made by the given version of the
+    converter with the given Settings'''
+    def __init__(self, filename, version, settings):
+        self.version = version
+        self.settings = settingsDigest(settings)
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.db = connect(filename)
+
+    def name(self, epub_file):
+        '''Returns the name of the row of the ePub epub_file: its path
+        relative to the directory of the manifest, with / as the separator'''
+        return os.path.relpath(os.path.abspath(epub_file),
+                               self.directory).replace(os.sep, '/')
+
+    def close(self):
+        '''Closes the manifest'''
+        self.db.close()
+
+    def isCurrent(self, source, epub_file, image_cache = None):
+        '''Determines if the ePub epub_file was made from the xml file source
+        as it is now, by this version with these settings. Given the
+        ContentCache image_cache, the ePub is also out of date if it holds a
+        different body for any of the images the ePub was made with; images
+        since evicted from the cache do not count.'''
+        name = self.name(epub_file)
+        row = self.db.execute('''SELECT size, mtime, sha1, version, settings,
+            images, epub_size, epub_mtime FROM builds WHERE epub = ?''',
+                              (name,)).fetchone()
+        if row is None:
+            return False
+        size, mtime, sha1, version, settings, images = row[:6]
+        epub_size, epub_mtime = row[6:]
+        if version != self.version or settings != self.settings:
+            return False
+        try:
+            epub_stat = os.stat(epub_file)
+            stat = os.stat(source)
+        except OSError:
+            return False
+        if (epub_stat.st_size, epub_stat.st_mtime) != (epub_size, epub_mtime):
+            return False
+        if (stat.st_size, stat.st_mtime) != (size, mtime):
+            if stat.st_size != size or fileDigest(source) != sha1:
+                return False
+            #The same content, touched or copied; recorded so that the next
+            #check need not hash it again
+            with self.db:
+                self.db.execute('''UPDATE builds SET mtime = ?
+                    WHERE epub = ?''', (stat.st_mtime, name))
+        if image_cache is not None:
+            for key, digest in json.loads(images).items():
+                record = image_cache.record(key)
+                if record is not None and record['sha1'] != digest:
+                    return False
+        return True
+
+    def record(self, source, epub_file, images):
+        '''Records that epub_file was made from the xml file source, with the
+        cached images given as a dictionary of their SHA-1 by key'''
+        stat = os.stat(source)
+        epub_stat = os.stat(epub_file)
+        with self.db:
+            self.db.execute('''INSERT OR REPLACE INTO builds VALUES
+                (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                            (self.name(epub_file), source,
+                             stat.st_size, stat.st_mtime,
+                             fileDigest(source), self.version, self.settings,
+                             json.dumps(images), epub_stat.st_size,
+                             epub_stat.st_mtime, time.time()))
+
+
+def merge(target, sources):
+    '''Combines the manifest files sources into the manifest file target,
+    keeping the latest build of each ePub. Returns the number of ePubs in
+    target.'''
+    db = connect(target)
+    try:
+        for source in sources:
+            db.execute('ATTACH DATABASE ? AS source', (source,))
+            with db:
+                db.execute('''INSERT OR REPLACE INTO builds
+                    SELECT new.* FROM source.builds AS new
+                    LEFT JOIN builds AS old ON old.epub = new.epub
+                    WHERE old.epub IS NULL OR old.built < new.built''')
+            db.execute('DETACH DATABASE source')
+        return db.execute('SELECT COUNT(*) FROM builds').fetchone()[0]
+    finally:
+        db.close()
@@ -1,17 +1,18 @@
 from main import __version__
 import datetime
 import os.path
+import posixpath
 import utils
+import tagindex
 import dublincore
-from xml.dom.minidom import getDOMImplementation
+import xmlbackend
 
 class ContentOPF(object):
     '''A class to represent the OPF document.'''
     
     def __init__(self, location, collection_mode = False):
-        #Create a DOMImplementation for the OPF
-        impl = getDOMImplementation()
-        self.opf = impl.createDocument(None, 'package', None)
+        #Create the OPF Document
+        self.opf = xmlbackend.createDocument('package')
         #Grab the root <package> node
         self.package = self.opf.lastChild
         #Set attributes for this node, including namespace declarations
@@ -29,7 +30,7 @@ class ContentOPF(object):
         self.spine.setAttribute('toc', 'ncx')
         #Due to importance in relative positioning of the content.opf file to 
         #other files in the the packaged, the contentOPF instance shoudl be 
-        #aware of its location
+        #aware of its location: the epubwriter receiving the ePub's files
         self.location = location
         #Make a list of articles, even if only one expected
         self.articles = []
@@ -57,10 +58,10 @@ class ContentOPF(object):
                 aid = _data.split('journal.')[1]
         aid_dashed = aid.replace('.', '-')
         #If there are tables, make tables xml file
-        tables = article.body.getElementsByTagName('table')
+        tables = tagindex.getElementsByTagName(article.body, 'table')
         #If there are refs, make biblio xml file
         if article.back:
-            refs = article.back.node.getElementsByTagName('ref')
+            refs = tagindex.getElementsByTagName(article.back.node, 'ref')
         else:
             refs = None
         self.addToSpine(aid_dashed, tables, refs)
@@ -125,33 +126,29 @@ medium, provided the original author and source are credited.'''
         '''The Manifest declares all of the documents within the ePub (except 
         mimetype and META-INF/container.xml). It should be generated as a 
         final step in the ePub process and after all articles have been parsed 
-        into <metadata> and <spine>.'''
+        into <metadata> and <spine>. The documents are those registered by the
+        epubwriter, in the order they were written.'''
         mimetypes = {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'xml': 
                      'application/xhtml+xml', 'png': 'image/png', 'css':
                      'text/css', 'ncx': 'application/x-dtbncx+xml'}
-        current_dir = os.getcwd()
-        os.chdir(self.location)
-        for path, subname, filenames in os.walk('OPS'):
-            path = path[4:]
-            if filenames:
-                for filename in filenames:
-                    name, ext = os.path.splitext(filename)
-                    ext = ext[1:]
-                    new = self.manifest.appendChild(self.opf.createElement('item'))
-                    new.setAttribute('href', os.path.join(path, filename))
-                    new.setAttribute('media-type', mimetypes[ext])
-                    if filename == 'toc.ncx':
-                        new.setAttribute('id', 'ncx')
-                    elif ext == 'png':
-                        id = os.path.dirname(path)
-                        id = id[7:]
-                        new.setAttribute('id', '{0}-{1}'.format(id, filename.replace('.', '-')))
-                    else:
-                        new.setAttribute('id', filename.replace('.', '-'))
-        os.chdir(current_dir)
+        for entry in self.location.names:
+            if not entry.startswith('OPS/'):
+                continue
+            path, filename = posixpath.split(entry[4:])
+            name, ext = os.path.splitext(filename)
+            ext = ext[1:]
+            new = self.manifest.appendChild(self.opf.createElement('item'))
+            new.setAttribute('href', entry[4:])
+            new.setAttribute('media-type', mimetypes[ext])
+            if filename == 'toc.ncx':
+                new.setAttribute('id', 'ncx')
+            elif ext == 'png':
+                id = posixpath.dirname(path)
+                id = id[7:]
+                new.setAttribute('id', '{0}-{1}'.format(id, filename.replace('.', '-')))
+            else:
+                new.setAttribute('id', filename.replace('.', '-'))
     
     def write(self):
         self.makeManifest()
-        filename = os.path.join(self.location, 'OPS', 'content.opf')
-        with open(filename, 'w') as output:
-            output.write(self.opf.toprettyxml(encoding = 'utf-8'))
+        self.location.writeDocument('OPS/content.opf', self.opf)
@@ -0,0 +1,144 @@
+'''Prefetching of article images into the cache, so that a later conversion
+need not wait on the network. The images of each article are found with a
+streaming scan of its xml file by iterparse, which drops every element once it
+has ended, instead of by building an Article. The missing images of successive
+articles are gathered and handed to the shared fetcher together, chunk_size at
+a time, so its threads stay busy across articles with few images. Cached
+images which are no longer current are revalidated, and downloaded again only
+if the server has changed them.'''
+
+import logging
+import os.path
+
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+import article
+import discovery
+
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+#The most images handed to the fetcher at once
+chunk_size = 256
+
+
+def scanImages(xml_file):
+    '''Returns the DOI of the article in xml_file and the xlink:href of each
+    of its graphic and inline-graphic elements, in document order'''
+    doi = None
+    hrefs = []
+    stack = []
+    with discovery.openInput(xml_file) as source:
+        for event, elem in etree.iterparse(source, events = ('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag in ('graphic', 'inline-graphic'):
+                hrefs.append(elem.get(XLINK_HREF))
+            elif elem.tag == 'article-id' and doi is None:
+                #The DOI of the article itself, as Article.getDOI() gives it
+                if elem.get('pub-id-type') == 'doi' and \
+                   any(parent.tag == 'article-meta' for parent in stack):
+                    doi = elem.text
+            if stack:
+                stack[-1].remove(elem)
+    return doi, hrefs
+
+
+class Prefetcher(object):
+    '''Fills the ContentCache image_cache with the images of articles,
+    counting the images found current in the cache (hits), those the server
+    confirmed unchanged, those downloaded and their bytes, and those which
+    could not be downloaded, as well as the articles skipped as unreadable
+    or not from PLoS'''
+    def __init__(self, image_cache):
+        self.image_cache = image_cache
+        self.articles = 0
+        self.skipped = 0
+        self.hits = 0
+        self.unchanged = 0
+        self.fetched = 0
+        self.failed = 0
+        self.bytes = 0
+        #The (DOI, keys) of the articles whose images are being gathered
+        self.pending = []
+        #The address and key of each missing or stale image of the pending
+        #articles, and their keys
+        self.missing = []
+        self.queued = set()
+
+    def add(self, xml_file):
+        '''Scans the article in xml_file and queues its missing images'''
+        doi, hrefs = scanImages(xml_file)
+        if doi is None:
+            raise ValueError('No DOI found')
+        images = article.plosImages(doi, hrefs)
+        self.articles += 1
+        for addr, key, _tag, _subdir, _filename in images:
+            if key in self.queued:  # Already queued, and counted, for one
+                continue
+            if self.image_cache.isCurrent(self.image_cache.record(key)):
+                self.hits += 1
+            else:
+                self.missing.append((addr, key))
+                self.queued.add(key)
+        keys = [image[1] for image in images]
+        #Kept from eviction, by the articles recorded before it, until flushed
+        self.image_cache.pin(keys)
+        self.pending.append((doi, keys))
+        if len(self.missing) >= chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''Downloads the queued images and records the pending articles'''
+        for addr, _key, location, status in \
+                self.image_cache.update(self.missing):
+            if status == 'failed':
+                self.failed += 1
+                logging.error('Could not prefetch {0}'.format(addr))
+            elif status == 'unchanged':
+                self.unchanged += 1
+            else:
+                self.fetched += 1
+                self.bytes += os.path.getsize(location)
+        for doi, keys in self.pending:
+            self.image_cache.storeArticle(doi, keys)
+        self.image_cache.unpin()
+        self.pending = []
+        self.missing = []
+        self.queued = set()
+
+    def run(self, xml_files):
+        '''Prefetches the images of each of xml_files. An article which cannot
+        be read, or whose images cannot be named, such as one whose DOI is
+        not that of a PLoS article, is skipped and reported.'''
+        for xml_file in xml_files:
+            try:
+                self.add(xml_file)
+            except Exception as error:
+                self.skipped += 1
+                message = u'Skipping {0}: {1}: {2}'.format(xml_file,
+                                                          type(error).__name__,
+                                                          error)
+                print(message)
+                logging.error(message)
+        self.flush()
+
+    def hitRate(self):
+        '''Returns the fraction of images which were not downloaded, being
+        current in the cache or confirmed unchanged'''
+        images = self.hits + self.unchanged + self.fetched + self.failed
+        if not images:
+            return 0.0
+        return float(self.hits + self.unchanged) / images
+
+    def summary(self):
+        '''Returns a line describing the prefetch'''
+        msg = u'Prefetched images for {0} articles: {1} fetched ({2} bytes), '\
+              u'{3} already cached, {4} unchanged ({5:.0%} hit rate), '\
+              u'{6} failed; {7} articles skipped'
+        return msg.format(self.articles, self.fetched, self.bytes, self.hits,
+                          self.unchanged, self.hitRate(), self.failed,
+                          self.skipped)
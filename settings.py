@@ -12,7 +12,37 @@ class Settings(object):
         self.caching = True
         #This sets the cache_location
         self.cache_location = os.path.join(local, 'cache')
+        #The most bytes the cached images may take up, None for no limit. The
+        #least recently used images are evicted first. See "main.py cache".
+        self.cache_size_limit = 2 * 1024 ** 3
+        #Cached files are used for this many seconds after they were
+        #downloaded, then the server is asked whether they have changed
+        #before they are used again. None never asks.
+        self.cache_ttl = 7 * 24 * 3600
         
+        #Images are downloaded concurrently by this many threads, with no more
+        #than downloads_per_host requests to one server at a time. Fewer are
+        #made while a server is throttling, see the downloader module.
+        self.download_threads = 8
+        self.downloads_per_host = 4
+        #The most requests per second made to one server, None for no limit
+        #beyond downloads_per_host. The rate made is lowered while a server
+        #throttles, and recovers once it stops.
+        self.host_request_rate = None
+        #Failed requests are retried this many times, with backoff
+        self.download_retries = 4
+        #The seconds allowed for downloading the images of one article, None
+        #for no limit. An article missing any image is not converted.
+        self.download_budget = 300
+        
+        #Batch mode converts this many articles at once, each in a process of
+        #its own which logs to its own file. The download limits above are
+        #shared among them.
+        self.batch_jobs = 1
+        #The seconds each article of a batch may take before it is given up
+        #as failed, 0 for no limit. Articles which fail are reported, and
+        #do not stop the batch.
+        self.article_timeout = 600
         #Logging is a good idea, best to leave True
         self.logging = True
         #This sets the location for storing log files
@@ -27,11 +57,17 @@ class Settings(object):
         #This sets a default output location
         self.default_output = os.path.join(local, 'output')
         
-        #This determines whether the program will erase the pre-zipped output
-        #directory once it finishes zipping it to ePub.
+        #This determines whether the program writes the ePub's files straight
+        #into the ePub, with no output directory. If False, the files are
+        #written to an output directory which is zipped and then kept.
         #It is generally good to leave as True. You can always unzip the ePub.
         self.cleanup = True
         
+        #This sets whether the ePub's documents are deflated, 6, at zlib's
+        #default level as zipfile does, or stored uncompressed, 0. Images are
+        #always stored as they are already compressed.
+        self.compression_level = 6
+        
         #This determines the location of the base_epub directory, which is the
         #reference directory copied to instantiate the epub hierarchy
         self.base_epub = os.path.join('resources', 'base_epub')
@@ -40,5 +76,16 @@ class Settings(object):
         #the ePub's css directory
         self.css_location = os.path.join('resources', 'text.css')
         
+        #This selects the engine converting the article content to XHTML.
+        #'handlers' is the reference, 'xslt' requires lxml (see the xslt
+        #module) and 'stream' writes the body as it is converted, to bound
+        #memory use on very large articles.
+        self.engine = 'handlers'
+        
+        #This selects the parser of article xml files, see the xmlbackend
+        #module. 'minidom' is the reference, 'lxml' parses with libxml2 and
+        #builds the same Document.
+        self.xml_parser = 'minidom'
+        
         #Configure the location of epubcheck-*.jar.
         self.epubcheck = '../epubcheck/epubcheck-3.0b3.jar'
\ No newline at end of file
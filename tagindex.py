@@ -0,0 +1,363 @@
+'''An index from tagName to the live Elements of a Document. The index is built
+once, when the Document is parsed or assembled, and then kept up to date as
+Elements are renamed, attached and detached, so that a lookup only costs the
+number of matching Elements rather than a traversal of the whole tree.
+
+Elements are kept in document order by numbering them in preorder, each also
+recording the number of its last descendant, so that the Elements beneath a
+node are a range of those numbers. The numbers are spaced apart, so that a
+subtree attached later is numbered within the gap between the Elements
+before and after it, and its Elements are inserted into the cached orders;
+a detached subtree is removed from them, and only its ancestors whose range
+ended with it are updated. Renaming leaves the numbering valid. Only when a
+gap is used up, or an Element is moved without being detached first, is the
+whole Document numbered again, on the next lookup.
+
+Code that mutates an indexed Document must report its mutations through
+rename(), attached() and detaching(). These functions, and the lookup
+functions, quietly fall back to plain minidom behavior for nodes whose
+Document has no index.'''
+
+from bisect import bisect_left, bisect_right
+
+import utils
+
+#When True, every lookup first verifies the index against a full traversal of
+#the Document and raises ValueError if they disagree. Meant for testing only.
+checking = False
+
+#The spacing of the numbers of a Document numbered whole, and the greatest
+#spacing of those given to the Elements of a subtree attached later
+spacing = 1 << 32
+attached_spacing = 1 << 16
+
+
+def walkElements(node):
+    '''Yields node, if it is an Element, then all of its descendant Elements in
+    document order.'''
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.nodeType == node.ELEMENT_NODE:
+            yield node
+        stack.extend(reversed(node.childNodes))
+
+
+class TagIndex(object):
+    '''A per-Document index mapping tagNames to the Elements using them. The
+    index attaches itself to the Document as document.tag_index.'''
+    def __init__(self, document):
+        self.document = document
+        #tagName -> set of Elements
+        self.elements = {}
+        #Element -> its preorder number, and the number of its last
+        #descendant, or its own if it has none; None until numbered, and
+        #whenever the numbering cannot be kept up to date
+        self.positions = None
+        self.lasts = None
+        #tagName -> (list of Elements in document order, list of their
+        #numbers); a cache, dropped for a tagName whenever one of its Elements
+        #is renamed, and for every tagName with the numbering
+        self.ordered = {}
+        self.add(document)
+        document.tag_index = self
+
+    def number(self):
+        '''Numbers the Elements of the Document in preorder'''
+        positions = {}
+        lasts = {}
+        position = -spacing
+        element_node = self.document.ELEMENT_NODE
+        stack = [(child, False) for child in reversed(self.document.childNodes)
+                 if child.nodeType == element_node]
+        while stack:
+            node, leaving = stack.pop()
+            if leaving:
+                lasts[node] = position
+                continue
+            position += spacing
+            positions[node] = position
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.childNodes)
+                         if child.nodeType == element_node)
+        self.positions = positions
+        self.lasts = lasts
+
+    def changed(self):
+        '''Drops the numbering and the cached orders, for the whole Document
+        to be numbered again by the next lookup'''
+        self.positions = None
+        self.lasts = None
+        self.ordered = {}
+
+    def add(self, node):
+        '''Adds node and its descendant Elements to the index. This is also
+        used when a node has moved within the Document.'''
+        elements = list(walkElements(node))
+        if not elements:
+            return
+        for element in elements:
+            self.elements.setdefault(element.tagName, set()).add(element)
+        if self.positions is None:
+            return
+        #Elements moved without being detached still have their old numbers
+        positions = self.positions
+        if any(element in positions for element in elements) or \
+           not self.insert(node, elements):
+            self.changed()
+
+    def insert(self, node, elements):
+        '''Numbers the Elements of the subtree node, just attached, within
+        the gap between the Elements before and after it and inserts them
+        into the cached orders. Returns False if the gap is too small.'''
+        parent = node.parentNode
+        if parent is None or parent.nodeType != parent.ELEMENT_NODE:
+            return False
+        previous = previousElement(node)
+        if previous is None:
+            low = self.positions[parent]
+        else:
+            low = self.lasts[previous]
+        following = followingElement(node)
+        step = attached_spacing
+        if following is not None:
+            step = min(step, (self.positions[following] - low) //
+                       (len(elements) + 1))
+            if step < 1:
+                return False
+        #The Elements are in preorder, numbered as number() would
+        position = low
+        stack = [(node, False)]
+        while stack:
+            element, leaving = stack.pop()
+            if leaving:
+                self.lasts[element] = position
+                continue
+            position += step
+            self.positions[element] = position
+            stack.append((element, True))
+            stack.extend((child, False)
+                         for child in reversed(element.childNodes)
+                         if child.nodeType == child.ELEMENT_NODE)
+        #The range of an ancestor ending before the subtree now ends with it
+        while parent is not None and parent.nodeType == parent.ELEMENT_NODE:
+            if self.lasts[parent] >= position:
+                break
+            self.lasts[parent] = position
+            parent = parent.parentNode
+        for element in elements:
+            try:
+                ordered, numbers = self.ordered[element.tagName]
+            except KeyError:
+                continue
+            index = bisect_right(numbers, self.positions[element])
+            ordered.insert(index, element)
+            numbers.insert(index, self.positions[element])
+        return True
+
+    def discard(self, node):
+        '''Removes node and its descendant Elements from the index'''
+        elements = list(walkElements(node))
+        if not elements:
+            return
+        if self.positions is not None:
+            self.remove(node, elements)
+        for element in elements:
+            try:
+                self.elements[element.tagName].discard(element)
+            except KeyError:
+                pass
+
+    def remove(self, node, elements):
+        '''Removes the Elements of the subtree node, about to be detached,
+        from the numbering and the cached orders'''
+        parent = node.parentNode
+        if node not in self.positions:
+            self.changed()
+            return
+        last = self.lasts[node]
+        #The range of an ancestor ending with the subtree now ends with the
+        #Element before it
+        if parent is not None and parent.nodeType == parent.ELEMENT_NODE:
+            previous = previousElement(node)
+            if previous is None:
+                end = self.positions[parent]
+            else:
+                end = self.lasts[previous]
+            while parent is not None and \
+                  parent.nodeType == parent.ELEMENT_NODE and \
+                  self.lasts[parent] == last:
+                self.lasts[parent] = end
+                parent = parent.parentNode
+        for element in elements:
+            position = self.positions.pop(element)
+            del self.lasts[element]
+            try:
+                ordered, numbers = self.ordered[element.tagName]
+            except KeyError:
+                continue
+            index = bisect_left(numbers, position)
+            del ordered[index]
+            del numbers[index]
+
+    def rename(self, element, tagname):
+        '''Changes the tagName of a single Element, updating the index'''
+        try:
+            self.elements[element.tagName].discard(element)
+        except KeyError:
+            pass
+        self.ordered.pop(element.tagName, None)
+        element.tagName = tagname
+        self.elements.setdefault(tagname, set()).add(element)
+        self.ordered.pop(tagname, None)
+
+    def lookup(self, tagname, topnode = None):
+        '''Returns a list of the Elements with tagName in document order. If
+        topnode is provided, only Elements beneath it are returned, like
+        topnode.getElementsByTagName(tagname).'''
+        if checking:
+            self.check()
+        if self.positions is None:
+            self.number()
+        try:
+            ordered, numbers = self.ordered[tagname]
+        except KeyError:
+            ordered = sorted(self.elements.get(tagname, ()),
+                             key = self.positions.__getitem__)
+            numbers = [self.positions[element] for element in ordered]
+            self.ordered[tagname] = (ordered, numbers)
+        if topnode is None or topnode is self.document:
+            return list(ordered)
+        #The descendants of topnode are numbered after it, up to its last
+        start = bisect_right(numbers, self.positions[topnode])
+        end = bisect_right(numbers, self.lasts[topnode])
+        return ordered[start:end]
+
+    def check(self):
+        '''Compares the index to a full traversal of the Document, raising
+        ValueError on the first tagName where they differ.'''
+        actual = {}
+        for element in walkElements(self.document):
+            actual.setdefault(element.tagName, []).append(element)
+        for tagname in set(actual) | set(self.elements):
+            found = actual.get(tagname, [])
+            if set(found) != self.elements.get(tagname, set()):
+                msg = 'Tag index is out of date for <{0}> elements'
+                raise ValueError(msg.format(tagname))
+            if tagname in self.ordered and self.ordered[tagname][0] != found:
+                msg = 'Tag index order is out of date for <{0}> elements'
+                raise ValueError(msg.format(tagname))
+        if self.positions is not None:
+            self.checkNumbering()
+
+    def checkNumbering(self):
+        '''Raises ValueError unless the numbers of the Elements increase in
+        document order, and the last number of each is that of its last
+        descendant'''
+        elements = list(walkElements(self.document))
+        if set(elements) != set(self.positions):
+            raise ValueError('Tag index numbering is out of date')
+        numbers = [self.positions[element] for element in elements]
+        if any(a >= b for a, b in zip(numbers, numbers[1:])):
+            raise ValueError('Tag index numbering is out of order')
+        for element in elements:
+            last = max(self.positions[descendant]
+                       for descendant in walkElements(element))
+            if self.lasts[element] != last:
+                msg = 'Tag index range is out of date for a <{0}> element'
+                raise ValueError(msg.format(element.tagName))
+
+
+def previousElement(node):
+    '''Returns the Element preceding node among its siblings, or None'''
+    node = node.previousSibling
+    while node is not None and node.nodeType != node.ELEMENT_NODE:
+        node = node.previousSibling
+    return node
+
+
+def followingElement(node):
+    '''Returns the first Element following node and its descendants in
+    document order, or None'''
+    while node is not None:
+        sibling = node.nextSibling
+        while sibling is not None and sibling.nodeType != sibling.ELEMENT_NODE:
+            sibling = sibling.nextSibling
+        if sibling is not None:
+            return sibling
+        node = node.parentNode
+    return None
+
+
+def getIndex(node):
+    '''Returns the TagIndex for the Document holding node, or None if the node
+    is detached or its Document is not indexed.'''
+    while node.parentNode is not None:
+        node = node.parentNode
+    return getattr(node, 'tag_index', None)
+
+
+def getElementsByTagName(topnode, tagname):
+    '''An indexed replacement for topnode.getElementsByTagName(tagname)'''
+    index = getIndex(topnode)
+    if index is None:
+        return topnode.getElementsByTagName(tagname)
+    return index.lookup(tagname, topnode)
+
+
+def getElementsByTagNames(topnode, tagnames):
+    '''An indexed replacement for utils.getElementsByTagNames()'''
+    index = getIndex(topnode)
+    if index is None:
+        return utils.getElementsByTagNames(topnode, tagnames)
+    found = {}
+    for tagname in tagnames:
+        found[tagname] = index.lookup(tagname, topnode)
+    return found
+
+
+def rename(element, tagname):
+    '''Sets the tagName of element, keeping its Document's index current'''
+    index = getIndex(element)
+    if index is None:
+        element.tagName = tagname
+    else:
+        index.rename(element, tagname)
+
+
+def attached(node):
+    '''Must be called after node is inserted into, or moved within, a tree.
+    A node moved without detaching() being called first has the whole
+    Document numbered again.'''
+    index = getIndex(node)
+    if index is not None:
+        index.add(node)
+
+
+def detaching(node):
+    '''Must be called before node is removed from its tree'''
+    index = getIndex(node)
+    if index is not None:
+        index.discard(node)
+
+
+def transplant(node, newparent, refchild = None):
+    '''Moves node, with its descendants, to newparent before refchild (or at
+    the end), updating the indexes of both trees. Unlike cloneNode() nothing is
+    copied, so this should be used whenever the original will not be read
+    again.'''
+    detaching(node)
+    newparent.insertBefore(node, refchild)
+    attached(node)
+    return node
+
+
+def transplantChildren(fromnode, newparent, copy = False):
+    '''Moves all of the children of fromnode to the end of newparent. If copy
+    is True, deep copies are appended instead and fromnode is left intact.'''
+    for child in list(fromnode.childNodes):
+        if copy:
+            newparent.appendChild(child.cloneNode(deep = True))
+            attached(newparent.lastChild)
+        else:
+            transplant(child, newparent)
@@ -0,0 +1,154 @@
+'''Helpers shared by the tests, which run with Python 2 from the repository
+directory:
+
+python -m unittest discover -s tests'''
+
+import BaseHTTPServer
+import SocketServer
+import logging
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+#The tests run upon the modules of this checkout
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import article
+import content
+import epubwriter
+import opf
+import tocncx
+import utils
+
+articles = os.path.join(root, 'tests', 'articles')
+#The conversion logs, among other things, each image it cannot find
+logging.disable(logging.CRITICAL)
+#The body of every image the StandIn serves, the signature of a PNG and some
+#padding
+image = '\x89PNG\r\n\x1a\n' + 'x' * 4096
+
+
+def articleFiles():
+    '''Returns the xml files of tests/articles'''
+    return [os.path.join(articles, name)
+            for name in sorted(os.listdir(articles))
+            if name.endswith('.xml')]
+
+
+def quietly(function, *args, **kwargs):
+    '''Returns function(*args, **kwargs), discarding what it prints'''
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def convert(document, engine, images = ()):
+    '''Converts the Article document with the given engine, as
+    main.makeEPUB() does but without its images, and returns the contents of
+    the ePub as a dictionary of file contents by name. Empty image files are
+    placed in the ePub for the names, sans extension, in images.'''
+    directory = tempfile.mkdtemp(prefix = 'oae-test-')
+    try:
+        base_epub = os.path.join(directory, 'base_epub')
+        utils.makeEPUBBase(base_epub,
+                           os.path.join(root, 'resources', 'text.css'))
+        outdirect = os.path.join(directory, document.getDOI().split('/')[1])
+        epub = epubwriter.ZipWriter(base_epub, outdirect, 6)
+        jid = document.getDOI().split('journal.')[1]
+        for name in images:
+            epub.writeData('OPS/images-{0}/{1}.png'.format(jid, name), '')
+        quietly(write, document, epub, engine)
+        epub.close()
+        with zipfile.ZipFile(epub.filename) as archive:
+            return dict((name, archive.read(name))
+                        for name in archive.namelist())
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+
+def write(document, epub, engine):
+    '''Writes the documents of the Article document to the ZipWriter epub'''
+    toc = tocncx.TocNCX()
+    toc.takeArticle(document)
+    myopf = opf.ContentOPF(epub)
+    myopf.takeArticle(document)
+    content.OPSContent(document.getDOI(), epub, document, engine)
+    toc.write(epub)
+    myopf.write()
+
+
+def convertFile(xml_file, engine = 'handlers', images = ()):
+    '''Parses and converts the article xml_file as convert() does'''
+    return convert(quietly(article.Article, xml_file), engine, images)
+
+
+class StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''A local HTTP server standing in for a publisher, answering every GET
+    with image after latency seconds, on a thread of its own per connection.
+    It counts the requests it answers in requests. Paths beginning /short/
+    are answered with a body shorter than their Content-Length, and those
+    beginning /drop/ have their connection closed after the response, though
+    the client was told it would be kept open, as by a server timing out an
+    idle connection.'''
+    daemon_threads = True
+
+    def __init__(self, latency = 0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           StandInHandler)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        '''Serves requests in a thread of its own, and returns the URL of
+        the server, which may also be used as its proxy'''
+        thread = threading.Thread(target = self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+    def stop(self, session):
+        '''Closes the connections the downloader.Session session keeps for
+        reuse, ending the threads serving them, then stops serving'''
+        for connections in session.idle.values():
+            for connection in connections:
+                connection.close()
+        session.idle.clear()
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Serves image for any path, keeping the connection open'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+        path = self.path.split('://', 1)[-1]
+        path = path[path.find('/'):]
+        length = len(image)
+        if path.startswith('/short/'):
+            length += 1024
+            self.close_connection = 1
+        elif path.startswith('/drop/'):
+            self.close_connection = 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        self.wfile.write(image)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,102 @@
+'''Batch mode run as a command upon tests/articles, with the StandIn of support
+as the proxy for the images: converted by a pool of processes, found up to
+date when run again, and converted in two shards whose merged manifest equals
+that of the whole batch.'''
+
+import json
+import os
+import os.path
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+import support
+
+
+def contents(epub_file):
+    '''Returns the contents of the ePub epub_file by name'''
+    with zipfile.ZipFile(epub_file) as epub:
+        return dict((name, epub.read(name)) for name in epub.namelist())
+
+
+def builds(manifest_file):
+    '''Returns the rows of the manifest file manifest_file by ePub, without
+    the times at which they were made, and with their images decoded'''
+    db = sqlite3.connect(manifest_file)
+    try:
+        rows = db.execute('''SELECT epub, source, size, sha1, version,
+            settings, images FROM builds''').fetchall()
+    finally:
+        db.close()
+    return dict((row[0], row[1:-1] + (json.loads(row[-1]),)) for row in rows)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        #The settings are relative to the working directory
+        self.directory = tempfile.mkdtemp(prefix = 'oae-test-')
+        resources = os.path.join(self.directory, 'resources')
+        os.mkdir(resources)
+        shutil.copy(os.path.join(support.root, 'resources', 'text.css'),
+                    resources)
+        self.server = support.StandIn()
+        proxy = self.server.start()
+        self.env = dict(os.environ, http_proxy = proxy, https_proxy = proxy,
+                        no_proxy = '', PYTHONDONTWRITEBYTECODE = '1')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def command(self, *args):
+        '''Runs main.py with args in the working directory, and returns its
+        summary of the batch as (converted, stale, up to date)'''
+        output = subprocess.check_output(
+            [sys.executable, os.path.join(support.root, 'main.py')] +
+            list(args), cwd = self.directory, env = self.env,
+            stderr = subprocess.STDOUT)
+        match = re.search(r'Converted (\d+) of (\d+) articles .* (\d+) up to '
+                          r'date', output)
+        if match is None:
+            return output
+        return tuple(int(count) for count in match.groups())
+
+    def batch(self, output, *args):
+        '''Runs batch mode upon the test articles into output'''
+        return self.command('-b', support.articles, '-o', output, '-c',
+                            'cache', '-l', 'logs', *args)
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def testBatch(self):
+        count = len(support.articleFiles())
+        self.assertEqual(self.batch('whole', '-j', '2'), (count, count, 0))
+        self.assertEqual(self.batch('whole', '-j', '2'), (0, 0, count))
+        #The shards share the output directory, each with its manifest
+        first = self.batch('shards', '--shard', '1/2')
+        second = self.batch('shards', '--shard', '2/2')
+        self.assertEqual(first[0] + second[0], count)
+        self.assertTrue(first[0] and second[0])
+        self.command('merge', '-o', 'shards',
+                     self.path('shards', 'manifest-1of2.sqlite'),
+                     self.path('shards', 'manifest-2of2.sqlite'))
+        whole = builds(self.path('whole', 'manifest.sqlite'))
+        self.assertEqual(len(whole), count)
+        self.assertEqual(builds(self.path('shards', 'manifest.sqlite')),
+                         whole)
+        for epub in whole:
+            self.assertEqual(contents(self.path('shards', epub)),
+                             contents(self.path('whole', epub)), epub)
+        #The merged manifest finds the whole batch up to date
+        self.assertEqual(self.batch('shards'), (0, 0, count))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+'''The downloader module against the local StandIn of support: the retry of a
+request on an idle connection the server has closed, the IncompleteRead of a
+body shorter than its Content-Length, and the cancellation of the fetches
+which run out of their budget or are abandoned.'''
+
+import httplib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import urllib2
+
+import support
+
+import downloader
+
+
+class DownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix = 'oae-test-')
+        self.server = support.StandIn()
+        self.url = self.server.start()
+        #The Fetchers request through the shared session, which must not
+        #take a proxy from the environment
+        self.shared = downloader.session
+        downloader.session = downloader.Session()
+        downloader.session.proxies = {}
+
+    def tearDown(self):
+        self.server.stop(downloader.session)
+        downloader.session = self.shared
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def testReuse(self):
+        '''Requests to a host reuse its idle connection, and one the server
+        has closed is retried on a new connection'''
+        session = downloader.session
+        for path in ['/a', '/b', '/drop/c', '/d']:
+            response = session.open(self.url + path)
+            self.assertEqual(response.read(), support.image)
+        #The request for /d found the connection /drop/c was answered on,
+        #which the server had closed
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(session.opened, 2)
+        self.assertEqual(session.reused, 3)
+
+    def testShortBody(self):
+        '''A body shorter than its Content-Length is an IncompleteRead,
+        whether streamed or read, and is not retried on a new connection'''
+        session = downloader.session
+        output = io.BytesIO()
+        with self.assertRaises(urllib2.URLError) as raised:
+            session.open(self.url + '/short/a', output = output)
+        self.assertIsInstance(raised.exception.reason, httplib.IncompleteRead)
+        self.assertEqual(output.getvalue(), '')
+        with self.assertRaises(urllib2.URLError) as raised:
+            session.open(self.url + '/short/b')
+        self.assertIsInstance(raised.exception.reason, httplib.IncompleteRead)
+        self.assertEqual(self.server.requests, 2)
+
+    def testShortBodyFetch(self):
+        '''The Fetcher retries a short body, then gives None for it and
+        removes its file'''
+        fetcher = downloader.Fetcher(threads = 2, retries = 1)
+        fetcher.backoff = 0.01
+        urls = [self.url + '/a', self.url + '/short/b']
+        results = list(fetcher.fetchResponses(urls, None, self.directory))
+        self.assertEqual([url for url, _response in results], urls)
+        response = results[0][1]
+        self.assertEqual(response.read(), support.image)
+        self.assertIsNone(results[1][1])
+        #Twice more, if it was first made on the connection /a was answered
+        #on, which is then retried on a new one
+        self.assertIn(self.server.requests, [3, 4])
+        self.assertEqual(os.listdir(self.directory),
+                         [os.path.basename(response.filename)])
+
+    def testBudget(self):
+        '''Requests still waiting for their host when the budget runs out
+        are given up, rather than made'''
+        self.server.latency = 0.5
+        fetcher = downloader.Fetcher(threads = 3, per_host = 1, retries = 0,
+                                     budget = 0.2)
+        urls = [self.url + '/{0}'.format(name) for name in 'abc']
+        start = time.time()
+        results = list(fetcher.fetchResponses(urls, None, self.directory))
+        self.assertLess(time.time() - start, 1.0)
+        #Whichever request took the host's only slot is made
+        responses = [response for _url, response in results
+                     if response is not None]
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(responses[0].read(), support.image)
+        self.assertEqual(self.server.requests, 1)
+
+    def testCancel(self):
+        '''A fetch abandoned by its consumer is cancelled, and the files of
+        the results nobody consumed are removed'''
+        self.server.latency = 0.2
+        fetcher = downloader.Fetcher(threads = 4, per_host = 4)
+        urls = [self.url + '/{0}'.format(name) for name in 'abcdefgh']
+        responses = fetcher.fetchResponses(urls, None, self.directory)
+        url, response = next(responses)
+        os.remove(response.filename)
+        fetcher.cancel()
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertLess(self.server.requests, len(urls))
+        responses.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
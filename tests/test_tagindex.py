@@ -0,0 +1,73 @@
+'''The tagindex module kept up to date through a conversion: with checking set,
+every lookup verifies the index against a full traversal of the Document.'''
+
+import unittest
+from xml.dom import minidom
+
+import support
+
+import tagindex
+
+
+class TagIndexTest(unittest.TestCase):
+    def setUp(self):
+        tagindex.checking = True
+
+    def tearDown(self):
+        tagindex.checking = False
+
+    def testConversion(self):
+        '''Every engine converts the articles with the index checked at each
+        lookup, to the same ePub contents as without checking'''
+        for engine in ['handlers', 'xslt', 'stream']:
+            for xml_file in support.articleFiles():
+                checked = support.convertFile(xml_file, engine)
+                tagindex.checking = False
+                try:
+                    expected = support.convertFile(xml_file, engine)
+                finally:
+                    tagindex.checking = True
+                self.assertEqual(checked, expected, (engine, xml_file))
+
+    def testMutations(self):
+        '''Attaching and detaching subtrees keeps the numbering, which is
+        only made again when a gap is used up'''
+        document = minidom.parseString(
+            '<a><b><c/><c/></b><d><c/></d><e/></a>')
+        index = tagindex.TagIndex(document)
+        a = document.documentElement
+        b, d, e = a.childNodes
+        self.assertEqual(len(tagindex.getElementsByTagName(b, 'c')), 2)
+        positions = index.positions
+        #Into the middle, at the end of the range of <b> and before <d>
+        tagindex.transplant(d.firstChild, b)
+        self.assertEqual(len(tagindex.getElementsByTagName(b, 'c')), 3)
+        self.assertEqual(tagindex.getElementsByTagName(d, 'c'), [])
+        #A subtree of new Elements at the end of the Document
+        new = document.createElement('d')
+        new.appendChild(document.createElement('c'))
+        e.appendChild(new)
+        tagindex.attached(new)
+        self.assertEqual(tagindex.getElementsByTagName(a, 'c'),
+                         a.getElementsByTagName('c'))
+        #Out of the end of the range of <b>, which then ends with its second
+        #<c>, before another <c> is attached after <b>
+        tagindex.detaching(b.lastChild)
+        b.removeChild(b.lastChild)
+        a.insertBefore(document.createElement('c'), d)
+        tagindex.attached(d.previousSibling)
+        self.assertEqual(len(tagindex.getElementsByTagName(b, 'c')), 2)
+        self.assertEqual(tagindex.getElementsByTagName(a, 'c'),
+                         a.getElementsByTagName('c'))
+        self.assertIs(index.positions, positions)
+        #Until the gap before the first child of <a> is used up
+        for count in range(40):
+            a.insertBefore(document.createElement('c'), a.firstChild)
+            tagindex.attached(a.firstChild)
+            self.assertEqual(tagindex.getElementsByTagName(a, 'c'),
+                             a.getElementsByTagName('c'))
+        self.assertIsNot(index.positions, positions)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+'''Parity of the paths of the xmlbackend module: the 'lxml' parser must give
+the Document minidom parses, and write() and StreamWriter, used by the
+'stream' engine, must give what minidom would write.'''
+
+import io
+import unittest
+
+import support
+
+import xmlbackend
+
+
+class XMLBackendTest(unittest.TestCase):
+    def testParse(self):
+        '''parse() gives the Document of xml.dom.minidom'''
+        import xml.dom.minidom
+        for xml_file in support.articleFiles():
+            expected = xml.dom.minidom.parse(xml_file).toxml()
+            self.assertEqual(xmlbackend.parse(xml_file).toxml(), expected)
+
+    @unittest.skipUnless(xmlbackend.available, 'lxml is not installed')
+    def testLXMLParse(self):
+        '''The 'lxml' parser gives the Document of xml.dom.minidom'''
+        for xml_file in support.articleFiles():
+            expected = xmlbackend.parse(xml_file).toxml()
+            self.assertEqual(xmlbackend.lxmlParse(xml_file).toxml(), expected)
+
+    @unittest.skipUnless(xmlbackend.available, 'lxml is not installed')
+    def testLXMLConversion(self):
+        '''Articles parsed by the 'lxml' parser make the same ePub contents
+        as those parsed by minidom'''
+        for xml_file in support.articleFiles():
+            expected = support.convertFile(xml_file)
+            xmlbackend.use('lxml')
+            try:
+                actual = support.convertFile(xml_file)
+            finally:
+                xmlbackend.use('minidom')
+            self.assertEqual(actual, expected)
+
+    def testWrite(self):
+        '''write() streams the output of toprettyxml()'''
+        for xml_file in support.articleFiles():
+            document = xmlbackend.parse(xml_file)
+            output = io.BytesIO()
+            xmlbackend.write(document, output)
+            self.assertEqual(output.getvalue(),
+                             document.toprettyxml(encoding = 'utf-8'))
+
+    def testStreamEngine(self):
+        '''The 'stream' engine, writing through StreamWriter, makes the same
+        ePub contents as the handlers'''
+        for xml_file in support.articleFiles():
+            expected = support.convertFile(xml_file, 'handlers')
+            actual = support.convertFile(xml_file, 'stream')
+            self.assertEqual(sorted(actual), sorted(expected))
+            for name in expected:
+                if name == 'OPS/content.opf':
+                    #The tables are only complete, and written, after the
+                    #streamed body, so they follow it in the manifest
+                    self.assertEqual(sorted(actual[name].splitlines()),
+                                     sorted(expected[name].splitlines()))
+                else:
+                    self.assertEqual(actual[name], expected[name], name)
+
+
+if __name__ == '__main__':
+    unittest.main()
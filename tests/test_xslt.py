@@ -0,0 +1,37 @@
+'''Parity of the 'xslt' engine with the handlers of content.py: its
+stylesheet must make the same ePub contents, which compares its output with
+that of the handlers for every test article.'''
+
+import unittest
+
+import support
+
+import xslt
+
+#Names of image files, sans extension, found among the test articles; the
+#figures, tables and formulas of those not listed have no image
+images = ['g001', 'g002', 'g009', 'e001', 'e002', 'e003', 't001']
+
+
+@unittest.skipUnless(xslt.available, 'the xslt engine requires lxml')
+class XSLTTest(unittest.TestCase):
+    def assertParity(self, images):
+        for xml_file in support.articleFiles():
+            expected = support.convertFile(xml_file, 'handlers', images)
+            actual = support.convertFile(xml_file, 'xslt', images)
+            self.assertEqual(sorted(actual), sorted(expected))
+            for name in expected:
+                self.assertEqual(actual[name], expected[name],
+                                 '{0} of {1}'.format(name, xml_file))
+
+    def testParity(self):
+        '''The ePubs of the xslt engine are those of the handlers'''
+        self.assertParity(())
+
+    def testImages(self):
+        '''Images in the ePub are found by the stylesheet as by findImage'''
+        self.assertParity(images)
+
+
+if __name__ == '__main__':
+    unittest.main()
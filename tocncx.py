@@ -1,6 +1,6 @@
 import utils
-import os.path
-from xml.dom.minidom import getDOMImplementation
+import tagindex
+import xmlbackend
 import main
     
 class TocNCX(object):
@@ -14,9 +14,7 @@ class TocNCX(object):
         _publicId = '-//NISO//DTD ncx 2005-1//EN'
         _systemId = 'http://www.daisy.org/z3986/2005/ncx-2005-1.dtd'
         
-        impl = getDOMImplementation()
-        mytype = impl.createDocumentType('ncx', _publicId, _systemId)
-        self.toc = impl.createDocument(None, 'ncx', mytype)
+        self.toc = xmlbackend.createDocument('ncx', _publicId, _systemId)
         
         self.ncx = self.toc.lastChild #IGNORE:E1101
         self.ncx.setAttribute('version', '2005-1')
@@ -51,6 +49,8 @@ those conforming to the relaxed constraints of OPS 2.0'''))
         #Some important integers
         self.playOrder = 1
         self.maxdepth = 0
+        #The ids given to the sec tags lacking one, see structureParse
+        self.sec_ids = {}
         #List of articles included
         self.articles = []
     
@@ -174,13 +174,16 @@ those conforming to the relaxed constraints of OPS 2.0'''))
             navcon.setAttribute('src','synop.{0}.xml#title'.format(self.jid))
         #Tag name strings we check for to determine structures and features
         tagnamestrs = [u'sec', u'fig', u'table-wrap']
-        #Pre-process step: give sec tags an id attribute if they lack it
-        c = 0
-        for sec in srcnode.getElementsByTagName('sec'):
-            if not sec.getAttribute('id'):
-                id = 'OA-EPUB-{0}'.format(str(c))
-                c += 1
-                sec.setAttribute('id', id)
+        #Pre-process step: number the sec tags lacking an id attribute, as
+        #the conversion of the body does. This covers every nested sec, so
+        #the recursive calls may skip it. The article is left as it is, as
+        #it is converted afterwards.
+        if first:
+            self.sec_ids = {}
+            for sec in tagindex.getElementsByTagName(srcnode, 'sec'):
+                if not sec.getAttribute('id'):
+                    id = 'OA-EPUB-{0}'.format(str(len(self.sec_ids)))
+                    self.sec_ids[sec] = id
         
         #Do the recursive parsing
         for child in srcnode.childNodes:
@@ -199,7 +202,8 @@ those conforming to the relaxed constraints of OPS 2.0'''))
                     elif tagname == u'table-wrap':
                         nav = self.toc.createElement('navTarget')
                         self.lot.appendChild(nav)
-                    id = child.getAttribute('id')
+                    id = child.getAttribute('id') or \
+                         self.sec_ids.get(child, u'')
                     nav.setAttribute('id', id)
                     nav.setAttribute('playOrder', str(self.playOrder))
                     self.playOrder += 1
@@ -255,9 +259,7 @@ those conforming to the relaxed constraints of OPS 2.0'''))
         self.setMetas()
         self.makeDocAuthor()
         self.makeDocTitle()
-        filename = os.path.join(location, 'OPS', 'toc.ncx')
-        with open(filename, 'w') as output:
-            output.write(self.toc.toprettyxml(encoding = 'utf-8'))
+        location.writeDocument('OPS/toc.ncx', self.toc)
     
     def makeText(self, textstring):
         text = self.toc.createElement('text')
@@ -1,6 +1,5 @@
 '''utility/common stuff'''
 import os.path
-import zipfile
 from collections import namedtuple
 
 Identifier = namedtuple('Identifer', 'id, type')
@@ -132,6 +131,23 @@ def getFormattedNode(node):
                 item.setAttribute('style', spans[item])
     return clone
 
+def getElementsByTagNames(topnode, tagnames):
+    '''Collects the descendant elements of topnode for several tagNames with a
+    single traversal, where getElementsByTagName() would need one traversal
+    for each. Returns a dictionary mapping each tagName to a list of its
+    elements in document order.'''
+    found = {}
+    for tagname in tagnames:
+        found[tagname] = []
+    stack = list(reversed(topnode.childNodes))
+    while stack:
+        node = stack.pop()
+        if node.nodeType == node.ELEMENT_NODE:
+            if node.tagName in found:
+                found[node.tagName].append(node)
+            stack.extend(reversed(node.childNodes))
+    return found
+
 def getTagData(node_list):
     '''Grab the (string) data from text elements
     node_list -- NodeList returned by getElementsByTagName
@@ -145,10 +161,12 @@ def getTagData(node_list):
     except TypeError:
         getTagData([node_list])
         
-def epubZip(outdirect):
-    '''Zips up the input file directory into an ePub file.'''
+def epubZip(outdirect, level = 6):
+    '''Zips up the input file directory into an ePub file. The entries are
+    compressed by media type at the given zlib level, see epubwriter.Archive'''
+    import epubwriter
     epub_filename = outdirect + '.epub'
-    epub = zipfile.ZipFile(epub_filename, 'w')
+    epub = epubwriter.Archive(epub_filename, level)
     current_dir = os.getcwd()
     os.chdir(outdirect)
     epub.write('mimetype')
@@ -184,12 +202,9 @@ def initiateDocument(titlestring,
                      _publicId = '-//W3C//DTD XHTML 1.1//EN',
                      _systemId = 'http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd'):
     '''A method for conveniently initiating a new xml.DOM Document'''
-    from xml.dom.minidom import getDOMImplementation
-    
-    impl = getDOMImplementation()
+    import xmlbackend
     
-    mytype = impl.createDocumentType('article', _publicId, _systemId)
-    doc = impl.createDocument(None, 'root', mytype)
+    doc = xmlbackend.createDocument('root', _publicId, _systemId, 'article')
     
     root = doc.lastChild #IGNORE:E1101
     root.setAttribute('xmlns', 'http://www.w3.org/1999/xhtml')
@@ -225,13 +240,12 @@ def scrapePLoSIssueCollection(issue_url):
     '''Uses Beautiful Soup to scrape the PLoS page of an issue. It is used
     instead of xml.dom.minidom because of malformed html/xml'''
     from BeautifulSoup import BeautifulStoneSoup
-    import urllib2
+    import downloader
     import os
     import os.path
     
-    iu = urllib2.urlopen(issue_url)
-    with open('temp','w') as temp:
-        temp.write(iu.read())
+    with open('temp','wb') as temp:
+        downloader.fetcher.open(issue_url, output = temp)
     with open('temp', 'r') as temp:
         soup = BeautifulStoneSoup(temp)
     os.remove('temp')
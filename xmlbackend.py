@@ -0,0 +1,250 @@
+'''The XML backend used to parse article files, to create new Documents and to
+serialize them. All of the conversion code works upon W3C DOM (minidom)
+Documents, which are parsed, created and written only through this module.
+
+Article files are parsed by minidom's own parser unless the 'lxml' parser is
+selected with use(), when lxml is installed (see available). It parses with
+libxml2, then builds the same minidom Document from the tree, which the
+conversion works upon either way. Every node is still made in Python, and on
+the articles measured this costs more than libxml2 saves, so minidom is the
+default.'''
+
+import codecs
+from xml.sax.saxutils import escape
+import xml.dom.minidom as minidom
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+#The parsers which may be selected with use(), by name
+parsers = ['minidom']
+if etree is not None:
+    parsers.append('lxml')
+available = 'lxml' in parsers
+#The selected parser
+parser = 'minidom'
+
+#The namespaces of xml:lang and of namespace declarations, bound to their
+#prefixes implicitly
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+XMLNS_NAMESPACE = 'http://www.w3.org/2000/xmlns/'
+
+
+def use(name):
+    '''Selects the parser, by name, for the rest of the run'''
+    global parser
+    if name not in parsers:
+        raise ValueError('Unknown or unavailable XML parser: {0}'.format(name))
+    parser = name
+
+
+def parse(xml_file):
+    '''Parses xml_file, a filename or file object, into a minidom Document'''
+    if parser == 'lxml':
+        return lxmlParse(xml_file)
+    return minidom.parse(xml_file)
+
+
+def lxmlParse(xml_file):
+    '''Parses xml_file with lxml and returns the minidom Document which
+    minidom would have parsed from it'''
+    tree = etree.parse(xml_file)
+    docinfo = tree.docinfo
+    impl = minidom.getDOMImplementation()
+    document = impl.createDocument(None, None, None)
+    if docinfo.doctype:
+        doctype = impl.createDocumentType(docinfo.root_name,
+                                          docinfo.public_id,
+                                          docinfo.system_url)
+        document.appendChild(doctype)
+        doctype.ownerDocument = document
+        document.doctype = doctype
+    root = tree.getroot()
+    for sibling in reversed(list(root.itersiblings(preceding = True))):
+        buildTree(sibling, document)
+    buildTree(root, document)
+    for sibling in root.itersiblings():
+        buildTree(sibling, document)
+    return document
+
+
+def qualifiedName(name, prefix):
+    '''Returns the namespace URI and prefix:local name of the lxml
+    {uri}local name, whose namespace is bound to prefix'''
+    if name[0] != '{':
+        return None, unicode(name)
+    uri, local = name[1:].split('}', 1)
+    if uri == XML_NAMESPACE:
+        prefix = 'xml'
+    if prefix:
+        return unicode(uri), u'{0}:{1}'.format(prefix, local)
+    return unicode(uri), unicode(local)
+
+
+def buildTree(root, parent):
+    '''Appends a minidom copy of the lxml node root, with all beneath it, to
+    parent, a Document or Element'''
+    document = parent.ownerDocument or parent
+    #Iterative, as article trees may be deeper than the recursion limit.
+    #lxml gives ASCII text as str, minidom always gives unicode. Each entry
+    #holds the lxml node, or the tail text of one, the parent of its copy and
+    #the namespaces in scope there.
+    stack = [(root, parent, {})]
+    while stack:
+        elem, parent, nsmap = stack.pop()
+        if isinstance(elem, basestring):
+            parent.appendChild(document.createTextNode(unicode(elem)))
+            continue
+        if elem.tag is etree.Comment:
+            parent.appendChild(document.createComment(unicode(elem.text or
+                                                              '')))
+            continue
+        if elem.tag is etree.ProcessingInstruction:
+            parent.appendChild(document.createProcessingInstruction(
+                unicode(elem.target), unicode(elem.text or '')))
+            continue
+        uri, name = qualifiedName(elem.tag, elem.prefix)
+        node = document.createElementNS(uri, name)
+        #The namespaces declared upon this element
+        scope = elem.nsmap
+        if scope != nsmap:
+            for prefix, namespace in scope.items():
+                if nsmap.get(prefix) != namespace:
+                    declaration = u'xmlns:' + prefix if prefix else u'xmlns'
+                    node.setAttributeNS(XMLNS_NAMESPACE, declaration,
+                                        unicode(namespace))
+        for key, value in elem.items():
+            prefix = None
+            if key[0] == '{':
+                namespace = key[1:].split('}')[0]
+                prefix = next((prefix for prefix, uri in scope.items()
+                               if uri == namespace and prefix), None)
+            uri, name = qualifiedName(key, prefix)
+            node.setAttributeNS(uri, name, unicode(value))
+        parent.appendChild(node)
+        if elem.text:
+            node.appendChild(document.createTextNode(unicode(elem.text)))
+        #Pushed in reverse so that children are built in document order
+        for child in reversed(elem):
+            if child.tail:
+                stack.append((child.tail, node, scope))
+            stack.append((child, node, scope))
+
+
+def createDocument(qualifiedName, publicId = None, systemId = None,
+                   doctypeName = None):
+    '''Creates a new Document with a document element named qualifiedName. A
+    DOCTYPE is included if publicId and systemId are provided; its name is
+    qualifiedName unless doctypeName is given.'''
+    impl = minidom.getDOMImplementation()
+    if publicId and systemId:
+        doctype = impl.createDocumentType(doctypeName or qualifiedName,
+                                          publicId, systemId)
+    else:
+        doctype = None
+    return impl.createDocument(None, qualifiedName, doctype)
+
+
+def write(document, filename):
+    '''Writes document, indented and encoded as UTF-8, to filename, which may
+    also be a file object. The output is the same as
+    document.toprettyxml(encoding = 'utf-8'), but is streamed to the file
+    rather than first being assembled as one string in memory.'''
+    if not isinstance(filename, basestring):
+        writer = codecs.getwriter('utf-8')(filename)
+        document.writexml(writer, '', '\t', '\n', 'utf-8')
+        return
+    with open(filename, 'wb') as output:
+        write(document, output)
+
+
+class StreamWriter(object):
+    '''Writes a Document to a file one piece at a time, producing the same
+    output as write(). Elements are opened with start() and closed with end();
+    complete nodes are written as children of the innermost open Element with
+    append(). Only one child of each open Element is held back, as the
+    indentation of an Element depends upon whether it has exactly one child
+    and whether that child is text.'''
+    def __init__(self, output):
+        self.writer = codecs.getwriter('utf-8')(output)
+        #The open Elements: [element, indent, child count, held child]
+        self.open = []
+
+    def startDocument(self, document):
+        '''Writes the XML declaration and the nodes of document which precede
+        its document element, such as the DOCTYPE'''
+        self.writer.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        for node in document.childNodes:
+            if node is document.documentElement:
+                break
+            node.writexml(self.writer, '', '\t', '\n')
+
+    def writeStartTag(self, element, indent, empty):
+        '''Writes the start tag of element, which only uses its tagName and
+        attributes, as minidom would'''
+        self.writer.write(indent + '<' + element.tagName)
+        for name in sorted(element.attributes.keys()):
+            value = element.getAttribute(name)
+            self.writer.write(u' {0}="{1}"'.format(name, escape(value,
+                                                            {'"': '&quot;'})))
+        if empty:
+            self.writer.write('/>\n')
+        else:
+            self.writer.write('>')
+
+    def release(self, frame):
+        '''Writes the start tag and the held child of an open Element once it
+        is known to have more than one child'''
+        element, indent, count, held = frame
+        if count == 1 and held is not None:
+            self.writeStartTag(element, indent, False)
+            self.writer.write('\n')
+            held.writexml(self.writer, indent + '\t', '\t', '\n')
+            frame[3] = None
+
+    def start(self, element):
+        '''Opens element as a child of the innermost open Element. The
+        children of element are ignored, they must be added with append().'''
+        if self.open:
+            parent = self.open[-1]
+            if parent[2] == 0:
+                self.writeStartTag(parent[0], parent[1], False)
+                self.writer.write('\n')
+            else:
+                self.release(parent)
+            parent[2] += 1
+            indent = parent[1] + '\t'
+        else:
+            indent = ''
+        self.open.append([element, indent, 0, None])
+
+    def append(self, node):
+        '''Writes node as a child of the innermost open Element'''
+        if not self.open:
+            node.writexml(self.writer, '', '\t', '\n')
+            return
+        frame = self.open[-1]
+        if frame[2] == 0:
+            frame[3] = node
+        else:
+            self.release(frame)
+            node.writexml(self.writer, frame[1] + '\t', '\t', '\n')
+        frame[2] += 1
+
+    def end(self):
+        '''Closes the innermost open Element'''
+        element, indent, count, held = self.open.pop()
+        if count == 0:
+            self.writeStartTag(element, indent, True)
+        elif held is not None and held.nodeType == held.TEXT_NODE:
+            self.writeStartTag(element, indent, False)
+            held.writexml(self.writer, '', '', '')
+            self.writer.write(u'</{0}>\n'.format(element.tagName))
+        else:
+            if held is not None:
+                self.writeStartTag(element, indent, False)
+                self.writer.write('\n')
+                held.writexml(self.writer, indent + '\t', '\t', '\n')
+            self.writer.write(u'{0}</{1}>\n'.format(indent, element.tagName))
@@ -0,0 +1,1159 @@
+'''An XSLT conversion engine, as an alternative to the handlers of OPSContent.
+The stylesheet below performs the conversions of the handlers for the main
+body and its tables, the abstracts and the rest of the synopsis, and the
+bibliography: those of the node handlers, such as figNodeHandler and
+refListHandler, of the element handlers and of divTitleFormat. It is compiled
+once and run by libxslt, through lxml.
+
+The stylesheet is run upon copies of nodes of the article Document made in
+memory by toTree(), so the article is not parsed a second time, and its
+result is built into the output Documents by build(). OPSContent still makes
+the parts of the synopsis drawn from the metadata of the article.
+
+minidom keeps apart text nodes which the handlers place side by side, and each
+is written on a line of its own, while lxml joins adjacent text. Where such
+text nodes meet, toTree() and the stylesheet place a processing instruction,
+SPLIT, at which build() begins a new text node. An empty text node is given
+as the processing instruction EMPTY.
+
+This engine requires lxml; see available.'''
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+available = etree is not None
+
+#The namespace of xml:lang and its kin is bound to the xml prefix implicitly
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+#lxml keeps namespace declarations apart from attributes, the xmlns and
+#xmlns:prefix attributes of minidom are carried in this namespace instead
+DECLARATION_NAMESPACE = 'urn:x-oae:xmlns'
+#The namespace given to a prefix which is used but not declared
+UNDECLARED_NAMESPACE = 'urn:x-oae:prefix:'
+
+SPLIT = 'oae-split'
+EMPTY = 'oae-empty'
+
+STYLESHEET = '''\
+<xsl:stylesheet version="1.0"
+  xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
+  xmlns:xlink="http://www.w3.org/1999/xlink"
+  xmlns:oae="urn:x-oae:xmlns"
+  exclude-result-prefixes="xlink oae">
+
+  <!--The journal id of the article-->
+  <xsl:param name="jid"/>
+  <!--The image files of the ePub, as |name=path|name=path|, where name is
+      that of the file sans extension and path is relative to OPS-->
+  <xsl:param name="images"/>
+  <!--The web site of the journal-->
+  <xsl:param name="site"/>
+
+  <!--The input is one of:
+      main, holding the body of the article, then its ack and the fn of the
+      author contributions, if any. The result is the content of the main
+      body followed by that of the tables document.
+      synopsis, holding the content of the synopsis body.
+      abstract, holding the content of an abstract of the synopsis.
+      biblio, holding the ref-list of the article.-->
+  <xsl:template match="/main">
+    <result>
+      <main>
+        <xsl:apply-templates select="body/node()"/>
+        <xsl:apply-templates select="ack" mode="acknowledgments"/>
+        <xsl:apply-templates select="fn" mode="contributions"/>
+      </main>
+      <tables>
+        <xsl:apply-templates select="body//table-wrap" mode="tables"/>
+      </tables>
+    </result>
+  </xsl:template>
+
+  <xsl:template match="/synopsis|/abstract|/biblio">
+    <result>
+      <xsl:copy>
+        <xsl:apply-templates select="node()"/>
+      </xsl:copy>
+    </result>
+  </xsl:template>
+
+  <!--Everything else is copied unchanged-->
+  <xsl:template match="@*|node()" name="copy">
+    <xsl:copy>
+      <xsl:apply-templates select="@*|node()"/>
+    </xsl:copy>
+  </xsl:template>
+
+  <!--Marks where text nodes are to be kept apart-->
+  <xsl:template name="split">
+    <xsl:processing-instruction name="oae-split"/>
+  </xsl:template>
+
+  <!--The path of the image file name, or nothing, as OPSContent.findImage-->
+  <xsl:template name="image">
+    <xsl:param name="name"/>
+    <xsl:value-of
+      select="substring-before(substring-after($images,
+                               concat('|', $name, '=')), '|')"/>
+  </xsl:template>
+
+  <!--What follows the last separator in string-->
+  <xsl:template name="last-part">
+    <xsl:param name="string"/>
+    <xsl:param name="separator"/>
+    <xsl:choose>
+      <xsl:when test="contains($string, $separator)">
+        <xsl:call-template name="last-part">
+          <xsl:with-param name="string"
+                          select="substring-after($string, $separator)"/>
+          <xsl:with-param name="separator" select="$separator"/>
+        </xsl:call-template>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:value-of select="$string"/>
+      </xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <!--The path of the image file named by what follows the last separator in
+      string-->
+  <xsl:template name="image-of">
+    <xsl:param name="string"/>
+    <xsl:param name="separator"/>
+    <xsl:call-template name="image">
+      <xsl:with-param name="name">
+        <xsl:call-template name="last-part">
+          <xsl:with-param name="string" select="$string"/>
+          <xsl:with-param name="separator" select="$separator"/>
+        </xsl:call-template>
+      </xsl:with-param>
+    </xsl:call-template>
+  </xsl:template>
+
+  <!--string with its spaces written as %20-->
+  <xsl:template name="escape-spaces">
+    <xsl:param name="string"/>
+    <xsl:choose>
+      <xsl:when test="contains($string, ' ')">
+        <xsl:value-of select="substring-before($string, ' ')"/>
+        <xsl:text>%20</xsl:text>
+        <xsl:call-template name="escape-spaces">
+          <xsl:with-param name="string"
+                          select="substring-after($string, ' ')"/>
+        </xsl:call-template>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:value-of select="$string"/>
+      </xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <!--The attributes removed by the element handlers-->
+  <xsl:template match="sec/@sec-type"/>
+  <xsl:template match="xref/@ref-type|xref/@rid"/>
+  <xsl:template match="named-content/@content-type|named-content/@xlink:*|
+                       named-content/@oae:xlink"/>
+  <xsl:template match="disp-quote/@content-type|disp-quote/@id|
+                       disp-quote/@specific-use|disp-quote/@xml:lang"/>
+  <xsl:template match="ext-link/@ext-link-type|ext-link/@xlink:*|
+                       ext-link/@oae:xlink"/>
+  <xsl:template match="email/@xlink:*|email/@oae:xlink"/>
+  <xsl:template match="fn/@fn-type|fn/@symbol|fn/@xml:lang"/>
+  <xsl:template match="list/@id|list/@list-content|list/@list-type|
+                       list/@prefix-word"/>
+  <xsl:template match="graphic/@alt-version|graphic/@alternate-form-of|
+                       graphic/@id|graphic/@mime-subtype|graphic/@mimetype|
+                       graphic/@position|graphic/@xlink:actuate|
+                       graphic/@xlink:href|graphic/@xlink:role|
+                       graphic/@xlink:title|graphic/@xlink:type|
+                       graphic/@oae:xlink"/>
+  <xsl:template match="table-wrap//table/@alternate-form-of"/>
+  <xsl:template match="/main//boxed-text/@content-type|
+                       /main//boxed-text/@position|
+                       /main//boxed-text/@xml:lang"/>
+  <xsl:template match="/main//supplementary-material/@mimetype|
+                       /main//supplementary-material/@xlink:href|
+                       /main//supplementary-material/@position|
+                       /main//supplementary-material/@xlink:type"/>
+
+  <!--OPSContent.boldElementHandler-->
+  <xsl:template match="bold">
+    <b><xsl:apply-templates select="@*|node()"/></b>
+  </xsl:template>
+
+  <!--OPSContent.italicElementHandler-->
+  <xsl:template match="italic">
+    <i><xsl:apply-templates select="@*|node()"/></i>
+  </xsl:template>
+
+  <!--OPSContent.monospaceElementHandler-->
+  <xsl:template match="monospace">
+    <span>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="style">font-family:monospace</xsl:attribute>
+      <xsl:apply-templates select="node()"/>
+    </span>
+  </xsl:template>
+
+  <!--OPSContent.subElementHandler and supElementHandler-->
+  <xsl:template match="sub/@arrange[. != '']|sup/@arrange[. != '']">
+    <xsl:attribute name="class"><xsl:value-of select="."/></xsl:attribute>
+  </xsl:template>
+
+  <!--OPSContent.smallCapsElementHandler-->
+  <xsl:template match="sc">
+    <span>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="style">font-variant:small-caps</xsl:attribute>
+      <xsl:apply-templates select="node()"/>
+    </span>
+  </xsl:template>
+
+  <!--OPSContent.underlineElementHandler-->
+  <xsl:template match="underline">
+    <span>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="style">text-decoration:underline</xsl:attribute>
+      <xsl:apply-templates select="node()"/>
+    </span>
+  </xsl:template>
+
+  <!--OPSContent.namedContentElementHandler-->
+  <xsl:template match="named-content">
+    <span>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="style">
+        <xsl:value-of select="@content-type"/>
+      </xsl:attribute>
+      <xsl:apply-templates select="node()"/>
+    </span>
+  </xsl:template>
+
+  <!--OPSContent.xrefElementHandler-->
+  <xsl:template match="xref">
+    <a>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="href">
+        <xsl:choose>
+          <xsl:when test="@ref-type = 'bibr'">biblio</xsl:when>
+          <xsl:when test="@ref-type = 'aff'">synop</xsl:when>
+          <xsl:when test="@ref-type = 'table-fn'">tables</xsl:when>
+          <xsl:otherwise>main</xsl:otherwise>
+        </xsl:choose>
+        <xsl:value-of select="concat('.', $jid, '.xml#', @rid)"/>
+      </xsl:attribute>
+      <xsl:apply-templates select="node()"/>
+    </a>
+  </xsl:template>
+
+  <!--OPSContent.secElementHandler, sections without an id are numbered in
+      document order, those of the tables apart from the others. A section
+      is counted by those of its key which come first in a union with it.-->
+  <xsl:key name="anonymous-secs" match="sec[not(string(@id))]"
+           use="count(ancestor::table-wrap)"/>
+
+  <xsl:template match="sec">
+    <div>
+      <xsl:apply-templates select="@*"/>
+      <xsl:if test="not(string(@id))">
+        <xsl:variable name="this" select="."/>
+        <xsl:attribute name="id">
+          <xsl:value-of
+            select="concat('OA-EPUB-', count(key('anonymous-secs',
+                    count(ancestor::table-wrap))
+                    [generate-id((. | $this)[1]) = generate-id(.)]) - 1)"/>
+        </xsl:attribute>
+      </xsl:if>
+      <xsl:apply-templates select="node()"/>
+    </div>
+  </xsl:template>
+
+  <!--OPSContent.dispQuoteElementHandler-->
+  <xsl:template match="disp-quote">
+    <span>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="class">disp-quote</xsl:attribute>
+      <xsl:apply-templates select="node()" mode="quote"/>
+    </span>
+  </xsl:template>
+
+  <xsl:template match="p" mode="quote">
+    <xsl:if test="preceding-sibling::p"><br/></xsl:if>
+    <xsl:call-template name="split"/>
+    <xsl:apply-templates select="node()"/>
+    <xsl:call-template name="split"/>
+  </xsl:template>
+
+  <xsl:template match="node()" mode="quote">
+    <xsl:apply-templates select="."/>
+  </xsl:template>
+
+  <!--OPSContent.extLinkElementHandler-->
+  <xsl:template match="ext-link">
+    <a>
+      <xsl:apply-templates select="@*"/>
+      <xsl:if test="string(@xlink:href)">
+        <xsl:attribute name="href">
+          <xsl:value-of select="@xlink:href"/>
+        </xsl:attribute>
+      </xsl:if>
+      <xsl:apply-templates select="node()"/>
+    </a>
+  </xsl:template>
+
+  <!--OPSContent.emailElementHandler-->
+  <xsl:template match="email">
+    <a>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="href">
+        <xsl:value-of
+          select="concat('mailto:', text()[. != '&#10;'][last()])"/>
+      </xsl:attribute>
+      <xsl:apply-templates select="node()"/>
+    </a>
+  </xsl:template>
+
+  <!--OPSContent.fnElementHandler-->
+  <xsl:template match="fn">
+    <span>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="class">footnote</xsl:attribute>
+      <xsl:apply-templates select="node()" mode="unwrap"/>
+    </span>
+  </xsl:template>
+
+  <xsl:template match="p" mode="unwrap">
+    <xsl:call-template name="split"/>
+    <xsl:apply-templates select="node()"/>
+    <xsl:call-template name="split"/>
+  </xsl:template>
+
+  <xsl:template match="node()" mode="unwrap">
+    <xsl:apply-templates select="."/>
+  </xsl:template>
+
+  <!--OPSContent.listElementHandler, a list is moved out of its paragraph,
+      which is continued after the list by a new one-->
+  <xsl:template match="p[list]">
+    <p>
+      <xsl:apply-templates
+        select="@*|node()[not(self::list or preceding-sibling::list)]"/>
+    </p>
+    <xsl:for-each select="list">
+      <xsl:variable name="lists" select="position()"/>
+      <xsl:apply-templates select="."/>
+      <p>
+        <xsl:apply-templates
+          select="../node()[not(self::list)]
+                  [count(preceding-sibling::list) = $lists]"/>
+      </p>
+    </xsl:for-each>
+  </xsl:template>
+
+  <xsl:template match="list">
+    <xsl:variable name="type" select="string(@list-type)"/>
+    <xsl:variable name="ordered"
+      select="$type = 'order' or $type = 'alpha-lower' or
+              $type = 'alpha-upper' or $type = 'roman-lower' or
+              $type = 'roman-upper'"/>
+    <xsl:choose>
+      <xsl:when test="$ordered">
+        <ol>
+          <xsl:apply-templates select="@*"/>
+          <xsl:call-template name="list-title"/>
+          <xsl:apply-templates select="node()"/>
+        </ol>
+      </xsl:when>
+      <xsl:otherwise>
+        <ul>
+          <xsl:apply-templates select="@*"/>
+          <xsl:call-template name="list-title"/>
+          <xsl:if test="not($type = 'bullet' or $type = 'simple' or
+                            $type = '')">
+            <xsl:attribute name="style">simple</xsl:attribute>
+          </xsl:if>
+          <xsl:apply-templates select="node()"/>
+        </ul>
+      </xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <!--The title of a list is made its title attribute-->
+  <xsl:template name="list-title">
+    <xsl:if test="title">
+      <xsl:attribute name="title">
+        <xsl:for-each select="title[1]//text()[. != '&#10;']">
+          <xsl:value-of select="."/>
+        </xsl:for-each>
+      </xsl:attribute>
+    </xsl:if>
+  </xsl:template>
+
+  <xsl:template match="list/title[1]" priority="4"/>
+
+  <xsl:template match="list/list-item">
+    <li><xsl:apply-templates select="@*|node()"/></li>
+  </xsl:template>
+
+  <!--OPSContent.graphicElementHandler, a graphic without an image file is
+      left a graphic-->
+  <xsl:template match="graphic">
+    <xsl:variable name="src">
+      <xsl:call-template name="image-of">
+        <xsl:with-param name="string" select="@xlink:href"/>
+        <xsl:with-param name="separator" select="'.'"/>
+      </xsl:call-template>
+    </xsl:variable>
+    <xsl:choose>
+      <xsl:when test="string($src)">
+        <img>
+          <xsl:apply-templates select="@*"/>
+          <xsl:attribute name="src">
+            <xsl:value-of select="$src"/>
+          </xsl:attribute>
+          <xsl:apply-templates select="node()"/>
+        </img>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:call-template name="copy"/>
+      </xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <!--OPSContent.inlineFormulaElementHandler-->
+  <xsl:template match="inline-formula">
+    <xsl:variable name="src">
+      <xsl:if test=".//inline-graphic">
+        <xsl:call-template name="image-of">
+          <xsl:with-param name="string"
+                          select="(.//inline-graphic)[1]/@xlink:href"/>
+          <xsl:with-param name="separator" select="'.'"/>
+        </xsl:call-template>
+      </xsl:if>
+    </xsl:variable>
+    <xsl:if test="string($src)">
+      <img src="{$src}" alt="An inline formula"/>
+    </xsl:if>
+    <xsl:call-template name="split"/>
+  </xsl:template>
+
+  <!--OPSContent.dispFormulaElementHandler, a formula without a graphic is
+      left as it is-->
+  <xsl:template match="disp-formula[string((.//graphic)[1]/@xlink:href)]">
+    <img alt="A display formula" class="disp-formula">
+      <xsl:attribute name="src">
+        <xsl:call-template name="image-of">
+          <xsl:with-param name="string"
+                          select="(.//graphic)[1]/@xlink:href"/>
+          <xsl:with-param name="separator" select="'.'"/>
+        </xsl:call-template>
+      </xsl:attribute>
+    </img>
+    <xsl:for-each select=".//label">
+      <xsl:sort select="position()" data-type="number" order="descending"/>
+      <b>
+        <xsl:apply-templates select="@*"/>
+        <xsl:attribute name="class">disp-formula-label</xsl:attribute>
+        <xsl:apply-templates select="node()"/>
+      </b>
+    </xsl:for-each>
+  </xsl:template>
+
+  <!--OPSContent.figNodeHandler, the caption follows the image, which is
+      placed in a div when directly in the body-->
+  <xsl:template match="/main//fig">
+    <xsl:choose>
+      <xsl:when test="parent::body">
+        <div><xsl:call-template name="figure-image"/></div>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:call-template name="figure-image"/>
+      </xsl:otherwise>
+    </xsl:choose>
+    <xsl:apply-templates select="(.//caption)[1]" mode="figure"/>
+  </xsl:template>
+
+  <xsl:template name="figure-image">
+    <xsl:variable name="src">
+      <xsl:call-template name="image-of">
+        <xsl:with-param name="string" select="@id"/>
+        <xsl:with-param name="separator" select="'-'"/>
+      </xsl:call-template>
+    </xsl:variable>
+    <img id="{@id}">
+      <xsl:call-template name="image-attributes">
+        <xsl:with-param name="src" select="$src"/>
+      </xsl:call-template>
+    </img>
+  </xsl:template>
+
+  <!--The src, alt and title of the image of a fig or table-wrap-->
+  <xsl:template name="image-attributes">
+    <xsl:param name="src"/>
+    <xsl:attribute name="src">
+      <xsl:choose>
+        <xsl:when test="string($src)">
+          <xsl:value-of select="$src"/>
+        </xsl:when>
+        <xsl:otherwise>not_found</xsl:otherwise>
+      </xsl:choose>
+    </xsl:attribute>
+    <xsl:attribute name="alt">
+      <xsl:choose>
+        <xsl:when test=".//alt-text">
+          <xsl:value-of
+            select="(.//alt-text[node()[1][self::text()]])[last()]/node()[1]"/>
+        </xsl:when>
+        <xsl:otherwise>A figure</xsl:otherwise>
+      </xsl:choose>
+    </xsl:attribute>
+    <xsl:variable name="long-desc"
+      select="string((.//long-desc[node()[1][self::text()]])[last()]
+                     /node()[1])"/>
+    <xsl:if test="$long-desc">
+      <xsl:attribute name="title">
+        <xsl:value-of select="$long-desc"/>
+      </xsl:attribute>
+    </xsl:if>
+  </xsl:template>
+
+  <xsl:template match="caption" mode="figure">
+    <div>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="class">caption</xsl:attribute>
+      <xsl:variable name="labels" select="ancestor::fig[1]//label"/>
+      <xsl:if test="$labels">
+        <b>
+          <xsl:value-of
+            select="concat($labels[node()[1][self::text()]][last()]
+                           /node()[1], '.')"/>
+        </b>
+      </xsl:if>
+      <xsl:apply-templates select="node()"/>
+    </div>
+  </xsl:template>
+
+  <xsl:template match="/main//fig//caption//title" priority="3">
+    <b><xsl:apply-templates select="@*|node()"/></b>
+  </xsl:template>
+
+  <!--OPSContent.tableWrapNodeHandler, in the main body a header and the
+      image of the table, with a link to the tables document-->
+  <xsl:template match="/main//table-wrap">
+    <div class="table_header" id="{@id}">
+      <xsl:if test=".//label">
+        <b>
+          <xsl:apply-templates select="(.//label)[1]/node()"/>
+          <xsl:call-template name="split"/>
+          <xsl:text>. </xsl:text>
+        </b>
+      </xsl:if>
+      <xsl:apply-templates select="((.//caption)[1]//title)[1]/node()"/>
+    </div>
+    <xsl:variable name="src">
+      <xsl:call-template name="image-of">
+        <xsl:with-param name="string" select="@id"/>
+        <xsl:with-param name="separator" select="'-'"/>
+      </xsl:call-template>
+    </xsl:variable>
+    <img>
+      <xsl:call-template name="image-attributes">
+        <xsl:with-param name="src" select="$src"/>
+      </xsl:call-template>
+    </img>
+    <xsl:if test=".//table">
+      <a href="tables.{$jid}.xml#{@id}">HTML version of this table</a>
+    </xsl:if>
+  </xsl:template>
+
+  <!--In the tables document, the tables of the table-wrap, then its
+      footnotes and a link back to the main body-->
+  <xsl:template match="table-wrap" mode="tables">
+    <xsl:apply-templates select=".//table" mode="tables"/>
+    <xsl:for-each select=".//table-wrap-foot">
+      <div class="footnotes">
+        <xsl:apply-templates select="node()"/>
+      </div>
+    </xsl:for-each>
+    <p>
+      <a href="main.{$jid}.xml#{@id}">Back to the text</a>
+    </p>
+  </xsl:template>
+
+  <xsl:template match="table" mode="tables">
+    <table>
+      <xsl:apply-templates select="@*"/>
+      <xsl:if test="position() = 1">
+        <xsl:attribute name="id">
+          <xsl:value-of select="ancestor::table-wrap[1]/@id"/>
+        </xsl:attribute>
+      </xsl:if>
+      <xsl:apply-templates select="node()"/>
+    </table>
+  </xsl:template>
+
+  <xsl:template match="table-wrap-foot[.//fn]//fn" priority="3">
+    <div><xsl:apply-templates select="@*|node()"/></div>
+  </xsl:template>
+
+  <xsl:template match="table-wrap-foot[.//fn]//label" priority="3">
+    <xsl:choose>
+      <xsl:when test="text()[. != '&#10;']">
+        <b><xsl:apply-templates select="@*|node()"/></b>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:call-template name="split"/>
+      </xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <xsl:template match="table-wrap-foot[.//fn]//title" priority="3">
+    <b><xsl:apply-templates select="@*|node()"/></b>
+  </xsl:template>
+
+  <xsl:template match="table-wrap-foot[.//fn]//copyright-statement|
+                       table-wrap-foot[.//fn]//attrib" priority="3">
+    <p><xsl:apply-templates select="@*|node()"/></p>
+  </xsl:template>
+
+  <!--OPSContent.refListHandler, each ref is made a paragraph by parseRef,
+      these follow the rest of the ref-list. That of the bibliography is
+      given the id references.-->
+  <xsl:template match="/main//ref-list|/biblio//ref-list">
+    <div>
+      <xsl:apply-templates select="@*"/>
+      <xsl:if test="parent::biblio">
+        <xsl:attribute name="id">references</xsl:attribute>
+      </xsl:if>
+      <xsl:attribute name="class">ref-list</xsl:attribute>
+      <xsl:apply-templates select="node()" mode="references"/>
+      <xsl:apply-templates select="ref" mode="reference"/>
+    </div>
+  </xsl:template>
+
+  <xsl:template match="ref" mode="references">
+    <xsl:call-template name="split"/>
+  </xsl:template>
+
+  <xsl:template match="node()" mode="references">
+    <xsl:apply-templates select="."/>
+  </xsl:template>
+
+  <xsl:template match="/main//ref-list/title[1]|/biblio//ref-list/title[1]"
+                priority="2.5">
+    <h2><xsl:apply-templates select="@*|node()"/></h2>
+  </xsl:template>
+
+  <!--OPSContent.parseRef-->
+  <xsl:template match="ref" mode="reference">
+    <p id="{@id}">
+      <xsl:choose>
+        <xsl:when test=".//citation">
+          <xsl:apply-templates select="(.//citation)[1]" mode="citation"/>
+        </xsl:when>
+        <xsl:otherwise>
+          <xsl:apply-templates select="(.//nlm-citation)[1]" mode="citation"/>
+        </xsl:otherwise>
+      </xsl:choose>
+    </p>
+  </xsl:template>
+
+  <!--Label. Authors (Year) Article Title. Source Volume(Issue):
+      Supplement Pages. Comment, and a link to the article-->
+  <xsl:template match="*[@citation-type = 'journal']" mode="citation">
+    <xsl:variable name="title" select="(.//article-title)[1]"/>
+    <xsl:variable name="year"
+      select="string((.//year)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="source"
+      select="string((.//source)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="issue"
+      select="string((.//issue)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="supplement"
+      select="string((.//supplement)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="fpage"
+      select="string((.//fpage)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="lpage"
+      select="string((.//lpage)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="comment"
+      select="string((.//comment)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="volume">
+      <xsl:value-of select="(.//volume)[1]/text()[. != '&#10;'][last()]"/>
+      <xsl:if test="$issue">
+        <xsl:value-of select="concat('(', $issue, ')')"/>
+      </xsl:if>
+    </xsl:variable>
+    <xsl:variable name="pages">
+      <xsl:value-of select="$fpage"/>
+      <xsl:if test="$fpage and $lpage">-</xsl:if>
+      <xsl:value-of select="$lpage"/>
+    </xsl:variable>
+    <xsl:call-template name="citation-label"/>
+    <xsl:call-template name="citation-authors"/>
+    <xsl:text> </xsl:text>
+    <xsl:if test="$year">
+      <xsl:value-of select="concat('(', $year, ')')"/>
+    </xsl:if>
+    <xsl:text> </xsl:text>
+    <xsl:call-template name="split"/>
+    <xsl:apply-templates select="$title/node()"/>
+    <xsl:call-template name="split"/>
+    <xsl:text> </xsl:text>
+    <xsl:if test="$source">
+      <xsl:value-of select="concat($source, ' ')"/>
+    </xsl:if>
+    <xsl:text> </xsl:text>
+    <xsl:if test="string($volume)">
+      <xsl:value-of select="concat($volume, ': ')"/>
+    </xsl:if>
+    <xsl:if test="$supplement">
+      <xsl:value-of select="concat($supplement, ' ')"/>
+    </xsl:if>
+    <xsl:if test="string($pages)">
+      <xsl:value-of select="concat($pages, '.')"/>
+    </xsl:if>
+    <xsl:value-of select="concat(' ', $comment)"/>
+    <xsl:choose>
+      <xsl:when test="$comment = 'doi:'">
+        <xsl:variable name="link" select="(.//ext-link)[1]"/>
+        <a href="{$link/@xlink:href}">
+          <xsl:value-of select="$link/text()[. != '&#10;'][last()]"/>
+        </a>
+      </xsl:when>
+      <xsl:when test="$title">
+        <a>
+          <xsl:attribute name="href">
+            <xsl:value-of
+              select="concat($site, 'article/findArticle.action?author=')"/>
+            <xsl:choose>
+              <xsl:when test=".//name">
+                <xsl:value-of
+                  select="((.//name)[1]//surname)[1]
+                          /text()[. != '&#10;'][last()]"/>
+              </xsl:when>
+              <xsl:otherwise>None</xsl:otherwise>
+            </xsl:choose>
+            <xsl:text>&amp;title=</xsl:text>
+            <xsl:call-template name="escape-spaces">
+              <xsl:with-param name="string">
+                <xsl:for-each select="$title//text()[. != '&#10;']">
+                  <xsl:value-of select="."/>
+                </xsl:for-each>
+              </xsl:with-param>
+            </xsl:call-template>
+          </xsl:attribute>
+          <xsl:text>Find This Article Online</xsl:text>
+        </a>
+      </xsl:when>
+    </xsl:choose>
+  </xsl:template>
+
+  <!--Label. Editors Article Title. Conference Name; Conference Date;
+      Conference Location. (Year) Comment-->
+  <xsl:template match="*[@citation-type = 'confproc']" mode="citation">
+    <xsl:variable name="name"
+      select="string((.//conf-name)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="date"
+      select="string((.//conf-date)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="location"
+      select="string((.//conf-loc)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:variable name="year"
+      select="string((.//year)[1]/text()[. != '&#10;'][last()])"/>
+    <xsl:call-template name="citation-label"/>
+    <xsl:call-template name="citation-authors"/>
+    <xsl:text> </xsl:text>
+    <xsl:call-template name="split"/>
+    <xsl:apply-templates select="(.//article-title)[1]/node()"/>
+    <xsl:call-template name="split"/>
+    <xsl:text> </xsl:text>
+    <xsl:if test="$name">
+      <xsl:value-of select="concat($name, '; ')"/>
+    </xsl:if>
+    <xsl:text> </xsl:text>
+    <xsl:if test="$date">
+      <xsl:value-of select="concat($date, '; ')"/>
+    </xsl:if>
+    <xsl:if test="$location">
+      <xsl:value-of select="concat($location, '; ')"/>
+    </xsl:if>
+    <xsl:if test="$year">
+      <xsl:value-of select="concat('(', $year, ') ')"/>
+    </xsl:if>
+    <xsl:call-template name="split"/>
+    <xsl:choose>
+      <xsl:when test=".//comment">
+        <xsl:apply-templates select="(.//comment)[1]/node()"/>
+      </xsl:when>
+      <xsl:otherwise>.</xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <!--Label. Each piece of text, the year in parentheses, the source in
+      brackets and the article title quoted, separated by commas-->
+  <xsl:template match="*[@citation-type = 'other']" mode="citation">
+    <xsl:variable name="text">
+      <xsl:call-template name="citation-label"/>
+      <xsl:for-each select=".//text()[normalize-space()]">
+        <xsl:choose>
+          <xsl:when test="parent::year">
+            <xsl:value-of select="concat('(', ., ')')"/>
+          </xsl:when>
+          <xsl:when test="parent::source">
+            <xsl:value-of select="concat('[', ., ']')"/>
+          </xsl:when>
+          <xsl:when test="parent::article-title">
+            <xsl:value-of select="concat('&quot;', ., '&quot;')"/>
+          </xsl:when>
+          <xsl:otherwise>
+            <xsl:value-of select="."/>
+          </xsl:otherwise>
+        </xsl:choose>
+        <xsl:text>, </xsl:text>
+      </xsl:for-each>
+    </xsl:variable>
+    <xsl:value-of select="substring($text, 1, string-length($text) - 2)"/>
+  </xsl:template>
+
+  <!--Other types of citation are left empty-->
+  <xsl:template match="*" mode="citation"/>
+
+  <xsl:template name="citation-label">
+    <xsl:value-of
+      select="concat((ancestor::ref[1]//label)[1]
+                     /text()[. != '&#10;'][last()], '. ')"/>
+  </xsl:template>
+
+  <xsl:template name="citation-authors">
+    <xsl:for-each select=".//name">
+      <xsl:if test="position() != 1">, </xsl:if>
+      <xsl:value-of select="(.//surname)[1]/text()[. != '&#10;'][last()]"/>
+      <xsl:if test=".//given-names">
+        <xsl:value-of
+          select="concat(' ', (.//given-names)[1]
+                              /text()[. != '&#10;'][last()])"/>
+      </xsl:if>
+    </xsl:for-each>
+    <xsl:if test=".//etal">, et al.</xsl:if>
+  </xsl:template>
+
+  <!--OPSContent.boxedTextNodeHandler-->
+  <xsl:template match="/main//boxed-text">
+    <blockquote><xsl:apply-templates select="@*|node()"/></blockquote>
+  </xsl:template>
+
+  <xsl:template match="/main//boxed-text//title" priority="2">
+    <b><xsl:apply-templates select="@*|node()"/></b>
+  </xsl:template>
+
+  <!--OPSContent.supplementaryMaterialNodeHandler, the label is linked to
+      the file at the site of the journal-->
+  <xsl:template match="/main//supplementary-material">
+    <div><xsl:apply-templates select="@*|node()"/></div>
+  </xsl:template>
+
+  <xsl:template match="/main//supplementary-material/object-id[1]"
+                priority="2">
+    <xsl:call-template name="split"/>
+  </xsl:template>
+
+  <xsl:template match="/main//supplementary-material/caption[1]"
+                priority="2">
+    <div><xsl:apply-templates select="@*|node()"/></div>
+  </xsl:template>
+
+  <xsl:template match="/main//supplementary-material/label[1]" priority="2">
+    <xsl:variable name="href" select="string(../@xlink:href)"/>
+    <xsl:variable name="journal"
+      select="substring-before(concat(substring-after($href, 'journal.'),
+                                      '.'), '.')"/>
+    <a>
+      <xsl:attribute name="href">
+        <xsl:choose>
+          <xsl:when test="$journal = 'pgen'">
+            <xsl:text>http://www.plosgenetics.org/</xsl:text>
+          </xsl:when>
+          <xsl:when test="$journal = 'pone'">
+            <xsl:text>http://www.plosone.org/</xsl:text>
+          </xsl:when>
+          <xsl:when test="$journal = 'pbio'">
+            <xsl:text>http://www.plosbiology.org/</xsl:text>
+          </xsl:when>
+          <xsl:when test="$journal = 'pcbi'">
+            <xsl:text>http://www.ploscompbiol.org/</xsl:text>
+          </xsl:when>
+          <xsl:when test="$journal = 'ppat'">
+            <xsl:text>http://www.plospathogens.org/</xsl:text>
+          </xsl:when>
+          <xsl:when test="$journal = 'pmed'">
+            <xsl:text>http://www.plosmedicine.org/</xsl:text>
+          </xsl:when>
+          <xsl:when test="$journal = 'pntd'">
+            <xsl:text>http://www.plosntds.org/</xsl:text>
+          </xsl:when>
+        </xsl:choose>
+        <xsl:value-of
+          select="concat('article/fetchSingleRepresentation.action?uri=',
+                         $href)"/>
+      </xsl:attribute>
+      <b><xsl:apply-templates select="@*|node()"/></b>
+    </a>
+  </xsl:template>
+
+  <!--OPSContent.acknowledgments-->
+  <xsl:template match="ack" mode="acknowledgments">
+    <div>
+      <xsl:apply-templates select="@*"/>
+      <xsl:attribute name="id">acknowledgments</xsl:attribute>
+      <h2>Acknowledgments</h2>
+      <xsl:apply-templates select="node()"/>
+    </div>
+  </xsl:template>
+
+  <!--OPSContent.authorContributions-->
+  <xsl:template match="fn" mode="contributions">
+    <div>
+      <xsl:copy-of select="@*[name() != 'fn-type']"/>
+      <xsl:attribute name="id">contributions</xsl:attribute>
+      <h2>Author Contibutions</h2>
+      <xsl:apply-templates select="node()"/>
+    </div>
+  </xsl:template>
+
+  <!--OPSContent.divTitleFormat, the sections and other divisions nested
+      from the body each take as their heading the first title within them
+      that the other conversions leave a title, and which no enclosing
+      division has taken. Headings are h2 for the outermost, empty titles
+      are removed.-->
+  <xsl:template match="/main//title" priority="1">
+    <xsl:variable name="depth">
+      <xsl:call-template name="heading">
+        <xsl:with-param name="division"
+          select="ancestor::*[parent::body/parent::main]
+                  [self::sec or self::supplementary-material or
+                   self::ref-list] |
+                  ancestor::*[parent::main][self::ack or self::fn]"/>
+      </xsl:call-template>
+    </xsl:variable>
+    <xsl:choose>
+      <xsl:when test="not(string($depth))">
+        <xsl:call-template name="copy"/>
+      </xsl:when>
+      <xsl:when test="not(node())">
+        <xsl:call-template name="split"/>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:element name="h{$depth + 2}">
+          <xsl:apply-templates select="@*|node()"/>
+        </xsl:element>
+      </xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <!--The depth of the division whose heading is the current title, if any,
+      from division and those within it-->
+  <xsl:template name="heading">
+    <xsl:param name="division"/>
+    <xsl:param name="depth" select="0"/>
+    <xsl:param name="taken" select="/.."/>
+    <xsl:variable name="first"
+      select="($division//title[not(ancestor::fig or ancestor::table-wrap or
+                                    ancestor::boxed-text or ancestor::ref or
+                                    ancestor::inline-formula or
+                                    ancestor::disp-formula or
+                                    parent::list)]
+                               [not(parent::ref-list and
+                                    not(preceding-sibling::title))]
+                               [count(. | $taken) != count($taken)])[1]"/>
+    <xsl:choose>
+      <xsl:when test="not($division) or not($first)"/>
+      <xsl:when test="count($first | current()) = 1">
+        <xsl:value-of select="$depth"/>
+      </xsl:when>
+      <xsl:otherwise>
+        <xsl:call-template name="heading">
+          <xsl:with-param name="division"
+            select="current()/ancestor::*[count(.. | $division) = 1]
+                    [self::sec or self::supplementary-material or
+                     self::ref-list or
+                     self::caption[parent::supplementary-material]]"/>
+          <xsl:with-param name="depth" select="$depth + 1"/>
+          <xsl:with-param name="taken" select="$taken | $first"/>
+        </xsl:call-template>
+      </xsl:otherwise>
+    </xsl:choose>
+  </xsl:template>
+
+  <!--OPSContent.abstractHandler-->
+  <xsl:template match="/abstract//title">
+    <h3><xsl:apply-templates select="@*|node()"/></h3>
+  </xsl:template>
+
+  <xsl:template match="/abstract//sec" priority="1">
+    <div>
+      <xsl:copy-of select="@*"/>
+      <xsl:apply-templates select="node()"/>
+    </div>
+  </xsl:template>
+
+</xsl:stylesheet>
+'''
+
+#The compiled stylesheet, created on first use
+stylesheet = None
+
+
+def getTransform():
+    '''Returns the compiled stylesheet, compiling it if necessary'''
+    global stylesheet
+    if stylesheet is None:
+        stylesheet = etree.XSLT(etree.XML(STYLESHEET))
+    return stylesheet
+
+
+def clarkName(name, uri, prefixes):
+    '''Returns the lxml {uri}local name of the minidom Element or Attr name
+    in the namespace uri, recording its prefix in prefixes'''
+    if name == 'xmlns' or name.startswith('xmlns:'):
+        return '{%s}%s' % (DECLARATION_NAMESPACE, name.split(':')[-1])
+    if ':' in name:
+        prefix, local = name.split(':', 1)
+    else:
+        prefix, local = None, name
+    if prefix == 'xml':
+        uri = XML_NAMESPACE
+    elif prefix and not uri:
+        uri = UNDECLARED_NAMESPACE + prefix
+    if not uri:
+        return name
+    prefixes.setdefault(uri, prefix)
+    return '{%s}%s' % (uri, local)
+
+
+def qualifiedName(name, prefixes):
+    '''Converts an lxml {uri}local name to a prefix:local name'''
+    if name[0] != '{':
+        return unicode(name)
+    uri, local = name[1:].split('}', 1)
+    if uri == DECLARATION_NAMESPACE:
+        if local == 'xmlns':
+            return u'xmlns'
+        return u'xmlns:' + local
+    prefix = prefixes.get(uri)
+    if not prefix:
+        return local
+    return u'{0}:{1}'.format(prefix, local)
+
+
+def appendText(parent, text):
+    '''Appends text to the lxml element parent, after its last child'''
+    if len(parent):
+        parent[-1].tail = (parent[-1].tail or '') + text
+    else:
+        parent.text = (parent.text or '') + text
+
+
+def toTree(name, nodes, prefixes):
+    '''Returns an lxml element name holding copies of the minidom nodes and
+    of all beneath them. prefixes maps the namespace URIs of the copies to
+    their prefixes in the nodes.'''
+    root = etree.Element(name)
+    #Iterative, as article trees may be deeper than the recursion limit. Each
+    #entry holds the children still to be copied, their copied parent and
+    #whether the last copied was text.
+    stack = [[iter(nodes), root, False]]
+    while stack:
+        entry = stack[-1]
+        children, parent, after_text = entry
+        node = next(children, None)
+        if node is None:
+            stack.pop()
+            continue
+        entry[2] = node.nodeType == node.TEXT_NODE
+        if node.nodeType == node.TEXT_NODE:
+            if after_text:
+                parent.append(etree.ProcessingInstruction(SPLIT))
+            if node.data:
+                appendText(parent, node.data)
+            else:
+                parent.append(etree.ProcessingInstruction(EMPTY))
+        elif node.nodeType == node.ELEMENT_NODE:
+            #tagName, rather than nodeName, is the one kept by renames
+            element = etree.SubElement(parent, clarkName(node.tagName,
+                                                         node.namespaceURI,
+                                                         prefixes))
+            for attribute in node.attributes.values():
+                element.set(clarkName(attribute.name, attribute.namespaceURI,
+                                      prefixes), attribute.value)
+            stack.append([iter(node.childNodes), element, False])
+        elif node.nodeType == node.COMMENT_NODE:
+            parent.append(etree.Comment(node.data))
+        elif node.nodeType == node.PROCESSING_INSTRUCTION_NODE:
+            parent.append(etree.ProcessingInstruction(node.target, node.data))
+    return root
+
+
+def build(root, parent, prefixes):
+    '''Appends a minidom copy of the lxml element root to parent, a Document
+    or Element. prefixes maps namespace URIs to prefixes.'''
+    document = parent.ownerDocument or parent
+    #Iterative, as article trees may be deeper than the recursion limit.
+    #lxml gives ASCII text as str, minidom always gives unicode.
+    stack = [(root, parent)]
+    while stack:
+        elem, parent = stack.pop()
+        if isinstance(elem, basestring):  # The tail text of a node
+            parent.appendChild(document.createTextNode(unicode(elem)))
+            continue
+        if elem.tag is etree.Comment:
+            comment = document.createComment(unicode(elem.text or ''))
+            parent.appendChild(comment)
+            continue
+        if elem.tag is etree.ProcessingInstruction:
+            if elem.target == EMPTY:
+                parent.appendChild(document.createTextNode(u''))
+            elif elem.target != SPLIT:
+                parent.appendChild(document.createProcessingInstruction(
+                    unicode(elem.target), unicode(elem.text or '')))
+            continue
+        node = document.createElement(qualifiedName(elem.tag, prefixes))
+        for name, value in elem.items():
+            node.setAttribute(qualifiedName(name, prefixes), unicode(value))
+        parent.appendChild(node)
+        if elem.text:
+            node.appendChild(document.createTextNode(unicode(elem.text)))
+        #Pushed in reverse so that children are built in document order
+        for child in reversed(list(elem)):
+            if child.tail:
+                stack.append((child.tail, node))
+            stack.append((child, node))
+
+
+def transform(name, nodes, targets, jid, images, site):
+    '''Runs the stylesheet upon copies of the minidom nodes, held by an
+    element name: 'main' for the <body> of an article followed by its <ack>
+    and author contributions <fn>, if any, 'synopsis' for the content of the
+    synopsis body or 'biblio' for the <ref-list>. The content of each part of
+    the result is appended to the minidom Element targets[part]; the parts
+    are 'main' and 'tables' for main, otherwise name. jid is the journal id
+    of the article, images maps the names of its image files, sans extension,
+    to their paths relative to OPS and site is the web site of its journal.'''
+    prefixes = {XML_NAMESPACE: 'xml'}
+    tree = toTree(name, nodes, prefixes)
+    table = u''.join(u'|{0}={1}'.format(image, path)
+                     for image, path in images.items()) + u'|'
+    strparam = etree.XSLT.strparam
+    result = getTransform()(tree, jid = strparam(jid),
+                            images = strparam(table), site = strparam(site))
+    for part in result.getroot():
+        target = targets.get(part.tag)
+        if target is None:
+            continue
+        document = target.ownerDocument
+        if part.text:
+            target.appendChild(document.createTextNode(unicode(part.text)))
+        for child in part:
+            build(child, target, prefixes)
+            if child.tail:
+                tail = document.createTextNode(unicode(child.tail))
+                target.appendChild(tail)